@@ -0,0 +1,335 @@
+"""
+Read-only HTTP API for aggregate slices of the published responses
+
+    GET /api/daily       sentiment per day
+    GET /api/hospitals   sentiment per hospital, most negative first
+    GET /api/summary     totals and distinct clinicians
+
+Every endpoint takes start and end (YYYY-MM-DD, inclusive) and any number
+of hospital parameters to narrow the slice, e.g.
+
+    /api/daily?start=2020-05-01&end=2020-05-31&hospital=Lewisham+Hospital
+
+Answers are JSON, or CSV with format=csv or Accept: text/csv, and come
+from the rollup cube of the published version, never the raw responses.
+Tables are paged with limit and offset; JSON pages link to the next one
+and CSV pages give it in a Link header. Each answer is cached by data
+version and query, carries an ETag so clients can revalidate with
+If-None-Match for free, and is gzipped for clients that accept it.
+
+    python api.py --port 8001
+"""
+import argparse
+import collections
+import datetime
+import gzip
+import hashlib
+import http.server
+import io
+import logging
+import os
+import socketserver
+import threading
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+
+import rollups
+import sketches
+import store
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+PORT = int(os.environ.get('API_PORT', 8001))
+PREFIX = '/api'
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+CACHE_ENTRIES = 256  # Encoded answers kept per process
+MIN_GZIP_BYTES = 1024
+MAX_AGE = 60  # Seconds clients may reuse an answer before revalidating
+COUNT_COLUMNS = ['sufficient', 'insufficient', 'total']
+UNVERSIONED = 'unversioned'  # Version of data from before versioned ingests
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(ValueError):
+    pass
+
+
+Query = collections.namedtuple('Query', ['start', 'end', 'hospitals', 'limit',
+                                         'offset', 'format'])
+
+
+class Dataset(object):
+    """The rollup cube and clinician sketches of one published version."""
+
+    def __init__(self, version, rollup_location, store_location):
+        self.version = version
+        self.cube = rollups.load(rollups.CUBE, rollup_location)
+        self.day_index = store.DayIndex(self.cube['day_month'])
+        self.clinicians = sketches.Clinicians(sketches.load(rollup_location))
+        # Sketches are keyed by the IDs of the version's own dimension
+        self.hospital_index = store.dimension(store_location)
+        if version != UNVERSIONED:
+            store.require(version)
+
+    def slice(self, query):
+        cube = self.cube.iloc[self.day_index.slice(query.start, query.end)]
+        if query.hospitals:
+            cube = cube[cube['hospital'].isin(query.hospitals)]
+        return cube
+
+    def daily(self, query):
+        return rollups.daily(self.slice(query)).rename(columns={'day_month': 'day'})
+
+    def hospitals(self, query):
+        return rollups.by_hospital(self.slice(query))
+
+    def summary(self, query):
+        cube = self.slice(query)
+        counts = cube[COUNT_COLUMNS].sum()
+        hospital_ids = None
+        if query.hospitals:
+            ids = self.hospital_index.names.get_indexer(query.hospitals)
+            hospital_ids = ids[ids >= 0]
+        total = int(counts['total'])
+        return {
+            'start': cube['day_month'].min() if len(cube) else None,
+            'end': cube['day_month'].max() if len(cube) else None,
+            'hospitals': int(cube['hospital'].nunique()),
+            'sufficient': int(counts['sufficient']),
+            'insufficient': int(counts['insufficient']),
+            'total': total,
+            'proportion-positive': 100.0 * counts['sufficient'] / total if total else None,
+            'proportion-negative': 100.0 * counts['insufficient'] / total if total else None,
+            'clinicians': self.clinicians.count(query.start, query.end, hospital_ids),
+            'clinicians_standard_error': sketches.STANDARD_ERROR,
+        }
+
+
+class QueryAPI(object):
+    """Answers queries against the published version, caching encoded answers."""
+
+    TABLES = {'daily': Dataset.daily, 'hospitals': Dataset.hospitals}
+
+    def __init__(self, cache_entries=CACHE_ENTRIES):
+        self.cache_entries = cache_entries
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.dataset = None
+
+    def etag(self, endpoint, params, accept=''):
+        """
+        Return the cache key and ETag of a query, without answering it.
+
+        Raises KeyError for an unknown endpoint and QueryError for bad
+        parameters.
+        """
+        if endpoint not in self.TABLES and endpoint != 'summary':
+            raise KeyError(endpoint)
+        query = parse_query(params, accept)
+        manifest = store.current()
+        if manifest is None:  # Nothing published by a versioned ingest yet
+            key = (UNVERSIONED, (rollups.ROLLUP_LOCATION, store.STORE_LOCATION),
+                   endpoint, query)
+        else:
+            key = (manifest['version'], (manifest['rollups'], manifest['store']),
+                   endpoint, query)
+        # Weak, as the gzipped and identity bodies share it
+        return key, 'W/"%s-%s"' % (key[0], hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16])
+
+    def answer(self, key):
+        """
+        Return (content type, body, gzipped body or None, extra headers)
+        for a key from etag.
+        """
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        version, locations, endpoint, query = key
+        dataset = self._dataset(version, locations)
+        if endpoint == 'summary':
+            body = json.dumps(dict(dataset.summary(query), version=version)).encode('utf-8')
+            content_type, headers = 'application/json', {}
+        else:
+            table = self.TABLES[endpoint](dataset, query)
+            content_type, body, headers = _page(table, endpoint, query, version)
+        answer = (content_type, body,
+                  _gzipped(body) if len(body) >= MIN_GZIP_BYTES else None, headers)
+
+        with self.lock:
+            self.cache[key] = answer
+            while len(self.cache) > self.cache_entries:
+                self.cache.popitem(last=False)
+        return answer
+
+    def _dataset(self, version, locations):
+        dataset = self.dataset
+        if dataset is None or dataset.version != version:
+            dataset = self.dataset = Dataset(version, *locations)
+        return dataset
+
+
+def parse_query(params, accept=''):
+    """Validate query parameters (a dict of lists) into a hashable Query."""
+    def one(name, default=None):
+        values = params.get(name)
+        return values[-1] if values else default
+
+    start, end = _day(one('start'), 'start'), _day(one('end'), 'end')
+    try:
+        limit = int(one('limit', DEFAULT_LIMIT))
+        offset = int(one('offset', 0))
+    except ValueError:
+        raise QueryError('limit and offset must be integers')
+    if not 0 < limit <= MAX_LIMIT or offset < 0:
+        raise QueryError('limit must be 1 to %d and offset at least 0' % MAX_LIMIT)
+    fmt = one('format') or ('csv' if 'text/csv' in accept else 'json')
+    if fmt not in ('json', 'csv'):
+        raise QueryError('format must be json or csv')
+    names = tuple(sorted(set(params.get('hospital', []))))
+    return Query(start, end, names, limit, offset, fmt)
+
+
+class APIServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api=None, port=PORT, host=''):
+        http.server.HTTPServer.__init__(self, (host, port), APIHandler)
+        self.api = api or QueryAPI()
+
+
+class APIHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if not url.path.startswith(PREFIX + '/'):
+            return self._error(404, 'Unknown endpoint')
+        endpoint = url.path[len(PREFIX) + 1:].strip('/')
+        params = urllib.parse.parse_qs(url.query)
+        api = self.server.api
+        try:
+            key, etag = api.etag(endpoint, params, self.headers.get('Accept', ''))
+        except KeyError:
+            return self._error(404, 'Unknown endpoint, use daily, hospitals or summary')
+        except QueryError as e:
+            return self._error(400, str(e))
+
+        headers = {'ETag': etag, 'Cache-Control': 'public, max-age=%d' % MAX_AGE,
+                   'Vary': 'Accept, Accept-Encoding'}
+        if _etag_matches(self.headers.get('If-None-Match', ''), etag):
+            # The ETag is known before the query runs, so this costs nothing
+            return self._send(304, b'', None, headers)
+
+        try:
+            content_type, body, gzipped, extra = api.answer(key)
+        except store.MissingVersion as e:
+            logger.error('%s', e)
+            return self._error(503, 'The data changed while it was being read, try again')
+        headers.update(extra)
+        if gzipped is not None and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzipped
+            headers['Content-Encoding'] = 'gzip'
+        return self._send(200, body, content_type, headers)
+
+    def _error(self, status, message):
+        body = json.dumps({'error': message}).encode('utf-8')
+        self._send(status, body, 'application/json')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _page(table, endpoint, query, version):
+    # Encodes one page of a table, with a link to the next page if any
+    page = table.iloc[query.offset:query.offset + query.limit]
+    more = query.offset + query.limit < len(table)
+    params = [('start', query.start), ('end', query.end)] + \
+        [('hospital', name) for name in query.hospitals] + \
+        [('limit', query.limit), ('offset', query.offset + query.limit),
+         ('format', query.format)]
+    next_url = '%s/%s?%s' % (PREFIX, endpoint, urllib.parse.urlencode(
+        [(k, v) for k, v in params if v is not None])) if more else None
+    headers = {'X-Total-Count': str(len(table))}
+
+    if query.format == 'csv':
+        if next_url:
+            headers['Link'] = '<%s>; rel="next"' % next_url
+        out = io.StringIO()
+        page.to_csv(out, index=False)
+        return 'text/csv; charset=utf-8', out.getvalue().encode('utf-8'), headers
+
+    page = page.astype(object).where(page.notna(), None)
+    body = json.dumps({'version': version, 'total': len(table),
+                       'offset': query.offset, 'limit': query.limit,
+                       'next': next_url, 'rows': page.to_dict('records')},
+                      default=_json_default)
+    return 'application/json', body.encode('utf-8'), headers
+
+
+def _etag_matches(if_none_match, etag):
+    # Weak comparison against a comma-separated list of tags, or *
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    if '*' in tags:
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return any((tag[2:] if tag.startswith('W/') else tag) == opaque for tag in tags)
+
+
+def _day(value, name):
+    if value is None:
+        return None
+    try:
+        return datetime.datetime.strptime(value, store.DAY_FORMAT).date().isoformat()
+    except ValueError:
+        raise QueryError('%s must be a date as YYYY-MM-DD' % name)
+
+
+def _gzipped(body):
+    out = io.BytesIO()
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6, mtime=0) as f:
+        f.write(body)
+    return out.getvalue()
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (pd.Timestamp, datetime.date)):
+        return value.isoformat()
+    raise TypeError(repr(value))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve aggregate PPE sentiment as JSON and CSV')
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    server = APIServer(port=args.port)
+    logger.info('Serving %s on port %d', PREFIX, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
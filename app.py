@@ -1,23 +1,155 @@
+import time
+_script_started = time.perf_counter()  # Before the imports, for metrics.startup
+
 import os
 import numpy as np
 import pandas as pd
-import pydeck as pdk
 import streamlit as st
-import seaborn as sns
+import charts
+import metrics
+import rollups
+import sketches
+import snapshot
+import spatial
+import store
 from datetime import date
 
-sns.set(style="darkgrid")
+# Charts are drawn at ingest and pydeck is imported when the map is drawn,
+# so a fresh process only pays for what the first page shows
+metrics.startup.add('imports', time.perf_counter() - _script_started)
 
-MERGED_DATA_LOCATION = './data/ppe-merged-responses.csv'
+ROLLUP_LOCATION = rollups.ROLLUP_LOCATION
+CHART_LOCATION = charts.CHART_LOCATION
 MAPBOX_API_KEY = os.environ.get('MAPBOX_TOKEN')
 LAST_UPDATE = date.today().strftime("%B %d, %Y")
 
 
-@st.cache()
-def load_data():
-    return pd.read_csv(MERGED_DATA_LOCATION,
-                       index_col='time',
-                       parse_dates=['time'])
+def load_rollup(name):
+    """
+    Return a rollup table and its day index for the published version
+
+    One copy is held per process and shared by every session; render
+    functions must treat it as read-only rather than copy it. Checking for
+    a new version is a single stat of the manifest, and a new version
+    replaces the cached one on the next rerun.
+    """
+    contents = load_snapshot()
+    if contents is not None and name in contents['rollups']:
+        return contents['rollups'][name]
+    _, rollup_root, _ = published_locations()
+    return _load_rollup(name, store.version(), rollup_root)
+
+
+def load_clinicians():
+    """Distinct clinician counts (sketches.Clinicians) for the published version."""
+    contents = load_snapshot()
+    if contents is not None:
+        return contents['clinicians']
+    _, rollup_root, _ = published_locations()
+    return _load_clinicians(store.version(), rollup_root)
+
+
+def load_snapshot():
+    """
+    The published version's snapshot (see snapshot.py), or None
+
+    Versions published before ingests wrote snapshots, or whose snapshot
+    can't be read, are loaded from the store and rollups instead.
+    """
+    manifest = store.current()
+    if manifest is None or not manifest.get('snapshot'):
+        return None
+    return _load_snapshot(manifest['version'], manifest['snapshot'])
+
+
+def load_chart(name):
+    """PNG bytes of a chart drawn at ingest, or None if it hasn't been drawn."""
+    _, _, chart_root = published_locations()
+    return _load_chart(name, store.version(), chart_root)
+
+
+def published_locations():
+    """Store, rollup and chart directories of the published version."""
+    manifest = store.current()
+    if manifest is None:  # Nothing published by a versioned ingest yet
+        return store.STORE_LOCATION, ROLLUP_LOCATION, CHART_LOCATION
+    # Versions published before charts were drawn at ingest have none
+    return manifest['store'], manifest['rollups'], \
+        manifest.get('charts', CHART_LOCATION)
+
+
+# Each loader checks its version still exists once it has read it, so a
+# version pruned underneath it raises rather than being cached as empty
+
+
+@st.cache(allow_output_mutation=True, max_entries=1)
+def _load_snapshot(version, location):
+    with metrics.span('app', 'read_snapshot'):
+        contents = snapshot.load(location)
+    store.require(version)
+    return contents
+
+
+@st.cache(allow_output_mutation=True, max_entries=8)
+def _load_rollup(name, version, location):
+    # Only runs when the version changes, so times a real read
+    with metrics.span('app', 'read_rollup'):
+        rollup = snapshot.read_rollup(name, location)
+    store.require(version)
+    return rollup
+
+
+@st.cache(allow_output_mutation=True, max_entries=1)
+def _load_clinicians(version, location):
+    clinicians = sketches.Clinicians(sketches.load(location))
+    store.require(version)
+    return clinicians
+
+
+@st.cache(allow_output_mutation=True, max_entries=16)
+def _load_chart(name, version, location):
+    path = charts.chart_path(name, location)
+    image = None
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            image = f.read()
+    store.require(version)
+    return image
+
+
+def render_chart(name, start=None, end=None, width=800):
+    """
+    Show a chart drawn at ingest, or draw it for the selected days
+
+    Charts at ingest cover every day, so a chart of the daily or cell
+    rollup is drawn again from the selected rows when the range is narrower.
+    """
+    table, day_index = load_rollup(charts.SOURCES[name])
+    if start is not None and day_index is not None and \
+            (start, end) != (day_index.first, day_index.last):
+        st.image(_draw_chart(name, store.version(), start, end), width=width)
+        return
+    image = load_chart(name)
+    if image is None:
+        st.info("This chart will be drawn by the next ingest")
+        return
+    st.image(image, width=width)
+
+
+@st.cache(max_entries=32)
+def _draw_chart(name, version, start, end):
+    table, day_index = load_rollup(charts.SOURCES[name])
+    with metrics.span('app', 'draw_chart'):
+        image = charts.png(name, select_days(table, day_index, start, end))
+    store.require(version)
+    return image
+
+
+def select_days(table, day_index, start, end):
+    """Rows of a table between start and end, inclusive, without scanning it."""
+    if day_index is None:
+        return table
+    return table.iloc[day_index.slice(start, end)]
 
 
 def render_sidebar():
@@ -45,7 +177,7 @@ def render_sidebar():
         Data analysis and presentation using:
         
         * [Streamlit](https://www.streamlit.io/)
-        * [Exploratory](https://exploratory.io/)
+        * [Matplotlib](https://matplotlib.org/) and [Seaborn](https://seaborn.pydata.org/)
         """
     )
 
@@ -61,6 +193,16 @@ def render_sidebar():
     )
 
 
+def render_date_range(day_index):
+    if day_index is None or not len(day_index):  # Nothing ingested yet
+        return None, None
+    days = [pd.Timestamp(d).date() for d in day_index.days]
+    first, last = st.sidebar.slider(
+        "Days to include", 0, len(days) - 1, (0, len(days) - 1))
+    st.sidebar.markdown(f"Showing responses from **{days[first]}** to **{days[last]}**")
+    return days[first], days[last]
+
+
 def render_content_header():
     st.title("The Sentiment of UK Clinicians on Personal Protective Equipment Supply between April 22nd and June 24th, 2020")
     st.markdown("""Author: Dr Edward Wallitt MBBS BSc - Product Lead for the Induction App""")
@@ -98,11 +240,15 @@ def render_how_it_works():
              width=300)
 
 
-def render_initial_analysis(data):
+def render_initial_analysis(by_day, start=None, end=None):
     st.header("UK PPE Supply and Availability Sentiment Responses")
     st.subheader("Do you feel you and your team have enough PPE today?")
-    scoped_data = data.copy(deep=True)
-    st.info("n = " + str(len(scoped_data)))
+    # The rollup has no columns until the first ingest writes it
+    st.info("n = " + str(int(by_day['total'].sum()) if len(by_day) else 0))
+    clinicians = load_clinicians().count(start, end)
+    st.markdown(
+        f"Responses came from about **{clinicians:,}** different clinicians "
+        f"(estimated, standard error {sketches.STANDARD_ERROR:.1%})")
 
     #sufficient_supply_df = scoped_data[scoped_data['sufficient-supply'] == True]
     #insufficient_supply_df = scoped_data[scoped_data['sufficient-supply'] == False]
@@ -114,33 +260,15 @@ def render_initial_analysis(data):
     #)
 
     # st.bar_chart(data, use_container_width=True)
-    st.markdown(
-        """
-        <iframe src="https://exploratory.io/viz/CNw7BmT9hR/Total-PPE-Responses-moG6tLn4zy?embed=true" width="500" height="375" frameborder="0"></iframe>
-        <hr />
-        """
-    , unsafe_allow_html=True)
+    render_chart(charts.TOTALS, start, end, width=500)
+    render_chart(charts.TREND, start, end)
 
-    st.markdown(
-        """
-        <iframe
-        src = "https://exploratory.io/viz/CNw7BmT9hR/Overall-Trend-in-PPE-Supply-Sentiment-bFT1xqn4Qp?embed=true"
-        width = "800"
-        height = "600"
-        frameborder = "0" > < / iframe >
-        <hr />
-        """
-    , unsafe_allow_html=True)
 
 
-
-# @st.cache(persist=True, suppress_st_warning=True)
-def render_results_map(data):
-    # scoped_data = data.copy(deep=True)
-    # midpoint = (np.average(scoped_data["lat"]), np.average(scoped_data["lon"]))
-
-    # sufficient_supply_df = scoped_data[scoped_data['sufficient-supply'] == 1]
-    # insufficient_supply_df = scoped_data[scoped_data['sufficient-supply'] == 0]
+def render_results_map(start=None, end=None):
+    # Cells are binned per day at ingest, see spatial.py
+    cells, day_index = load_rollup(rollups.CELLS)
+    cells = select_days(cells, day_index, start, end)
 
     st.header("PPE Supply Sentiment Map")
 
@@ -151,68 +279,66 @@ def render_results_map(data):
         more confidence we can have in the shade of color.
 
         NOTE: This data is cumulative, and shows the totals gathered between 22nd April and 24th June 2020. If you wish to 
-        filter by day you can enter a date below.
+        filter by day you can narrow the days to include in the sidebar.
         """
     )
 
-    st.markdown(
-        """
-        <iframe src="https://exploratory.io/viz/CNw7BmT9hR/Heatmap-of-Negative-Sentment-ZKX4OQh3Nj?embed=true" width="800" height="600" frameborder="0"></iframe>
-        """
-    , unsafe_allow_html=True)
-
-
-    # if st.checkbox('Filter by day'):
-    #     day_to_filter = st.date_input('Date')
-    #     insufficient_supply_df = insufficient_supply_df[insufficient_supply_df.index.date == day_to_filter]
-    #     st.subheader(f'PPE supply sentiment on {day_to_filter}')
-
-    # st.pydeck_chart(pdk.Deck(
-    #     map_style="mapbox://styles/mapbox/light-v9",
-    #     mapbox_key=MAPBOX_API_KEY,
-    #     initial_view_state={
-    #         "latitude": midpoint[0],
-    #         "longitude": midpoint[1],
-    #         "zoom": 5.3,
-    #         "pitch": 40,
-    #         "bearing": -22.1,
-    #         "elevation_scale": 6
-    #     },
-    #     layers=[
-    #         pdk.Layer(
-    #             "HexagonLayer",
-    #             data=insufficient_supply_df,
-    #             get_position=["lon", "lat"],
-    #             elevation_scale=60,
-    #             pickable=True,
-    #             extruded=True,
-    #             coverage=0.8,
-    #             auto_highlight=True,
-    #             radius=1500
-    #         )
-    #     ],
-    # ))
-
-
-def render_supply_over_time(data):
-    copy = data.copy()
-    by_daily_supply = copy.groupby(['day_month', 'sufficient-supply']).size().unstack().reset_index()
-    by_daily_supply['total'] = (by_daily_supply[True]) + (by_daily_supply[False])
-    by_daily_supply['proportion-negative'] = (by_daily_supply[False] / by_daily_supply['total']) * 100
-    by_daily_supply['proportion-positive'] = (by_daily_supply[True] / by_daily_supply['total']) * 100
+    render_chart(charts.HEATMAP, start, end, width=600)
+
+    if start is not None and start == end:
+        st.subheader(f'PPE supply sentiment on {start}')
+    elif start is not None:
+        st.subheader(f'PPE supply sentiment from {start} to {end}')
+    if cells.empty:
+        st.info("No responses for this selection")
+        return
+    cells = cells.groupby(['q', 'r', 'lat', 'lon'])[['sufficient', 'insufficient', 'total']] \
+        .sum().reset_index()
+
+    insufficient_cells = cells[cells['insufficient'] > 0]
+    if insufficient_cells.empty:
+        st.info("No negative responses for this selection")
+        return
+    midpoint = (np.average(insufficient_cells["lat"]), np.average(insufficient_cells["lon"]))
+
+    import pydeck as pdk  # Only needed here, and slow to import
+
+    st.pydeck_chart(pdk.Deck(
+        map_style="mapbox://styles/mapbox/light-v9",
+        mapbox_key=MAPBOX_API_KEY,
+        initial_view_state={
+            "latitude": midpoint[0],
+            "longitude": midpoint[1],
+            "zoom": 5.3,
+            "pitch": 40,
+            "bearing": -22.1,
+            "elevation_scale": 6
+        },
+        layers=[
+            pdk.Layer(
+                "ColumnLayer",
+                data=insufficient_cells[['lat', 'lon', 'insufficient', 'total']],
+                get_position=["lon", "lat"],
+                get_elevation="insufficient",
+                elevation_scale=60,
+                disk_resolution=6,
+                radius=spatial.CELL_SIZE_KM * 1000 * 0.8,
+                pickable=True,
+                extruded=True,
+                auto_highlight=True
+            )
+        ],
+    ))
+
+
+def render_supply_over_time(start=None, end=None):
+    by_daily_supply, day_index = load_rollup(rollups.DAILY)
+    by_daily_supply = select_days(by_daily_supply, day_index, start, end)
 
     # st.info(f"Average number of clinicians reporting per day: {round(by_daily_supply['total'].mean())}")
 
     #st.subheader('Trend in PPE sentiment over time')
-    st.markdown(
-    """
-        <iframe
-        src = "https://exploratory.io/viz/CNw7BmT9hR/PPE-Response-Sentiment-Split-Wud7CIF5gl?embed=true"
-        width = "800"
-        height = "600"
-        frameborder = "0" ></iframe>
-    """, unsafe_allow_html=True
-    )
+    render_chart(charts.SENTIMENT, start, end)
 
     # ax = sns.lineplot(x="day_month", y='proportion-negative', data=by_daily_supply)
     # ax = sns.lineplot(x="day_month", y='proportion-positive', data=by_daily_supply)
@@ -237,26 +363,36 @@ def render_worst_performers():
     st.markdown(
         """
         This figure shows in ascending order the bottom 170 hospital were positive sentiment towards PPE supply is being reported.
+
+        NOTE: The ranking is cumulative over every day, whatever days are selected in the sidebar.
         """
     )
     # st.image('./static/images/negative_sentiment_performers.png', caption='Cumulative % Positive PPE Sentiment by Hospital Descending (n = 170)', use_column_width=True)
 
-    st.markdown(
-        """
-        <iframe src="https://exploratory.io/viz/CNw7BmT9hR/PPE-Supply-Sentiment-by-Hospital-QKu9dYd9al?embed=true" width="800" height="600" frameborder="0"></iframe>
-        """
-    , unsafe_allow_html=True)
+    render_chart(charts.RANKING)
 
 def main():
-    data = load_data()
-    render_sidebar()
-    render_content_header()
-    render_initial_analysis(data)
-    render_supply_over_time(data)
-    render_results_map(data)
-    render_worst_performers()
-
-    render_how_it_works()
+    metrics.serve()
+    with metrics.span('app', 'run'):
+        with metrics.span('app', 'load_data'), metrics.startup.phase('load_data'):
+            by_day, day_index = load_rollup(rollups.DAILY)
+        render_sidebar()
+        start, end = render_date_range(day_index)
+        render_content_header()
+        with metrics.span('app', 'render_initial_analysis'):
+            render_initial_analysis(select_days(by_day, day_index, start, end), start, end)
+        with metrics.span('app', 'render_supply_over_time'):
+            render_supply_over_time(start, end)
+        with metrics.span('app', 'render_results_map'):
+            render_results_map(start, end)
+        render_worst_performers()
+
+        render_how_it_works()
+
+    # Only the first run in each process is recorded
+    metrics.startup.add('first_render', time.perf_counter() - _script_started,
+                        version=store.version(), snapshot=load_snapshot() is not None)
+    metrics.startup.finish()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+"""
+Benchmarks for the ingest pipeline and dashboard aggregations
+
+* generate.py writes synthetic ppe-survey-1 exports
+* server.py emulates Mixpanel's export endpoint on localhost
+* run.py times each stage and compares runs
+
+Run from the repository root, e.g. python -m benchmarks.run --events 100000
+"""
@@ -0,0 +1,145 @@
+"""
+Synthetic ppe-survey-1 exports in Mixpanel's NDJSON export format
+
+Each day is generated independently from a seed derived from the date, so
+any day range can be reproduced without generating the days before it and
+the stand-in server can serve shards on demand.
+
+    python -m benchmarks.generate --events 1000000 --out export.ndjson
+"""
+import argparse
+import calendar
+import datetime
+import random
+import sys
+import uuid
+
+import pandas as pd
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+HOSPITALS_LOCATION = './data/hospital_locations.csv'
+START_DAY = datetime.date(2020, 4, 22)
+DAYS = 64  # 22 April to 24 June 2020, the collection period
+EVENT = 'ppe-survey-1'
+
+GB_SHARE = 0.9
+UNMATCHED_SHARE = 0.05  # Test spaces, departments and misspellings
+REPEAT_SHARE = 0.15  # Responses resubmitted minutes after the first
+CLINICIANS_PER_EVENT = 0.05
+OTHER_COUNTRIES = ['IE', 'US', 'ZA', 'AU', 'IN']
+UNMATCHED_SUFFIXES = [' - Emergency Department', ' - ICU', ' ED', ' (main)']
+TEST_SPACES = ['INHC Triage Space', 'NHSX TeamSpace', 'Test Space']
+
+
+class Generator(object):
+    """Reproducible daily event batches for a total of events."""
+
+    def __init__(self, events, days=DAYS, start=START_DAY, seed=0,
+                 hospitals_location=HOSPITALS_LOCATION):
+        self.events = events
+        self.days = days
+        self.start = start
+        self.seed = seed
+
+        sites = pd.read_csv(hospitals_location)
+        self.hospitals = list(sites['hospital'])
+        self.cum_weights = list(sites['count'].clip(lower=1).cumsum())
+        # Some hospitals are consistently more negative than others
+        rng = random.Random(seed)
+        self.positive_rate = {h: rng.uniform(0.3, 0.9) for h in self.hospitals}
+        self.clinicians = max(1, int(events * CLINICIANS_PER_EVENT))
+
+    def day_range(self):
+        return [self.start + datetime.timedelta(i) for i in range(self.days)]
+
+    def events_on(self, day):
+        index = (day - self.start).days
+        if not 0 <= index < self.days:
+            return 0
+        base, extra = divmod(self.events, self.days)
+        return base + (1 if index < extra else 0)
+
+    def day(self, day, where=None):
+        """
+        Return the export lines for one day, in time order, optionally only
+        those whose properties where(properties) accepts.
+        """
+        events = self.day_events(day)
+        if where is not None:
+            events = [e for e in events if where(e)]
+        return [json.dumps({'event': EVENT, 'properties': e}).encode('utf-8')
+                for e in events]
+
+    def day_events(self, day):
+        """Return the properties of one day's events, in time order."""
+        rng = random.Random('%s-%s' % (self.seed, day.isoformat()))
+        midnight = calendar.timegm(day.timetuple())
+        count = self.events_on(day)
+
+        events = []
+        while len(events) < count:
+            # Responses cluster in the working day
+            t = midnight + int(min(86399, max(0, rng.gauss(13 * 3600, 4 * 3600))))
+            event = self._event(rng, t)
+            events.append(event)
+            if rng.random() < REPEAT_SHARE and len(events) < count:
+                repeat = dict(event, time=min(midnight + 86399,
+                                              t + rng.randint(30, 300)))
+                repeat['sufficient-supply'] = rng.random() < 0.5
+                events.append(repeat)
+
+        events.sort(key=lambda e: e['time'])
+        return events
+
+    def days_between(self, from_date, to_date, where=None):
+        """Yield export lines for every day in [from_date, to_date]."""
+        day = from_date
+        while day <= to_date:
+            for line in self.day(day, where):
+                yield line
+            day += datetime.timedelta(1)
+
+    def _event(self, rng, t):
+        hospital = rng.choices(self.hospitals, cum_weights=self.cum_weights)[0]
+        supply = rng.random() < self.positive_rate[hospital]
+        if rng.random() < UNMATCHED_SHARE:
+            hospital = rng.choice([rng.choice(TEST_SPACES),
+                                   hospital + rng.choice(UNMATCHED_SUFFIXES)])
+        country = 'GB' if rng.random() < GB_SHARE else rng.choice(OTHER_COUNTRIES)
+        clinician = uuid.UUID(int=rng.randrange(self.clinicians) + (self.seed << 64))
+        return {
+            'time': t,
+            'distinct_id': str(clinician),
+            'hospital': hospital,
+            'sufficient-supply': supply,
+            'mp_country_code': country,
+            '$os': rng.choice(['iOS', 'Android']),
+            'mp_lib': 'swift',
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=DAYS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default='-', help="File to write, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    generator = Generator(args.events, days=args.days, seed=args.seed)
+    out = sys.stdout.buffer if args.out == '-' else open(args.out, 'wb')
+    try:
+        for day in generator.day_range():
+            out.write(b'\n'.join(generator.day(day)) + b'\n')
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+
+
+if __name__ == '__main__':
+    main()
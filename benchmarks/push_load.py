@@ -0,0 +1,148 @@
+"""
+Load generator for the push ingestion service
+
+Sends synthetic ppe-survey-1 events, timed in the last hour, to push.py in
+NDJSON batches from several threads, resending a share of the batches to
+exercise replays. Reports request latency percentiles and throughput, then
+waits for the service to publish and reports how long after the last
+request the responses reached the published store, and how many of them.
+
+    python push.py --port 8000 &
+    python -m benchmarks.push_load --url http://127.0.0.1:8000/events --events 20000
+"""
+import argparse
+import datetime
+import gzip
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+import store
+from benchmarks.generate import Generator, EVENT
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+DEFAULT_BATCH = 100
+DEFAULT_CONCURRENCY = 4
+DEFAULT_REPLAY = 0.1  # Share of batches sent twice
+
+
+def batches(events, batch_size, seed=0, now=None):
+    """
+    Split events from the hour before now into NDJSON bodies of batch_size
+    events. The same seed and now give the same events.
+    """
+    generator = Generator(events, days=1, seed=seed)
+    properties = generator.day_events(generator.start)
+    # Move the generated day onto the last hour, keeping the order
+    now = int(time.time() if now is None else now)
+    rng = random.Random(seed)
+    times = sorted(rng.randint(now - 3600, now) for _ in properties)
+    lines = [json.dumps({'event': EVENT, 'properties': dict(p, time=t)}).encode('utf-8')
+             for p, t in zip(properties, times)]
+    return [b'\n'.join(lines[i:i + batch_size])
+            for i in range(0, len(lines), batch_size)]
+
+
+def run(url, events, batch_size=DEFAULT_BATCH, concurrency=DEFAULT_CONCURRENCY,
+        replay=DEFAULT_REPLAY, token=None, gzipped=False, seed=0, now=None):
+    bodies = batches(events, batch_size, seed, now)
+    rng = random.Random(seed)
+    bodies += [body for body in bodies if rng.random() < replay]
+    rng.shuffle(bodies)
+
+    headers = {'Content-Type': 'application/x-ndjson'}
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+    if gzipped:
+        headers['Content-Encoding'] = 'gzip'
+    local = threading.local()
+
+    def send(body):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        data = gzip.compress(body) if gzipped else body
+        started = time.perf_counter()
+        while True:
+            response = local.session.post(url, data=data, headers=headers)
+            if response.status_code != 503:
+                break
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        response.raise_for_status()
+        return time.perf_counter() - started, response.json()
+
+    version_before = store.version()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(send, bodies))
+    elapsed = time.perf_counter() - started
+    sent_at = time.time()
+
+    latencies = [seconds for seconds, _ in results]
+    accepted = sum(counts['accepted'] for _, counts in results)
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    print('%d requests, %d events accepted (%d replayed) in %.2fs: %.0f events/s'
+          % (len(bodies), accepted, accepted - events, elapsed, accepted / elapsed))
+    print('request latency p50 %.1fms  p90 %.1fms  p99 %.1fms'
+          % (p50 * 1000, p90 * 1000, p99 * 1000))
+    return version_before, sent_at
+
+
+def wait_for_publish(version_before, sent_at, timeout=60, settle=5):
+    """
+    Print how long after sent_at the store was last republished, waiting
+    until no new version has appeared for settle seconds.
+    """
+    deadline = time.time() + timeout
+    version, published = version_before, None
+    while time.time() < deadline:
+        current = store.current()
+        if current is not None and current['version'] != version:
+            version, published = current['version'], time.time()
+        if published is not None and time.time() - published >= settle:
+            break
+        time.sleep(0.1)
+    if published is None:
+        print('Nothing was published within %ds' % timeout)
+        return
+    today = store.read(store.current()['store'], columns=['distinct_id'],
+                       start=datetime.date.today() - datetime.timedelta(1))
+    print('Published %.2fs after the last request; %d responses stored for '
+          'today and yesterday' % (max(0.0, published - sent_at), len(today)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/events')
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH)
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--replay', type=float, default=DEFAULT_REPLAY,
+                        help='Share of batches sent twice, default 0.1')
+    parser.add_argument('--token', help='PUSH_TOKEN of the service')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--now', type=int,
+                        help='Unix time of the last event; pass the same value '
+                             'and seed again to replay a whole run')
+    parser.add_argument('--no-wait', action='store_true',
+                        help="Don't wait for the events to be published")
+    args = parser.parse_args(argv)
+
+    version_before, sent_at = run(args.url, args.events, args.batch, args.concurrency,
+                                  args.replay, args.token, args.gzip, args.seed,
+                                  args.now)
+    if not args.no_wait:
+        wait_for_publish(version_before, sent_at)
+
+
+if __name__ == '__main__':
+    main()
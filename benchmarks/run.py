@@ -0,0 +1,225 @@
+"""
+Time each ingest and dashboard stage on synthetic data
+
+Stages run in the order data flows through them, each in its own process
+so that peak RSS is attributable to it:
+
+    fetch      read_events from the local stand-in export server
+    fetch_gb   the same with the scheduler's GB filter pushed down
+    parse      decode an in-memory export into a DataFrame
+    merge      scheduler.transform: GB filter, time parts, hospital join
+    write      write the day-partitioned store
+    load       read the store's hospital, answer and location columns
+    aggregate  build the rollup cube and the tables derived from it
+    snapshot   read the snapshot the app loads instead of the rollups
+
+Each stage is repeated and reported as latency percentiles, events per
+second, peak RSS and, for fetches, the response bytes sent. Save a run with --save and check a later one against
+it with --compare, which exits non-zero when a stage's median slows down by
+more than --tolerance.
+
+    python -m benchmarks.run --events 100000 --save baseline.json
+    python -m benchmarks.run --events 100000 --compare baseline.json
+"""
+import argparse
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+STAGES = ['fetch', 'fetch_gb', 'parse', 'merge', 'write', 'load', 'aggregate',
+          'snapshot']
+COLUMNS = ['time', 'mp_country_code', 'hospital', 'sufficient-supply', 'distinct_id']
+LOAD_COLUMNS = ['hospital', 'sufficient-supply', 'lat', 'lon', 'day_month']
+DEFAULT_TOLERANCE = 0.25
+
+
+def run_stage(stage, events, repeat, workdir):
+    """Run one stage repeat times and return its measurements."""
+    import mixpanel as mp
+    import rollups
+    import scheduler
+    import snapshot
+    import store
+    from benchmarks.generate import Generator, EVENT
+    from benchmarks.server import ExportServer, KEYS
+
+    generator = Generator(events)
+    days = generator.day_range()
+    store_location = os.path.join(workdir, 'merged')
+
+    def parsed():
+        data = b'\n'.join(generator.days_between(days[0], days[-1]))
+        return mp._export_to_df(data, list(COLUMNS), False)
+
+    server = None
+    if stage in ('fetch', 'fetch_gb'):
+        server = ExportServer(generator).start()
+        mp.set_transport(mp.Transport(data_api_base=server.base_url))
+        filters = scheduler.FILTERS if stage == 'fetch_gb' else None
+
+        def work():
+            return len(mp.read_events(KEYS, events=EVENT, start=days[0], end=days[-1],
+                                      columns=list(COLUMNS), exclude_mp=False,
+                                      shard='week', filters=filters))
+    elif stage == 'parse':
+        data = b'\n'.join(generator.days_between(days[0], days[-1]))
+
+        def work():
+            return len(mp._export_to_df(data, list(COLUMNS), False))
+    elif stage == 'merge':
+        raw = parsed()
+
+        def work():
+            scheduler.transform(raw)
+            return len(raw)
+    elif stage in ('write', 'load', 'aggregate', 'snapshot'):
+        merged = scheduler.transform(parsed())
+        store.clear(store_location)
+        store.write(merged, store_location)
+        loaded = store.read(store_location, columns=rollups.SOURCE_COLUMNS)
+        if stage == 'snapshot':
+            rollup_location = os.path.join(workdir, 'rollups')
+            snapshot_location = os.path.join(workdir, snapshot.SNAPSHOT_FILE)
+            rollups.build(store_location, rollup_location)
+            snapshot.build(rollup_location, snapshot_location)
+
+        def work():
+            if stage == 'write':
+                store.clear(store_location)
+                store.write(merged, store_location)
+            elif stage == 'load':
+                store.read(store_location, columns=LOAD_COLUMNS)
+            elif stage == 'snapshot':
+                snapshot.load(snapshot_location)
+            else:
+                cube = rollups.compute_cube(loaded)
+                rollups.daily(cube)
+                rollups.by_hospital(cube)
+                rollups.cells(cube)
+            return len(loaded)
+    else:
+        raise ValueError('Unknown stage %r' % stage)
+
+    setup_rss = _peak_rss_mb()
+    latencies = []
+    processed = 0
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            processed = work()
+            latencies.append(time.perf_counter() - started)
+    finally:
+        if server is not None:
+            server.stop()
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    sent = server.bytes_sent // repeat if server is not None else None
+    return {
+        'events': processed,
+        'repeat': repeat,
+        'p50': p50,
+        'p90': p90,
+        'p99': p99,
+        'events_per_sec': processed / p50 if p50 else None,
+        'setup_rss_mb': setup_rss,
+        'peak_rss_mb': _peak_rss_mb(),
+        'bytes_sent': sent,
+    }
+
+
+def run(stages, events, repeat):
+    workdir = tempfile.mkdtemp(prefix='ppe-bench-')
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            for stage in stages:
+                results[stage] = pool.apply(run_stage, (stage, events, repeat, workdir))
+                print(_format_row(stage, results[stage]))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'events': events,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'stages': results,
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Print p50 changes against baseline and return the regressed stages."""
+    regressions = []
+    for stage, result in current['stages'].items():
+        before = baseline.get('stages', {}).get(stage)
+        if before is None:
+            continue
+        change = result['p50'] / before['p50'] - 1 if before['p50'] else 0.0
+        flag = ''
+        if change > tolerance:
+            regressions.append(stage)
+            flag = '  REGRESSION'
+        print('%-10s p50 %8.3fs -> %8.3fs (%+.0f%%)%s'
+              % (stage, before['p50'], result['p50'], change * 100, flag))
+    if baseline.get('events') != current['events']:
+        print('Note: baseline ran %s events, this run %s'
+              % (baseline.get('events'), current['events']))
+    return regressions
+
+
+def _peak_rss_mb():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+
+def _format_row(stage, result):
+    row = ('%-10s p50 %8.3fs  p90 %8.3fs  p99 %8.3fs  %12.0f events/s  '
+           'peak RSS %7.1f MB (setup %.1f MB)'
+           % (stage, result['p50'], result['p90'], result['p99'],
+              result['events_per_sec'] or 0, result['peak_rss_mb'],
+              result['setup_rss_mb']))
+    if result.get('bytes_sent') is not None:
+        row += '  %.1f MB sent' % (result['bytes_sent'] / 1024.0 ** 2)
+    return row
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--save', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Baseline JSON file from --save')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed p50 slowdown before failing, default 0.25')
+    args = parser.parse_args(argv)
+
+    results = run(args.stages, args.events, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+Local stand-in for Mixpanel's raw data export endpoint
+
+Serves GET /api/2.0/export/ with synthetic events from benchmarks.generate,
+checking the request signature and expiry the way Mixpanel does and
+honouring Accept-Encoding: gzip. where expressions are applied when they
+are in the form mixpanel.where_expression produces. Point the client at it
+with
+
+    mixpanel.set_transport(mixpanel.Transport(data_api_base=server.base_url))
+
+    python -m benchmarks.server --events 1000000 --port 8765
+"""
+import argparse
+import datetime
+import http.server
+import operator
+import re
+import socketserver
+import threading
+import time
+import urllib.parse
+import zlib
+
+import mixpanel as mp
+from benchmarks.generate import Generator, EVENT
+
+
+API_KEY = 'benchmark-key'
+API_SECRET = 'benchmark-secret'
+KEYS = (API_KEY, API_SECRET)
+EXPORT_PATH = '/api/%s/export/' % mp.VERSION
+COMPARISON = re.compile(r'^properties\[("(?:[^"\\]|\\.)*")\] (==|!=|<=|>=|<|>) (.+)$')
+OPERATORS = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,
+             '<=': operator.le, '>': operator.gt, '>=': operator.ge}
+
+
+class ExportServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, generator, port=0, secret=API_SECRET):
+        http.server.HTTPServer.__init__(self, ('127.0.0.1', port), ExportHandler)
+        self.generator = generator
+        self.secret = secret
+        self.requests = 0
+        self.bytes_sent = 0
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d/api' % self.server_address[1]
+
+    def start(self):
+        """Serve from a background thread and return self."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class ExportHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path.rstrip('/') != EXPORT_PATH.rstrip('/'):
+            return self._error(404, 'Unknown endpoint')
+
+        params = dict(urllib.parse.parse_qsl(url.query))
+        error = self._check_signature(params)
+        if error:
+            return self._error(400, error)
+
+        try:
+            from_date = datetime.datetime.strptime(params['from_date'], mp.date_format).date()
+            to_date = datetime.datetime.strptime(params['to_date'], mp.date_format).date()
+        except (KeyError, ValueError):
+            return self._error(400, 'from_date and to_date are required')
+
+        try:
+            matches = where_predicate(params.get('where'))
+        except ValueError as e:
+            return self._error(400, 'Unsupported where expression: %s' % e)
+
+        events = mp.json.loads(params['event']) if 'event' in params else None
+        self.server.requests += 1
+        if events is not None and EVENT not in events:
+            return self._send_lines([])
+        return self._send_lines(
+            self.server.generator.days_between(from_date, to_date, matches))
+
+    def _check_signature(self, params):
+        sig = params.pop('sig', None)
+        if params.get('api_key') != API_KEY:
+            return 'Invalid API key'
+        if sig != mp.hash_args(dict(params), self.server.secret):
+            return 'Invalid signature'
+        try:
+            if int(params['expire']) < time.time():
+                return 'Request has expired'
+        except (KeyError, ValueError):
+            return 'expire is required'
+        return None
+
+    def _send_lines(self, lines):
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Transfer-Encoding', 'chunked')
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self.end_headers()
+
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzipped else None
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= 1000:
+                self._write_chunk(b'\n'.join(batch) + b'\n', compressor)
+                batch = []
+        if batch:
+            self._write_chunk(b'\n'.join(batch) + b'\n', compressor)
+        if compressor is not None:
+            self._write_raw(compressor.flush())
+        self.wfile.write(b'0\r\n\r\n')
+
+    def _write_chunk(self, data, compressor):
+        if compressor is not None:
+            data = compressor.compress(data)
+        self._write_raw(data)
+
+    def _write_raw(self, data):
+        if data:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+            self.server.bytes_sent += len(data)
+
+    def _error(self, status, message):
+        body = mp.json.dumps({'error': message}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def where_predicate(where):
+    """
+    Return a function of an event's properties for a where expression of
+    ANDed comparisons and parenthesised ORs or ANDs of comparisons, as
+    mixpanel.where_expression writes, or None.
+    """
+    if not where:
+        return None
+    clauses = []
+    for clause in _split(where, ' and '):
+        if clause.startswith('(') and clause.endswith(')'):
+            # 'in' filters are ORs and 'not in' filters are ANDs
+            alternatives = _split(clause[1:-1], ' or ')
+            if len(alternatives) > 1:
+                clauses.append(('any', [_comparison(c) for c in alternatives]))
+            else:
+                clauses.append(('all', [_comparison(c)
+                                        for c in _split(clause[1:-1], ' and ')]))
+        elif clause.startswith('(') or clause.endswith(')'):
+            raise ValueError(clause)
+        else:
+            clauses.append(('all', [_comparison(clause)]))
+
+    def matches(properties):
+        for kind, comparisons in clauses:
+            results = (_compare(properties, c) for c in comparisons)
+            if not (any(results) if kind == 'any' else all(results)):
+                return False
+        return True
+    return matches
+
+
+def _split(expression, separator):
+    # Splits on separator outside parentheses and quoted strings
+    parts, depth, quoted, start, i = [], 0, False, 0, 0
+    while i < len(expression):
+        char = expression[i]
+        if quoted:
+            if char == '\\':
+                i += 1
+            elif char == '"':
+                quoted = False
+        elif char == '"':
+            quoted = True
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif depth == 0 and expression.startswith(separator, i):
+            parts.append(expression[start:i].strip())
+            start = i = i + len(separator)
+            continue
+        i += 1
+    parts.append(expression[start:].strip())
+    return parts
+
+
+def _comparison(clause):
+    match = COMPARISON.match(clause)
+    if match is None:
+        raise ValueError(clause)
+    prop, op, value = match.groups()
+    return mp.json.loads(prop), OPERATORS[op], mp.json.loads(value)
+
+
+def _compare(properties, comparison):
+    prop, op, value = comparison
+    if prop not in properties:
+        return op is operator.ne
+    try:
+        return op(properties[prop], value)
+    except TypeError:
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    server = ExportServer(Generator(args.events, seed=args.seed), port=args.port)
+    print('Serving %s with keys %s' % (server.base_url, KEYS))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Cold start of the dashboard per release, from the app's startup log
+
+Each app process appends one line to metrics.STARTUP_LOG_LOCATION after
+its first page load (see metrics.Startup). This groups them by release and
+reports percentiles of the time to first render, its phases and the age of
+the process by then, in the order releases first appear in the log.
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --last 5
+"""
+import argparse
+import collections
+
+import numpy as np
+
+import metrics
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+PHASES = ['imports', 'load_data', 'first_render']
+
+
+def read(location=metrics.STARTUP_LOG_LOCATION):
+    """Startup log entries grouped by release, in order of first appearance."""
+    releases = collections.OrderedDict()
+    with open(location) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # A line cut short by a dyno stopping
+                continue
+            releases.setdefault(entry.get('release', 'unknown'), []).append(entry)
+    return releases
+
+
+def summarise(entries):
+    """p50 and p90 of each phase, the process age and the share from snapshots."""
+    summary = collections.OrderedDict([('starts', len(entries))])
+    series = [(phase, [e['phases'].get(phase) for e in entries]) for phase in PHASES]
+    series.append(('process', [e.get('process_seconds') for e in entries]))
+    for name, values in series:
+        values = [v for v in values if v is not None]
+        summary[name] = tuple(np.percentile(values, [50, 90])) if values else None
+    summary['snapshot'] = sum(1 for e in entries if e.get('snapshot')) / float(len(entries))
+    return summary
+
+
+def _format_row(release, summary):
+    row = '%-16s %5d starts' % (release[:16], summary['starts'])
+    for name in PHASES + ['process']:
+        if summary[name] is None:
+            row += '  %-12s %15s' % (name, '-')
+        else:
+            row += '  %-12s %6.2fs %6.2fs' % ((name,) + summary[name])
+    return row + '  %3.0f%% snapshot' % (summary['snapshot'] * 100)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--log', default=metrics.STARTUP_LOG_LOCATION)
+    parser.add_argument('--last', type=int, help='Only the last N releases')
+    args = parser.parse_args(argv)
+
+    releases = list(read(args.log).items())
+    if args.last:
+        releases = releases[-args.last:]
+    print('%-16s %11s  p50 and p90 seconds of each phase' % ('release', ''))
+    for release, entries in releases:
+        print(_format_row(release, summarise(entries)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+Dashboard charts rendered from the rollups at ingest
+
+Each chart is a PNG written next to the rollups of the version it was drawn
+from, so the dashboard serves it straight from disk and a chart is only
+redrawn when an ingest publishes new data. Charts of the daily and cell
+rollups are drawn again by the dashboard, with png, when a narrower day
+range is selected.
+
+Matplotlib and seaborn take seconds to import on a fresh dyno, so they
+are imported when a chart is drawn rather than with this module.
+"""
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+import rollups
+import store
+
+
+CHART_LOCATION = './data/charts'
+TOTALS = 'totals'
+TREND = 'trend'
+SENTIMENT = 'sentiment'
+RANKING = 'ranking'
+HEATMAP = 'heatmap'
+
+# The rollup each chart is drawn from
+SOURCES = {TOTALS: rollups.DAILY, TREND: rollups.DAILY, SENTIMENT: rollups.DAILY,
+           RANKING: rollups.HOSPITALS, HEATMAP: rollups.CELLS}
+RANKING_HOSPITALS = 170  # Hospitals shown in the ranking, most negative first
+DPI = 100
+POSITIVE_COLOR = '#4c9f70'
+NEGATIVE_COLOR = '#d1495b'
+
+
+def build(rollup_location=rollups.ROLLUP_LOCATION, location=CHART_LOCATION):
+    """Draw every chart from the rollups in rollup_location into location."""
+    os.makedirs(location, exist_ok=True)
+    tables = {}
+    for name, source in SOURCES.items():
+        if source not in tables:
+            tables[source] = rollups.load(source, rollup_location)
+        image = png(name, tables[source])
+        store.replace_file(chart_path(name, location), lambda f: f.write(image), 'wb')
+
+
+def png(name, table):
+    """Draw a chart from the rows of its rollup (see SOURCES) as PNG bytes."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import seaborn as sns
+
+    with sns.axes_style('darkgrid'):
+        figure = _DRAW[name](table)
+    out = io.BytesIO()
+    FigureCanvasAgg(figure).print_png(out)
+    return out.getvalue()
+
+
+def chart_path(name, location=CHART_LOCATION):
+    return os.path.join(location, name + '.png')
+
+
+def _figure(**kwargs):
+    from matplotlib.figure import Figure
+    return Figure(dpi=DPI, **kwargs)
+
+
+def _totals(by_day):
+    figure = _figure(figsize=(5, 3.75))
+    ax = figure.add_subplot()
+    counts = [by_day['sufficient'].sum(), by_day['insufficient'].sum()]
+    bars = ax.bar(['Yes', 'No'], counts, color=[POSITIVE_COLOR, NEGATIVE_COLOR])
+    for bar, count in zip(bars, counts):
+        ax.annotate('{:,}'.format(int(count)), (bar.get_x() + bar.get_width() / 2, count),
+                    ha='center', va='bottom')
+    ax.set(title='Total PPE responses', ylabel='Responses')
+    figure.tight_layout()
+    return figure
+
+
+def _trend(by_day):
+    figure = _figure(figsize=(8, 6))
+    ax = figure.add_subplot()
+    days = pd.to_datetime(by_day['day_month'])
+    total = by_day['total'].cumsum().replace(0, np.nan)
+    ax.plot(days, by_day['sufficient'].cumsum() / total * 100,
+            color=POSITIVE_COLOR, label='Enough PPE')
+    ax.plot(days, by_day['insufficient'].cumsum() / total * 100,
+            color=NEGATIVE_COLOR, label='Not enough PPE')
+    ax.set(title='Overall trend in PPE supply sentiment',
+           ylabel='Cumulative % of responses', ylim=(0, 100))
+    ax.legend(loc='upper right')
+    figure.autofmt_xdate()
+    figure.tight_layout()
+    return figure
+
+
+def _sentiment(by_day):
+    figure = _figure(figsize=(8, 6))
+    ax = figure.add_subplot()
+    days = pd.to_datetime(by_day['day_month'])
+    ax.bar(days, by_day['proportion-positive'], color=POSITIVE_COLOR,
+           label='Enough PPE')
+    ax.bar(days, by_day['proportion-negative'], bottom=by_day['proportion-positive'],
+           color=NEGATIVE_COLOR, label='Not enough PPE')
+    ax.set(ylabel='% of responses', ylim=(0, 100))
+    ax.set_title('PPE response sentiment split by day', pad=24)
+    ax.legend(loc='lower center', bbox_to_anchor=(0.5, 1.0), ncol=2, frameon=False)
+    figure.autofmt_xdate()
+    figure.tight_layout()
+    return figure
+
+
+def _ranking(by_site):
+    by_site = by_site.head(RANKING_HOSPITALS)
+    # One bar per hospital, so the figure grows with the number shown
+    figure = _figure(figsize=(8, 1.5 + 0.14 * len(by_site)))
+    ax = figure.add_subplot()
+    positions = np.arange(len(by_site))
+    ax.barh(positions, by_site['proportion-positive'], color=POSITIVE_COLOR)
+    ax.set_yticks(positions)
+    ax.set_yticklabels(by_site['hospital'], fontsize=6)
+    ax.set_ylim(len(by_site) - 0.5, -0.5)  # Most negative at the top
+    ax.set(title='PPE supply sentiment by hospital',
+           xlabel='Cumulative % positive responses', xlim=(0, 100))
+    figure.tight_layout()
+    return figure
+
+
+def _heatmap(cells):
+    # The map is cumulative, so cells are summed over the days given
+    cells = cells.groupby(['q', 'r', 'lat', 'lon'])[['sufficient', 'insufficient', 'total']] \
+        .sum().reset_index()
+    cells['proportion-negative'] = cells['insufficient'] / cells['total'] * 100
+    figure = _figure(figsize=(6, 8))
+    ax = figure.add_subplot()
+    total = cells['total']
+    sizes = 10 + 190 * total / total.max() if len(cells) else total
+    points = ax.scatter(cells['lon'], cells['lat'], s=sizes,
+                        c=cells['proportion-negative'], cmap='Reds',
+                        vmin=0, vmax=100, alpha=0.8, edgecolors='none')
+    figure.colorbar(points, ax=ax, label='% negative responses')
+    ax.set(title='Heatmap of negative sentiment', xlabel='Longitude',
+           ylabel='Latitude', aspect=1.6)
+    figure.tight_layout()
+    return figure
+
+
+_DRAW = {TOTALS: _totals, TREND: _trend, SENTIMENT: _sentiment,
+         RANKING: _ranking, HEATMAP: _heatmap}
@@ -0,0 +1,121 @@
+"""
+Collapse repeated answers from the same clinician
+
+Clinicians often submit the same survey several times within minutes. A
+policy names which responses count as repeats of each other and which of
+them is kept:
+
+    none            keep every response
+    latest-per-day  the last answer per clinician, hospital and day
+    first-per-day   the first answer per clinician, hospital and day
+    burst           the last answer of each run of answers per clinician
+                    and hospital that are at most BURST_MINUTES apart on
+                    the same day
+
+Deduplicator applies a policy to a stream of time-indexed chunks. Repeats
+never span days, so it only holds the responses of the days still open
+(the latest day seen and LATENESS_DAYS before it) and emits every other
+day, complete, as soon as a later day arrives.
+"""
+import numpy as np
+import pandas as pd
+
+
+KEYS = ['distinct_id', 'hospital_id']
+BURST_MINUTES = 15
+# Days before the latest one seen that can still receive late responses
+LATENESS_DAYS = 1
+
+POLICIES = {
+    'none': None,
+    'latest-per-day': {'keep': 'last'},
+    'first-per-day': {'keep': 'first'},
+    'burst': {'keep': 'last', 'window': pd.Timedelta(minutes=BURST_MINUTES)},
+}
+
+
+class Deduplicator(object):
+    """
+    Streaming, day-windowed deduplication of time-indexed DataFrames
+
+    push each chunk in roughly time order and write what it returns; call
+    flush at the end for the days still open. Every day is returned
+    exactly once and in full, so the caller can replace stored days
+    rather than append to them. seed adds previously stored responses of
+    the open days so that repeats are collapsed across runs.
+    """
+
+    def __init__(self, policy='latest-per-day', keys=KEYS,
+                 lateness_days=LATENESS_DAYS):
+        if policy not in POLICIES:
+            raise ValueError('Unknown dedup policy %r, use one of %s'
+                             % (policy, sorted(POLICIES)))
+        self.policy = policy
+        self.keys = list(keys)
+        self.lateness = pd.Timedelta(days=lateness_days)
+        self.rows_in = 0
+        self.rows_out = 0
+        self.pending = None
+
+    @property
+    def collapsed(self):
+        """Rows dropped as repeats so far."""
+        held = len(self.pending) if self.pending is not None else 0
+        return self.rows_in - self.rows_out - held
+
+    def seed(self, df):
+        """Add already stored responses, which are returned with their days."""
+        return self.push(df)
+
+    def push(self, df):
+        """Add a chunk and return the rows of the days it closed."""
+        if df.empty:
+            return df.iloc[:0]
+        self.rows_in += len(df)
+        frame = df if self.pending is None else \
+            pd.concat([self.pending, df], sort=False)
+        frame = self._collapse(frame.sort_index(kind='mergesort'))
+
+        days = pd.DatetimeIndex(frame.index).normalize()
+        is_open = days >= days.max() - self.lateness
+        self.pending = frame[is_open]
+        return self._emit(frame[~is_open])
+
+    def flush(self):
+        """Return the rows of every day still open."""
+        if self.pending is None:
+            return pd.DataFrame()
+        frame, self.pending = self.pending, None
+        return self._emit(frame)
+
+    def _emit(self, frame):
+        self.rows_out += len(frame)
+        return frame
+
+    def _collapse(self, frame):
+        options = POLICIES[self.policy]
+        if options is None or frame.empty:
+            return frame
+
+        times = pd.DatetimeIndex(frame.index)
+        keys = frame[self.keys].astype(object)
+        groups = keys.fillna('').assign(_day=times.normalize()) \
+            .groupby(self.keys + ['_day'], sort=False).ngroup().to_numpy()
+        # Responses missing a key can't be matched, so each is its own group
+        unkeyed = keys.isna().any(axis=1).to_numpy()
+        groups[unkeyed] = -1 - np.arange(unkeyed.sum())
+        if 'window' not in options:
+            keep = ~pd.Series(groups).duplicated(keep=options['keep']).to_numpy()
+            return frame[keep]
+
+        # Within each group, in time order, keep the last response of every
+        # run whose gaps are all within the window
+        stamps = times.asi8
+        order = np.lexsort((stamps, groups))
+        groups, stamps = groups[order], stamps[order]
+        continues = (groups[1:] == groups[:-1]) & \
+            (stamps[1:] - stamps[:-1] <= options['window'].value)
+        last_of_run = np.append(~continues, True)
+        keep = np.zeros(len(frame), dtype=bool)
+        keep[order[last_of_run]] = True
+        return frame[keep]
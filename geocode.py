@@ -0,0 +1,298 @@
+"""
+Geocoding of hospital names the store's hospital dimension doesn't know
+
+A provider is any callable taking a hospital name and returning a Place,
+None when nothing was found, or raising GeocodeError when the lookup
+failed and should be retried on a later run. GeocoderProvider looks names
+up with the geocoder package, LocalProvider answers from a table of known
+sites, without network access, for trying the pipeline out.
+
+Geocoder resolves names through a persistent GeocodeCache first and sends
+only names it has never looked up, or whose negative result has expired,
+to the provider, in concurrent batches held to a request rate. The cache
+is saved after every batch, so each name is looked up at most once even
+if a run is interrupted.
+
+Sites found are appended to the store's own copy of the dimension
+(hospitals.csv in the store, see hospitals.py) and kept there for every
+later ingest, so results are only accepted if they are a hospital, clinic
+or surgery in the UK, and names of test spaces and the like are never
+looked up. Geocoding is
+off unless GEOCODE_PROVIDER is set.
+"""
+import collections
+import datetime
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import hospitals
+import store
+
+
+CACHE_LOCATION = os.environ.get('GEOCODE_CACHE', './data/geocode-cache.csv')
+LOCAL_SITES_LOCATION = os.environ.get('GEOCODE_LOCAL_SITES', './data/geocode-local.csv')
+# A geocoder provider name such as 'osm' or 'google', 'local' or 'none'
+PROVIDER = os.environ.get('GEOCODE_PROVIDER', 'none')
+API_KEY = os.environ.get('GEOCODE_API_KEY')
+# Requests per second across all workers; Nominatim allows one
+RATE = float(os.environ.get('GEOCODE_RATE', 1))
+WORKERS = int(os.environ.get('GEOCODE_WORKERS', 4))
+BATCH_SIZE = 20  # Names looked up between cache saves
+# Days before a name that wasn't found is looked up again
+NEGATIVE_TTL_DAYS = float(os.environ.get('GEOCODE_NEGATIVE_TTL_DAYS', 7))
+QUERY_SUFFIX = ', United Kingdom'
+# South, west, north and east edges of the UK, Northern Ireland included
+UK_BOUNDS = (49.8, -8.7, 60.9, 1.8)
+# OpenStreetMap types, or Google types, of the places accepted as sites
+SITE_KINDS = {'hospital', 'clinic', 'doctors', 'doctor'}
+# Names of test and demo spaces in the app, never looked up
+IGNORED_NAMES = re.compile(r'\b(test|tests|testing|dummy|demo|sandbox|triage space)\b')
+
+CACHE_COLUMNS = ['key', 'name', 'found', 'lat', 'lon', 'address', 'kind',
+                 'looked_up']
+
+# kind is the provider's type for the place, e.g. 'hospital'
+Place = collections.namedtuple('Place', ['lat', 'lon', 'address', 'kind'])
+
+logger = logging.getLogger(__name__)
+
+
+class GeocodeError(Exception):
+    """A lookup failed, rather than finding nothing, and can be retried."""
+
+
+class GeocoderProvider(object):
+    """Look names up with one of the geocoder package's providers, e.g. 'osm'."""
+
+    rate_limited = True
+
+    def __init__(self, method='osm', suffix=QUERY_SUFFIX, **options):
+        import geocoder
+        self.lookup = getattr(geocoder, method)
+        self.suffix = suffix
+        self.options = options
+
+    def __call__(self, name):
+        try:
+            result = self.lookup(name + self.suffix, **self.options)
+        except Exception as e:
+            raise GeocodeError('%s: %s' % (name, e))
+        if result.ok and result.latlng:
+            lat, lon = result.latlng
+            return Place(float(lat), float(lon), result.address, _kind(result))
+        status = str(result.status or '')
+        if 'no results' in status.lower() or 'zero_results' in status.lower():
+            return None
+        raise GeocodeError('%s: %s' % (name, status or 'no response'))
+
+
+class LocalProvider(object):
+    """
+    Stand-in provider answering from a table of sites
+
+    sites is a DataFrame, or the path of a CSV, with hospital, lat and lon
+    columns and optionally address. latency seconds are slept per lookup to
+    mimic a remote service; lookups aren't held to the request rate.
+    """
+
+    rate_limited = False
+
+    def __init__(self, sites=LOCAL_SITES_LOCATION, latency=0.0):
+        if isinstance(sites, str):
+            sites = pd.read_csv(sites) if os.path.exists(sites) else \
+                pd.DataFrame(columns=['hospital', 'lat', 'lon'])
+        addresses = sites['address'] if 'address' in sites.columns else \
+            [None] * len(sites)
+        self.places = {hospitals.normalize(name): Place(float(lat), float(lon), address,
+                                                        'hospital')
+                       for name, lat, lon, address
+                       in zip(sites['hospital'], sites['lat'], sites['lon'], addresses)}
+        self.latency = latency
+        self.calls = 0
+
+    def __call__(self, name):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.places.get(hospitals.normalize(name))
+
+
+def provider(name=PROVIDER, api_key=API_KEY):
+    """Return the provider called name, or None for 'none'."""
+    if name == 'none':
+        return None
+    if name == 'local':
+        return LocalProvider()
+    options = {'key': api_key} if api_key else {}
+    return GeocoderProvider(name, **options)
+
+
+class GeocodeCache(object):
+    """
+    Every lookup's result, keyed by normalized name, in a CSV at location
+
+    Names that weren't found are kept too, and count as unknown again once
+    they are older than negative_ttl_days.
+    """
+
+    def __init__(self, location=CACHE_LOCATION, negative_ttl_days=NEGATIVE_TTL_DAYS):
+        self.location = location
+        self.negative_ttl = datetime.timedelta(days=negative_ttl_days)
+        self.entries = collections.OrderedDict()
+        if location and os.path.exists(location):
+            table = pd.read_csv(location, keep_default_na=False,
+                                na_values={'lat': [''], 'lon': ['']})
+            table = table.reindex(columns=CACHE_COLUMNS, fill_value='')
+            for row in table.itertuples(index=False):
+                self.entries[row.key] = row._asdict()
+
+    def __contains__(self, name):
+        entry = self.entries.get(hospitals.normalize(name))
+        if entry is None:
+            return False
+        if _found(entry):
+            # Hits cached before results were checked are looked up again
+            return bool(entry.get('kind'))
+        looked_up = datetime.datetime.strptime(entry['looked_up'], '%Y-%m-%dT%H:%M:%S')
+        return datetime.datetime.utcnow() - looked_up < self.negative_ttl
+
+    def get(self, name):
+        """Return the cached Place, or None if not found or not cached."""
+        entry = self.entries.get(hospitals.normalize(name))
+        if entry is None or not _found(entry) or not entry.get('kind'):
+            return None
+        return Place(float(entry['lat']), float(entry['lon']), entry['address'] or None,
+                     entry['kind'])
+
+    def put(self, name, place):
+        self.entries[hospitals.normalize(name)] = {
+            'key': hospitals.normalize(name),
+            'name': name,
+            'found': place is not None,
+            'lat': place.lat if place else None,
+            'lon': place.lon if place else None,
+            'address': (place.address or '') if place else '',
+            'kind': (place.kind or '') if place else '',
+            'looked_up': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    def save(self):
+        if not self.location:
+            return
+        os.makedirs(os.path.dirname(self.location) or '.', exist_ok=True)
+        table = pd.DataFrame(list(self.entries.values()), columns=CACHE_COLUMNS)
+        store.replace_file(self.location, lambda f: table.to_csv(f, index=False))
+
+
+class RateLimiter(object):
+    """Space calls to wait() at least 1 / rate seconds apart, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Geocoder(object):
+    """
+    Resolve names to Places through a cache and a rate-limited provider
+
+    Providers with rate_limited set to False, such as LocalProvider, are
+    called as fast as the workers allow.
+    """
+
+    def __init__(self, provider, cache=None, rate=RATE, workers=WORKERS,
+                 batch_size=BATCH_SIZE):
+        self.provider = provider
+        self.cache = cache if cache is not None else GeocodeCache()
+        self.limiter = RateLimiter(rate if getattr(provider, 'rate_limited', True) else 0)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.stats = collections.Counter()
+
+    def lookup(self, names):
+        """
+        Return a dict of the names that were found and their Places.
+
+        Names are looked up with the provider only if the cache has never
+        seen them or their negative result has expired. Results that aren't
+        a site in the UK (see acceptable) are cached as not found. Names
+        matching IGNORED_NAMES are skipped. Failed lookups are logged and
+        left out of the cache, to be retried on the next run.
+        """
+        unique = collections.OrderedDict()
+        for name in names:
+            normalized = hospitals.normalize(name)
+            if not normalized:
+                continue
+            if IGNORED_NAMES.search(normalized):
+                self.stats['ignored'] += 1
+                continue
+            unique.setdefault(normalized, name.strip())
+        unknown = [name for name in unique.values() if name not in self.cache]
+        self.stats['cached'] += len(unique) - len(unknown)
+
+        if unknown and self.provider is not None:
+            with ThreadPoolExecutor(self.workers) as executor:
+                for i in range(0, len(unknown), self.batch_size):
+                    batch = unknown[i:i + self.batch_size]
+                    for name, (ok, place) in zip(batch, executor.map(self._lookup, batch)):
+                        if ok:
+                            if place is not None and not acceptable(place):
+                                logger.info('Ignoring geocoded %r: %s at %.4f, %.4f',
+                                            name, place.kind, place.lat, place.lon)
+                                self.stats['rejected'] += 1
+                                place = None
+                            self.cache.put(name, place)
+                            self.stats['found' if place else 'not_found'] += 1
+                        else:
+                            self.stats['failed'] += 1
+                    self.cache.save()
+
+        found = {}
+        for name in unique.values():
+            place = self.cache.get(name)
+            if place is not None:
+                found[name] = place
+        return found
+
+    def _lookup(self, name):
+        self.limiter.wait()
+        try:
+            return True, self.provider(name)
+        except GeocodeError as e:
+            logger.warning('Geocoding failed, will retry next run: %s', e)
+            return False, None
+
+
+def acceptable(place):
+    """Whether a Place is a hospital, clinic or surgery inside UK_BOUNDS."""
+    south, west, north, east = UK_BOUNDS
+    return place.kind in SITE_KINDS and south <= place.lat <= north and \
+        west <= place.lon <= east
+
+
+def _kind(result):
+    # The first of the result's types that is a site kind, else its type
+    raw = result.raw if isinstance(getattr(result, 'raw', None), dict) else {}
+    kinds = [raw.get('type'), raw.get('class')] + list(raw.get('types') or [])
+    kinds = [k for k in kinds if isinstance(k, str)]
+    return next((k for k in kinds if k in SITE_KINDS), kinds[0] if kinds else '')
+
+
+def _found(entry):
+    return entry['found'] in (True, 'True', 'true', 1)
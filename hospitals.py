@@ -0,0 +1,246 @@
+"""
+Hospital dimension for joining responses to geocoded hospital sites
+
+Every row of the dimension gets an integer ID equal to its row position.
+The store keeps IDs, so each store holds its own copy of the dimension
+(DIMENSION_FILE, see sync) and its IDs never change: hospital_locations.csv
+can be edited or reordered freely, and its sites that the copy doesn't
+know are appended to the copy on the next ingest. Free-text hospital
+names from the survey are resolved to IDs through, in order:
+
+* an exact match on the normalized name
+* the alias table (hospital_aliases.csv: alias,hospital)
+* a trigram index, comparing each ' - ' separated part of the response
+  text with site names, e.g. 'Emergency Department - Queen Alexandra
+  Hospital' resolves to 'Queen Alexandra Hospital'
+
+Names that match none of these can be geocoded (see geocode.py) and
+appended to a store's copy with add_sites.
+
+Names are resolved once per distinct value, so joining a column of
+responses costs one dictionary lookup per distinct name plus an array take.
+"""
+import os
+import re
+import shutil
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+HOSPITALS_LOCATION = './data/hospital_locations.csv'
+DIMENSION_FILE = 'hospitals.csv'  # A store's own copy, see sync
+SITE_COLUMNS = ['hospital', 'count', 'lat', 'lon', 'location', 'address']
+ALIASES_LOCATION = './data/hospital_aliases.csv'
+
+UNMATCHED = -1
+# Trigram Jaccard similarity a part of the response text needs with a site
+MIN_SIMILARITY = 0.82
+# Shorter site names match too many unrelated responses to guess from
+MIN_FUZZY_LENGTH = 8
+
+
+def normalize(name):
+    """Lowercase, spell out '&' and reduce punctuation to single spaces."""
+    if not isinstance(name, str):
+        return ''
+    name = name.lower().replace('&', ' and ').replace("'", '').replace('’', '')
+    return ' '.join(re.findall(r'[a-z0-9]+', name))
+
+
+def segments(name):
+    """Split a response like 'ED - Lewisham Hospital' into its parts."""
+    if not isinstance(name, str):
+        return []
+    parts = [normalize(p) for p in re.split(r'\s+[-\u2013\u2014]+\s+', name)]
+    return [p for p in parts if p]
+
+
+def trigrams(normalized):
+    padded = ' %s ' % normalized
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class HospitalIndex(object):
+    """
+    Hospital sites keyed by integer ID, with name lookups
+
+    Attributes
+    ----------
+    names : pandas.Index of canonical hospital names, position is the ID
+    lat, lon : float64 arrays of site coordinates, position is the ID
+    """
+
+    def __init__(self, sites, aliases=None):
+        self.sites = sites.reset_index(drop=True)
+        self.names = pd.Index(self.sites['hospital'])
+        self.lat = self.sites['lat'].to_numpy(dtype=np.float64)
+        self.lon = self.sites['lon'].to_numpy(dtype=np.float64)
+
+        self._by_name = {}
+        for hospital_id, name in enumerate(self.names):
+            self._by_name.setdefault(normalize(name), hospital_id)
+
+        if aliases is not None:
+            for alias, name in zip(aliases['alias'], aliases['hospital']):
+                hospital_id = self._by_name.get(normalize(name))
+                if hospital_id is not None:
+                    self._by_name.setdefault(normalize(alias), hospital_id)
+
+        self._grams = {}
+        self._postings = defaultdict(list)
+        for name, hospital_id in self._by_name.items():
+            self._index_grams(name, hospital_id)
+
+        self._resolved = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def extend(self, sites):
+        """
+        Add sites appended to the hospitals file after this index was built.
+
+        sites is indexed by ID, as returned by add_sites. IDs already in the
+        index are skipped, so the same sites can be passed more than once.
+        """
+        new = sites[sites.index >= len(self)]
+        if new.empty:
+            return
+        if new.index[0] != len(self):
+            raise ValueError('Sites from ID %d are missing' % len(self))
+        self.sites = pd.concat([self.sites, new[self.sites.columns]])
+        self.names = pd.Index(self.sites['hospital'])
+        self.lat = self.sites['lat'].to_numpy(dtype=np.float64)
+        self.lon = self.sites['lon'].to_numpy(dtype=np.float64)
+        for hospital_id, name in zip(new.index, new['hospital']):
+            key = normalize(name)
+            if key not in self._by_name:
+                self._by_name[key] = hospital_id
+                self._index_grams(key, hospital_id)
+        # Names that matched nothing before may match a new site
+        self._resolved = {name: hospital_id for name, hospital_id
+                          in self._resolved.items() if hospital_id != UNMATCHED}
+
+    def resolve_name(self, name):
+        """Return the ID for a single free-text name, or UNMATCHED."""
+        key = normalize(name)
+        if key not in self._resolved:
+            hospital_id = self._by_name.get(key)
+            if hospital_id is None:
+                hospital_id = self._fuzzy(name)
+            self._resolved[key] = hospital_id
+        return self._resolved[key]
+
+    def resolve(self, names):
+        """Map a column of names to an int32 array of IDs."""
+        codes, uniques = pd.factorize(pd.Series(names, dtype=object))
+        ids = np.array([self.resolve_name(n) for n in uniques] + [UNMATCHED],
+                       dtype=np.int32)
+        # factorize marks missing names with -1, which picks UNMATCHED
+        return ids[codes]
+
+    def coordinates(self, ids):
+        """Return (lat, lon) arrays for IDs, NaN where UNMATCHED."""
+        ids = np.asarray(ids)
+        matched = ids != UNMATCHED
+        lat = np.where(matched, self.lat.take(ids, mode='clip'), np.nan)
+        lon = np.where(matched, self.lon.take(ids, mode='clip'), np.nan)
+        return lat, lon
+
+    def categorical(self, ids):
+        """Return hospital names for IDs without copying any strings."""
+        return pd.Categorical.from_codes(np.asarray(ids), categories=self.names)
+
+    def _index_grams(self, name, hospital_id):
+        if len(name) < MIN_FUZZY_LENGTH:
+            return
+        grams = trigrams(name)
+        self._grams[name] = (hospital_id, grams)
+        for gram in grams:
+            self._postings[gram].append(name)
+
+    def _fuzzy(self, name):
+        best, best_rank = UNMATCHED, (0.0, 0)
+        for part in segments(name):
+            hospital_id = self._by_name.get(part)
+            if hospital_id is not None:
+                return hospital_id
+
+            grams = trigrams(part)
+            hits = defaultdict(int)
+            for gram in grams:
+                for candidate in self._postings.get(gram, ()):
+                    hits[candidate] += 1
+
+            # Prefer the most similar name, then the longest (most specific)
+            for candidate, count in hits.items():
+                hospital_id, candidate_grams = self._grams[candidate]
+                similarity = float(count) / len(grams | candidate_grams)
+                rank = (similarity, len(candidate))
+                if rank > best_rank:
+                    best, best_rank = hospital_id, rank
+        return best if best_rank[0] >= MIN_SIMILARITY else UNMATCHED
+
+
+def load(location=HOSPITALS_LOCATION, aliases_location=ALIASES_LOCATION):
+    sites = pd.read_csv(location)
+    aliases = None
+    if aliases_location and os.path.exists(aliases_location):
+        aliases = pd.read_csv(aliases_location)
+    return HospitalIndex(sites, aliases)
+
+
+def add_sites(places, location=HOSPITALS_LOCATION):
+    """
+    Append sites to a hospitals file and return them indexed by their IDs.
+
+    places maps a hospital name to a geocode.Place.
+    """
+    sites = pd.DataFrame(
+        [(name, 0, place.lat, place.lon, '[%s, %s]' % (place.lat, place.lon),
+          place.address) for name, place in places.items()],
+        columns=SITE_COLUMNS)
+    return _append(sites, location)
+
+
+def sync(location, source=HOSPITALS_LOCATION):
+    """
+    Bring a store's copy of the dimension at location up to date with source
+
+    A missing copy starts as source. Otherwise sites in source whose name
+    the copy doesn't have are appended, so sites keep their IDs whatever
+    happens to source. Returns the sites appended, indexed by their IDs.
+    """
+    if not os.path.exists(location):
+        os.makedirs(os.path.dirname(location) or '.', exist_ok=True)
+        store.replace_file(location, lambda f: _copy(source, f))
+        return pd.DataFrame(columns=SITE_COLUMNS)
+    known = set(normalize(name) for name in pd.read_csv(location, usecols=['hospital'])['hospital'])
+    sites = pd.read_csv(source).reindex(columns=SITE_COLUMNS)
+    sites = sites[[normalize(name) not in known for name in sites['hospital']]]
+    return _append(sites.drop_duplicates(subset='hospital'), location)
+
+
+def _append(sites, location):
+    # The file is copied, appended to and swapped in (see
+    # store.replace_file), so readers never see a partial row and existing
+    # rows keep their IDs
+    first_id = len(pd.read_csv(location, usecols=['hospital']))
+    sites = sites.set_axis(pd.RangeIndex(first_id, first_id + len(sites)), axis=0)
+    if sites.empty:
+        return sites
+
+    def write(f):
+        _copy(location, f)
+        sites.to_csv(f, header=False, index=False)
+    store.replace_file(location, write)
+    return sites
+
+
+def _copy(location, f):
+    with open(location) as src:
+        shutil.copyfileobj(src, f)
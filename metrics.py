@@ -0,0 +1,281 @@
+"""
+Stage timings and row counts for the ingest pipeline and the dashboard
+
+Scheduler runs are recorded with a Run: each stage is timed, rows and
+bytes are counted against it, and when the run finishes one JSON line is
+appended to the run log and the registry is written out in Prometheus'
+text format, for node_exporter's textfile collector to pick up.
+
+The app times its stages with span and serves the same registry over HTTP
+when METRICS_PORT is set. Its first page load in each process is also
+recorded with startup: how long the imports, the data load and the first
+render took, and the process' age by then, appended as one JSON line per
+process to the startup log with the release it ran, so the cold start of
+each release can be compared, see benchmarks/startup.py.
+"""
+import collections
+import contextlib
+import datetime
+import json
+import os
+import threading
+import time
+import uuid
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               start_http_server, write_to_textfile)
+
+
+RUN_LOG_LOCATION = os.environ.get('RUN_LOG', './data/run-log.jsonl')
+METRICS_LOCATION = os.environ.get('METRICS_FILE', './data/metrics.prom')
+METRICS_PORT = os.environ.get('METRICS_PORT')
+STARTUP_LOG_LOCATION = os.environ.get('STARTUP_LOG', './data/startup-log.jsonl')
+# Set by Heroku's dyno metadata, or by hand
+RELEASE = os.environ.get('RELEASE') or os.environ.get('HEROKU_RELEASE_VERSION') or \
+    os.environ.get('SOURCE_VERSION') or 'unknown'
+STAGE_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60,
+                 120, 300, 600, float('inf'))
+
+REGISTRY = CollectorRegistry()
+STAGE_SECONDS = Histogram(
+    'ppe_stage_seconds', 'Time spent in each pipeline or dashboard stage',
+    ['component', 'stage'], buckets=STAGE_BUCKETS, registry=REGISTRY)
+ROWS = Counter(
+    'ppe_rows', 'Rows handled by each stage, by kind (in, out or a reason '
+    'they were dropped)', ['component', 'stage', 'kind'], registry=REGISTRY)
+BYTES_DOWNLOADED = Counter(
+    'ppe_downloaded_bytes', 'Response bytes received from Mixpanel, after decompression',
+    ['component'], registry=REGISTRY)
+LAST_RUN = Gauge(
+    'ppe_last_run_timestamp_seconds', 'When the last run finished',
+    ['component', 'status'], registry=REGISTRY)
+LAST_RUN_SECONDS = Gauge(
+    'ppe_last_run_seconds', 'How long the last run took',
+    ['component'], registry=REGISTRY)
+STARTUP_SECONDS = Gauge(
+    'ppe_app_startup_seconds', 'Time the first page load of this process '
+    'spent in each phase', ['phase'], registry=REGISTRY)
+
+_server_lock = threading.Lock()
+_server_port = None
+
+
+@contextlib.contextmanager
+def span(component, stage):
+    """Time a block and record it in the stage histogram."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(component, stage).observe(time.perf_counter() - started)
+
+
+def serve(port=METRICS_PORT):
+    """
+    Expose the registry on port from a background thread, once per process.
+
+    Safe to call on every Streamlit rerun; does nothing if port is unset.
+    """
+    global _server_port
+    if not port:
+        return
+    with _server_lock:
+        if _server_port is None:
+            start_http_server(int(port), registry=REGISTRY)
+            _server_port = int(port)
+
+
+class Startup(object):
+    """
+    Timings of the first page load in this process
+
+    Phases are timed with phase, or added with add, until finish writes
+    them out; later calls do nothing, so the app can call these on every
+    rerun.
+    """
+
+    def __init__(self, log_location=STARTUP_LOG_LOCATION, release=RELEASE):
+        self.log_location = log_location
+        self.release = release
+        self.lock = threading.Lock()
+        self.phases = collections.OrderedDict()
+        self.fields = {}
+        self.finished = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time a block as phase name, if the first page load is still going."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+    def add(self, name, seconds, **fields):
+        """Record a phase timed elsewhere, with extra fields for the log entry."""
+        with self.lock:
+            if not self.finished:
+                self.phases[name] = round(seconds, 6)
+                self.fields.update(fields)
+
+    def finish(self):
+        """Write the startup log entry and gauges, once per process."""
+        with self.lock:
+            if self.finished:
+                return None
+            self.finished = True
+        for name, seconds in self.phases.items():
+            STARTUP_SECONDS.labels(name).set(seconds)
+        uptime = _process_seconds()
+        if uptime is not None:
+            STARTUP_SECONDS.labels('process').set(uptime)
+
+        entry = collections.OrderedDict([
+            ('release', self.release),
+            ('started', datetime.datetime.now().isoformat()),
+            ('pid', os.getpid()),
+            ('process_seconds', None if uptime is None else round(uptime, 3)),
+        ])
+        entry.update(self.fields)
+        entry['phases'] = dict(self.phases)
+        if self.log_location:
+            _makedirs_for(self.log_location)
+            with open(self.log_location, 'a') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+        return entry
+
+
+startup = Startup()
+
+
+class Run(object):
+    """
+    One pass of a batch job, such as an ingest
+
+    Stages entered more than once, or timed over an iterator with
+    timed_iter, are summed and observed once per run. Nothing is written
+    until finish is called; log_location and metrics_location can be set
+    to None to skip either output.
+    """
+
+    def __init__(self, component, log_location=RUN_LOG_LOCATION,
+                 metrics_location=METRICS_LOCATION):
+        self.component = component
+        self.log_location = log_location
+        self.metrics_location = metrics_location
+        self.id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.stages = collections.OrderedDict()
+        self.fields = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block as stage name."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_time(name, time.perf_counter() - started)
+
+    def timed_iter(self, name, iterable, rows=len):
+        """
+        Yield from iterable, timing only the work of producing each item
+        and counting rows(item) as the stage's rows out.
+        """
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._add_time(name, time.perf_counter() - started)
+                return
+            self._add_time(name, time.perf_counter() - started)
+            self.count(name, 'out', rows(item))
+            yield item
+
+    def count(self, stage, kind, rows):
+        """Add rows to a stage's count of kind, e.g. 'in', 'out' or 'dropped_non_gb'."""
+        rows = int(rows)
+        record = self._stage(stage)
+        record['rows'][kind] = record['rows'].get(kind, 0) + rows
+        ROWS.labels(self.component, stage, kind).inc(rows)
+
+    def add(self, stage, seconds=0.0, rows=None):
+        """
+        Add time and row counts measured elsewhere, e.g. in a worker
+        process, to a stage.
+        """
+        self._add_time(stage, seconds)
+        for kind, count in (rows or {}).items():
+            self.count(stage, kind, count)
+
+    def downloaded(self, nbytes):
+        self.fields['bytes_downloaded'] = self.fields.get('bytes_downloaded', 0) + nbytes
+        BYTES_DOWNLOADED.labels(self.component).inc(nbytes)
+
+    def set(self, **fields):
+        """Attach extra fields, e.g. the date range, to the run log entry."""
+        self.fields.update(fields)
+
+    def finish(self, status='ok'):
+        """Append the run to the run log and write the metrics file."""
+        seconds = time.time() - self.started
+        for name, record in self.stages.items():
+            STAGE_SECONDS.labels(self.component, name).observe(record['seconds'])
+        LAST_RUN.labels(self.component, status).set(time.time())
+        LAST_RUN_SECONDS.labels(self.component).set(seconds)
+
+        entry = collections.OrderedDict([
+            ('run', self.id),
+            ('component', self.component),
+            ('started', datetime.datetime.fromtimestamp(self.started).isoformat()),
+            ('seconds', round(seconds, 3)),
+            ('status', status),
+        ])
+        entry.update(self.fields)
+        entry['stages'] = [dict(stage=name, **record)
+                           for name, record in self.stages.items()]
+
+        if self.log_location:
+            _makedirs_for(self.log_location)
+            with open(self.log_location, 'a') as f:
+                f.write(json.dumps(entry, default=str) + '\n')
+        if self.metrics_location:
+            _makedirs_for(self.metrics_location)
+            write_to_textfile(self.metrics_location, REGISTRY)
+        return entry
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.finish('ok' if exc_type is None else 'failed')
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {'seconds': 0.0, 'rows': {}}
+        return self.stages[name]
+
+    def _add_time(self, name, seconds):
+        record = self._stage(name)
+        record['seconds'] = round(record['seconds'] + seconds, 6)
+
+
+def _process_seconds():
+    # Seconds since this process started, from /proc where there is one
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the command, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+    return uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+
+
+def _makedirs_for(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
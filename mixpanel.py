@@ -2,27 +2,72 @@
 A library to request data from Mixpanel's Raw Data Export API 
 Writtne by Ed Wallitt from Induction Healthcare Group PLC
 """
+import calendar
+import collections
 import datetime
+import gzip
 import hashlib
+import operator
+import os
+import random
+import re
+import threading
 import time
-import urllib.error
+from concurrent.futures import ThreadPoolExecutor
 import urllib.parse
-import urllib.request
 
+import numpy as np
 import pandas as pd
+import requests
 
 try:
     import json
 except ImportError:
     import simplejson as json
 
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _decoder = json.JSONDecoder()
+
+    def _loads(line):
+        # Skips json.loads' per-call encoding detection and wrapper checks
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        return _decoder.raw_decode(line.strip())[0]
+
 
 VERSION = '2.0'  # Mixpanel API version
 date_format = '%Y-%m-%d'  # Mixpanel's API date format
+DEFAULT_CHUNKSIZE = 100000  # Events per DataFrame when streaming exports
+DEFAULT_WORKERS = 4  # Concurrent export requests when sharding
+DEFAULT_RETRIES = 3  # Attempts per shard after the first has failed
+SHARD_DAYS = {'day': 1, 'week': 7}
+DEFAULT_CACHE_BYTES = 2 * 1024 ** 3  # Compressed responses kept on disk
+API_BASE = 'https://mixpanel.com/api'
+DATA_API_BASE = 'https://data.mixpanel.com/api'
+CONNECT_TIMEOUT = 10  # Seconds to establish a connection
+READ_TIMEOUT = 120  # Seconds to wait for the next bytes of a response
+BACKOFF = 1.0  # Seconds before the first retry, doubled on each attempt
+MAX_BACKOFF = 60.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+STREAM_BUFFER = 1024 ** 2  # Bytes buffered when streaming a response
+# Properties decoded to compact types instead of Python objects
+CATEGORICAL_COLUMNS = ['hospital', 'mp_country_code']
+BOOLEAN_COLUMNS = ['sufficient-supply']
+FILTER_OPERATORS = ['==', '!=', '<', '<=', '>', '>=', 'in', 'not in']
+# Query strings in error messages, which carry the API key and signature
+_QUERY = re.compile(r'\?[^\s\'"()]*')
+_ORDERINGS = {'<': operator.lt, '<=': operator.le, '>': operator.gt,
+              '>=': operator.ge}
 
 
 def read_events(keys, events=None, start=None, end=None, 
-                where=None, bucket=None, columns=None, exclude_mp=True):
+                where=None, bucket=None, columns=None, exclude_mp=True,
+                chunksize=None, shard=None, workers=DEFAULT_WORKERS,
+                retries=DEFAULT_RETRIES, cache=None, filters=None,
+                pushdown=True):
     """
     Request data from Mixpanel's Raw Data Export API and return as a pandas
     DataFrame with event times converted to pandas Timestamp objects
@@ -53,12 +98,163 @@ def read_events(keys, events=None, start=None, end=None,
         Filter out event properties that begin with '$' or 'mp_'.
         These properties are automatically inserted by Mixpanel and indicate
         things like region, OS, etc.
+    chunksize: int, optional
+        If specified, return an iterator of DataFrames holding at most
+        chunksize events each instead of a single DataFrame. The response
+        is read incrementally, so memory use is bounded by the chunk size
+        rather than the size of the export. See iter_events.
+    shard: 'day' or 'week', optional
+        Split the date range into shards of this length and fetch them
+        concurrently instead of sending one request for the whole range.
+        Results are merged back in date order.
+    workers: int, default 4
+        Maximum number of shards fetched at the same time
+    retries: int, default 3
+        Number of times a failed request (or shard) is retried, with
+        jittered exponential backoff, before the whole read fails
+    cache: ResponseCache, optional
+        Serve exports of days before yesterday from this on-disk cache,
+        and store them there after downloading
+    filters: list of (property, operator, value) tuples, optional
+        Only return events matching every filter, e.g.
+        [('mp_country_code', '==', 'GB')]. Operators are ==, !=, the
+        numeric comparisons <, <=, > and >=, and in and not in with a list
+        of values. The filters are sent to Mixpanel as a where expression
+        (see where_expression), ANDed with where, so that only matching
+        events are downloaded and decoded. They are also applied to every
+        decoded batch, so the result is correct even when the server
+        ignores them. Filtered properties need not be in columns.
+    pushdown: Send filters to Mixpanel. default True
+        When False, filters are only applied locally.
 
     For more information, see: 
     https://mixpanel.com/docs/api-documentation/exporting-raw-data-you-inserted-into-mixpanel
 
     """
+    if chunksize is not None:
+        return iter_events(keys, events=events, start=start, end=end,
+                           where=where, bucket=bucket, columns=columns,
+                           exclude_mp=exclude_mp, chunksize=chunksize,
+                           shard=shard, workers=workers, retries=retries,
+                           cache=cache, filters=filters, pushdown=pushdown)
+
+    payload = _export_payload(events, start, end, where, bucket,
+                              filters if pushdown else None)
+    if shard is not None:
+        frames = list(_read_shards(keys, payload, columns, exclude_mp,
+                                   shard, workers, retries, cache, filters))
+        return _concat(frames)
+
+    data = request(keys, ['export'], payload, data_api=True, cache=cache,
+                   retries=retries)
+
+    return _export_to_df(data, columns, exclude_mp, filters)
+
+
+def iter_events(keys, events=None, start=None, end=None, where=None,
+                bucket=None, columns=None, exclude_mp=True,
+                chunksize=DEFAULT_CHUNKSIZE, shard=None,
+                workers=DEFAULT_WORKERS, retries=DEFAULT_RETRIES, cache=None,
+                filters=None, pushdown=True):
+    """
+    Stream data from Mixpanel's Raw Data Export API as pandas DataFrames of
+    at most chunksize events each
+
+    Takes the same parameters as read_events. The export response is read
+    line by line as it arrives, so the first batch is available before the
+    download has finished and peak memory does not grow with the export.
 
+    Batches carry a continuous integer index across the whole export, as
+    with pandas.read_csv(..., chunksize=N). When columns is not given, each
+    batch holds the properties seen in that batch only.
+
+    When shard is given, shards are downloaded concurrently and batches are
+    cut from each shard in date order, so memory is bounded by the shard
+    size times the number of workers rather than by chunksize.
+
+    With filters, batches hold the matching events of up to chunksize
+    decoded events, so they can be smaller than chunksize.
+    """
+    if chunksize < 1:
+        raise ValueError('chunksize must be a positive integer')
+
+    payload = _export_payload(events, start, end, where, bucket,
+                              filters if pushdown else None)
+    if columns is not None:
+        columns = _with_time(columns)
+
+    offset = 0
+    if shard is not None:
+        for df in _read_shards(keys, payload, columns, exclude_mp, shard,
+                               workers, retries, cache, filters):
+            for i in range(0, len(df), chunksize):
+                batch = df.iloc[i:i + chunksize]
+                batch.index = pd.RangeIndex(offset, offset + len(batch))
+                offset += len(batch)
+                yield batch
+        return
+
+    with request(keys, ['export'], payload, data_api=True, stream=True,
+                 cache=cache, retries=retries) as response:
+        for df in _decode_batches(response, columns, exclude_mp, chunksize,
+                                  filters):
+            yield df
+
+
+def _read_shards(keys, payload, columns, exclude_mp, shard, workers,
+                 retries, cache=None, filters=None):
+    # Yields one DataFrame per shard in date order. Shards that finish early
+    # wait for earlier ones, and no more than workers shards are fetched
+    # ahead of the consumer, so a slow consumer bounds memory use.
+    shards = _date_shards(payload['from_date'], payload['to_date'], shard)
+    workers = max(1, workers)
+
+    def fetch(dates):
+        shard_payload = dict(payload, from_date=dates[0], to_date=dates[1])
+        data = request(keys, ['export'], shard_payload, data_api=True,
+                       cache=cache, retries=retries)
+        return _export_to_df(data, columns, exclude_mp, filters)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for dates in shards:
+            pending.append(executor.submit(fetch, dates))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _concat(frames):
+    # Each shard has its own categories, and concatenating categoricals
+    # that differ gives object columns; unify them first, as store.read does
+    for col in CATEGORICAL_COLUMNS:
+        parts = [f[col] for f in frames if col in f]
+        if len(parts) > 1 and all(isinstance(p.dtype, pd.CategoricalDtype)
+                                  for p in parts):
+            unified = pd.api.types.union_categoricals(parts, sort_categories=True)
+            for f in frames:
+                if col in f:
+                    f[col] = pd.Categorical(f[col], categories=unified.categories)
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def _date_shards(from_date, to_date, shard):
+    if shard not in SHARD_DAYS:
+        raise ValueError("shard must be one of %s" % sorted(SHARD_DAYS))
+    step = datetime.timedelta(SHARD_DAYS[shard])
+    start = datetime.datetime.strptime(from_date, date_format).date()
+    end = datetime.datetime.strptime(to_date, date_format).date()
+
+    shards = []
+    while start <= end:
+        stop = min(start + step - datetime.timedelta(1), end)
+        shards.append((start.strftime(date_format), stop.strftime(date_format)))
+        start = stop + datetime.timedelta(1)
+    return shards
+
+
+def _export_payload(events, start, end, where, bucket, filters=None):
     if start is None:
         # This default comes from an error message you'll receive if you 
         # try an start date earlier than 7/10/2011
@@ -80,67 +276,572 @@ def read_events(keys, events=None, start=None, end=None,
     if isinstance(events, str):
         events = [events]
 
+    if filters:
+        compiled = where_expression(filters)
+        where = '(%s) and (%s)' % (where, compiled) if where else compiled
+
     # Fill the payload with the parameters if they're specified
     params = {'event' : events, 'where' : where, 'bucket' : bucket}
     for k, v in params.items():
         if v is not None:
             payload[k] = v
 
-    data = request(keys, ['export'], payload, data_api=True)
-
-    return _export_to_df(data, columns, exclude_mp)
+    return payload
 
 
-def _export_to_df(data, columns, exclude_mp):
-    # Keep track of the parameters each returned event
-    parameters = set()
-
+def _export_to_df(data, columns, exclude_mp, filters=None):
     # Calls to the data export API do not return JSON.  They return
     # records separated by newlines, where each record is valid JSON.
+    if isinstance(data, bytes):
+        data = data.split(b'\n')
+    if columns is not None:
+        columns = _with_time(columns)
+
+    for df in _decode_batches(data, columns, exclude_mp, filters=filters):
+        return df
+    return _to_df({c: [] for c in columns or ['time']})
+
+
+def _decode_batches(lines, columns, exclude_mp, chunksize=None, filters=None):
+    """
+    Decode export lines into DataFrames of at most chunksize events
+
+    When columns are known the requested properties of each event are
+    appended straight to one buffer per column, so no per-event dict is
+    kept and properties that weren't asked for are never copied. Filtered
+    properties are decoded too, even those exclude_mp leaves out, and
+    dropped again once the batch has been filtered.
+    """
+    extra = []
+    if filters:
+        names = list(dict.fromkeys(f[0] for f in filters))
+        if columns is not None:
+            extra = [c for c in names if c not in columns]
+            columns = list(columns) + extra
+        elif exclude_mp:
+            extra = [c for c in names if _excluded(c)]
+
+    if columns is None:
+        batches = _record_batches(lines, exclude_mp, chunksize, keep=extra)
+    else:
+        batches = _column_batches(lines, columns, chunksize)
+
+    offset = 0
+    for buffers in batches:
+        df = _to_df(buffers, offset)
+        if filters:
+            df = df[filter_mask(df, filters)]
+            if extra:
+                # Properties no event in the batch had were never decoded
+                df = df.drop(columns=extra, errors='ignore')
+            df.index = pd.RangeIndex(offset, offset + len(df))
+        offset += len(df)
+        yield df
+
+
+def where_expression(filters):
+    """
+    Compile (property, operator, value) filters to a Mixpanel segmentation
+    expression, e.g. properties["mp_country_code"] == "GB"
+    """
+    clauses = []
+    for prop, op, value in _checked_filters(filters):
+        lhs = 'properties[%s]' % json.dumps(prop)
+        if op in ('in', 'not in'):
+            compare, join = ('==', ' or ') if op == 'in' else ('!=', ' and ')
+            clauses.append('(%s)' % join.join(
+                '%s %s %s' % (lhs, compare, json.dumps(v)) for v in value))
+        else:
+            clauses.append('%s %s %s' % (lhs, op, json.dumps(value)))
+    return ' and '.join(clauses)
+
+
+def filter_mask(df, filters):
+    """
+    Return a boolean array of the rows of df matching every filter
+
+    Evaluates filters the way Mixpanel evaluates the where expression
+    from where_expression. A property missing from df matches only != and
+    not in.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for prop, op, value in _checked_filters(filters):
+        if prop in df:
+            values = df[prop]
+        else:
+            values = pd.Series([None] * len(df), index=df.index, dtype=object)
+        if op == 'in':
+            matched = values.isin(value)
+        elif op == 'not in':
+            matched = ~values.isin(value)
+        elif op in ('==', '!='):
+            matched = values.astype(object) == value
+            if op == '!=':
+                matched = ~matched
+        else:
+            numbers = pd.to_numeric(values.astype(object), errors='coerce')
+            matched = _ORDERINGS[op](numbers, value)
+        mask &= np.asarray(matched, dtype=bool)
+    return mask
+
+
+def _checked_filters(filters):
+    checked = []
+    for prop, op, value in filters:
+        if op not in FILTER_OPERATORS:
+            raise ValueError('Unsupported filter operator %r, use one of %s'
+                             % (op, FILTER_OPERATORS))
+        if prop == 'time':
+            raise ValueError('Filter on time with start and end instead')
+        if op in ('in', 'not in'):
+            value = list(value)
+            if not value:
+                raise ValueError('%r filter on %s needs at least one value'
+                                 % (op, prop))
+        elif value is None:
+            raise ValueError('Filter on %s compares with None' % prop)
+        elif op in _ORDERINGS and not isinstance(value, (int, float)):
+            raise ValueError('%r filter on %s needs a number' % (op, prop))
+        checked.append((prop, op, value))
+    return checked
+
+
+def _column_batches(lines, columns, chunksize):
+    with_event = 'event' in columns
+    buffers = {c: [] for c in columns}
+    appends = [(c, buffers[c].append) for c in columns]
+    size = 0
+    for line in lines:
+        try:
+            event = _loads(line)
+            properties = event['properties']
+            if with_event:
+                properties['event'] = event['event']
+        except ValueError:  # Not valid JSON
+            continue
+        get = properties.get
+        for c, append in appends:
+            append(get(c))
+        size += 1
+        if chunksize and size >= chunksize:
+            yield buffers
+            buffers = {c: [] for c in columns}
+            appends = [(c, buffers[c].append) for c in columns]
+            size = 0
+    if size:
+        yield buffers
+
+
+def _record_batches(lines, exclude_mp, chunksize, keep=()):
+    # Without columns the union of every event's properties is needed, so
+    # events are kept as dicts until the batch is complete
+    batch = []
+    for ev in _iter_records(lines):
+        batch.append(ev)
+        if chunksize and len(batch) >= chunksize:
+            yield _records_to_columns(batch, exclude_mp, keep)
+            batch = []
+    if batch:
+        yield _records_to_columns(batch, exclude_mp, keep)
+
+
+def _iter_records(lines):
     # The event parameters are in the properties field
-    events = []
-    for line in data.split(b'\n'):
+    for line in lines:
         try:
-            event = json.loads(line)
+            event = _loads(line)
             ev = event['properties']
             ev['event']=event['event']
         except ValueError:  # Not valid JSON
             continue
 
-        parameters.update(list(ev.keys()))
-        events.append(ev)
+        yield ev
+
+
+def _records_to_columns(events, exclude_mp, keep=()):
+    # Keep track of the parameters each returned event
+    parameters = set()
+    for ev in events:
+        parameters.update(ev.keys())
 
     # If columns is excluded, leave off parameters that start with '$' as
     # these are automatically included in the Mixpanel events and clutter the
-    # real data
-    if columns is None:
-        if exclude_mp:
-            columns = [p for p in parameters if not (p.startswith('$') or
-                                                     p.startswith('mp_'))]
+    # real data, unless they are kept to be filtered on
+    if exclude_mp:
+        columns = [p for p in parameters if not _excluded(p) or p in keep]
+    else:
+        columns = list(parameters)
+    return {c: [ev.get(c) for ev in events] for c in columns}
+
+
+def _excluded(name):
+    # Properties Mixpanel adds itself, left off when exclude_mp is set
+    return name.startswith('$') or name.startswith('mp_')
+
+
+def _with_time(columns):
+    if isinstance(columns, str):
+        columns = [columns]
+    if 'time' not in columns:
+        columns = list(columns) + ['time']
+    return columns
+
+
+def _to_df(buffers, offset=0):
+    data = {}
+    for c, values in buffers.items():
+        if c == 'time':
+            data[c] = _to_datetime(values)
+        elif c in CATEGORICAL_COLUMNS:
+            data[c] = pd.Categorical(values)
+        elif c in BOOLEAN_COLUMNS:
+            data[c] = _to_bool(values)
+        else:
+            data[c] = values
+    size = len(buffers['time']) if 'time' in buffers else 0
+    return pd.DataFrame(data, columns=list(buffers),
+                        index=pd.RangeIndex(offset, offset + size))
+
+
+def _to_datetime(seconds):
+    # Same result as datetime.fromtimestamp on every value: naive local time.
+    # UTC offsets only change on quarter hour boundaries, so they are looked
+    # up once per distinct quarter hour instead of once per event.
+    epoch = np.asarray(seconds)
+    missing = None
+    if epoch.dtype.kind not in 'iu':  # Missing, fractional or string times
+        epoch = pd.to_numeric(pd.Series(seconds, dtype=object)).to_numpy(np.float64)
+        missing = np.isnan(epoch)
+        epoch = np.where(missing, 0, epoch)
+
+    quarters, inverse = np.unique(epoch // 900, return_inverse=True)
+    offsets = np.array([_utc_offset(int(q) * 900) for q in quarters],
+                       dtype=np.int64)
+    times = pd.to_datetime(epoch + offsets[inverse], unit='s')
+    if missing is not None:
+        times = times.where(~missing)
+    return times.values
+
+
+def _utc_offset(timestamp):
+    return calendar.timegm(time.localtime(timestamp)) - timestamp
+
+
+def _to_bool(values):
+    array = np.asarray(values)
+    if array.dtype == np.bool_:
+        return array
+    return values  # Missing answers; keep them rather than guess
+
+
+class Transport(object):
+    """
+    HTTP transport used by request
+
+    Keeps connections alive in a pool shared by all requests, asks for gzip
+    and decompresses streamed responses as they are read, applies connect
+    and read timeouts and retries connection errors, timeouts and 429/5xx
+    responses with jittered exponential backoff, honouring Retry-After.
+
+    api_base and data_api_base can point at a local stand-in server.
+    """
+
+    def __init__(self, api_base=API_BASE, data_api_base=DATA_API_BASE,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                 retries=DEFAULT_RETRIES, backoff=BACKOFF,
+                 max_backoff=MAX_BACKOFF, pool_size=DEFAULT_WORKERS):
+        self.api_base = api_base
+        self.data_api_base = data_api_base
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.bytes_received = 0  # Decompressed response bytes, all threads
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip'
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, url, stream=False, retries=None):
+        """
+        GET url and return the response, raising requests.HTTPError for
+        error statuses that are not retried or still fail after retries.
+        Unless stream is set the body is read inside the retry loop.
+
+        Errors raised name the URL without its query string, so the API key
+        and signature never reach logs or tracebacks.
+        """
+        if retries is None:
+            retries = self.retries
+        for attempt in range(retries + 1):
+            retry_after = None
+            try:
+                response = self.session.get(url, stream=stream,
+                                            timeout=self.timeout)
+                if response.status_code in RETRY_STATUSES and attempt < retries:
+                    retry_after = _retry_after(response)
+                    response.close()
+                else:
+                    try:
+                        response.raise_for_status()
+                    except requests.HTTPError as e:
+                        raise _redacted(e) from None
+                    if not stream:
+                        # Read now so failures are retried
+                        self.received(len(response.content))
+                    return response
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if attempt == retries:
+                    raise _redacted(e) from None
+            time.sleep(self._delay(attempt, retry_after))
+
+    def received(self, nbytes):
+        with self._lock:
+            self.bytes_received += nbytes
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        # Full jitter keeps concurrent shards from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
+
+
+def _redacted(error):
+    # The same error with query strings cut from its message
+    return type(error)(_QUERY.sub('', str(error)), response=error.response)
+
+
+def _retry_after(response):
+    try:
+        return max(0.0, float(response.headers['Retry-After']))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Return the Transport used when request isn't given one."""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = Transport()
+        return _transport
+
+
+def set_transport(transport):
+    """Replace the default Transport, e.g. with one for a test server."""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+
+
+class _LineStream(object):
+    # Iterates a streamed response line by line, decompressing as it goes
+    def __init__(self, response, transport=None):
+        self.response = response
+        self.transport = transport
+
+    def __iter__(self):
+        pending = b''
+        for chunk in self.response.iter_content(STREAM_BUFFER):
+            self._received(len(chunk))
+            lines = (pending + chunk).split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
+
+    def read(self):
+        data = b''.join(self.response.iter_content(STREAM_BUFFER))
+        self._received(len(data))
+        return data
+
+    def close(self):
+        self.response.close()
+
+    def _received(self, nbytes):
+        if self.transport is not None:
+            self.transport.received(nbytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ResponseCache(object):
+    """
+    On-disk cache of raw data API responses
+
+    Entries are gzip files named by a hash of the request's meaning (method,
+    event, dates, where, bucket and format), leaving out the key, expiry and
+    signature that change on every call. Only exports ending before
+    yesterday are cached, as Mixpanel can still add late events to more
+    recent days, and cached entries never expire. The least recently used
+    entries are deleted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, location, max_bytes=DEFAULT_CACHE_BYTES):
+        self.location = location
+        self.max_bytes = max_bytes
+
+    def key(self, methods, params, format='json', data_api=False):
+        semantic = {k: v for k, v in params.items()
+                    if k not in ('api_key', 'expire', 'sig')}
+        semantic.update(methods=list(methods), format=format,
+                        data_api=bool(data_api))
+        return hashlib.sha256(
+            json.dumps(semantic, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+    def cacheable(self, params):
+        to_date = params.get('to_date')
+        if to_date is None:
+            return False
+        yesterday = datetime.date.today() - datetime.timedelta(1)
+        return to_date < yesterday.strftime(date_format)
+
+    def path(self, key):
+        return os.path.join(self.location, key[:2], key + '.gz')
+
+    def get(self, key):
+        """Return the cached bytes for key, or None."""
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            return f.read()
+
+    def open(self, key):
+        """Return the cached response for key as a binary file, or None."""
+        path = self.path(key)
+        try:
+            f = gzip.open(path, 'rb')
+            os.utime(path)  # Mark as recently used for eviction
+        except (IOError, OSError):
+            return None
+        return f
+
+    def put(self, key, data):
+        with self.writer(key) as f:
+            f.write(data)
+
+    def writer(self, key):
+        return _CacheWriter(self, key)
+
+    def evict(self):
+        entries = []
+        for root, _, files in os.walk(self.location):
+            for name in files:
+                if name.endswith('.gz'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:  # Removed by another writer
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class _CacheWriter(object):
+    # Writes an entry under a temporary name and only publishes it once
+    # complete, so concurrent readers never see a partial response
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.path = cache.path(key)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.tmp_path = '%s.%d.%d.tmp' % (self.path, os.getpid(),
+                                          id(self))
+        self.file = gzip.open(self.tmp_path, 'wb')
+
+    def write(self, data):
+        self.file.write(data)
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+        self.cache.evict()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+class _CachingResponse(object):
+    # Yields a live response line by line while copying it into the cache.
+    # The entry is only kept if the whole response was read.
+    def __init__(self, response, writer):
+        self.response = response
+        self.writer = writer
+        self.complete = False
+
+    def __iter__(self):
+        for line in self.response:
+            self.writer.write(line)
+            yield line
+        self.complete = True
+
+    def close(self):
+        self.response.close()
+        if self.complete:
+            self.writer.commit()
         else:
-            columns = parameters
-    elif 'time' not in columns:
-        columns.append('time')
-    df = pd.DataFrame(events, columns=columns)
+            self.writer.discard()
 
-    # Make time a datetime.
-    df['time'] = df['time'].map(lambda x: datetime.datetime.fromtimestamp(x))
+    def __enter__(self):
+        return self
 
-    return df
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
 
 # The code below is from Mixpanel's Python client for the data export API.
 # There are only a few modifications:
 #     * Add data_api optional argument
-#     * Change the base URL to http://data.mixpanel.com if data_api is set
+#     * Change the base URL to https://data.mixpanel.com if data_api is set
 #     * make it a function that takes keys instead of a class initialized
 #       with the keys (this is just a personal preference)
 #     * Changed max. line width
+#     * Add stream, cache, transport and retries optional arguments
+#     * Send requests through a pooled, retrying Transport over https
 # Mixpanel, Inc. -- http://mixpanel.com/
 #
 # Python API client library to consume mixpanel.com analytics data.
 # https://mixpanel.com/site_media//api/v2/mixpanel.py
-def request(keys, methods, params, format='json', data_api=False):
+def request(keys, methods, params, format='json', data_api=False,
+            stream=False, cache=None, transport=None, retries=None):
     """
         methods - List of methods to be joined, 
                       e.g. ['events', 'properties', 'values']
@@ -148,7 +849,31 @@ def request(keys, methods, params, format='json', data_api=False):
                       http://mixpanel.com/api/2.0/events/properties/values/
 
         params - Extra parameters associated with method
+
+        stream - Return the open response instead of reading it, so that
+                 large data API exports can be consumed line by line. The
+                 caller is responsible for closing it.
+
+        cache - ResponseCache to serve data API responses for past days
+                from, and to store them in
+
+        transport - Transport to send the request with, defaults to the
+                    shared one from get_transport
+
+        retries - Override the transport's number of retries
     """
+    cache_key = None
+    if cache is not None and data_api and cache.cacheable(params):
+        cache_key = cache.key(methods, params, format, data_api)
+        if stream:
+            cached = cache.open(cache_key)
+            if cached is not None:
+                return cached
+        else:
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
     api_key, api_secret = keys
 
     params['api_key'] = api_key
@@ -157,16 +882,26 @@ def request(keys, methods, params, format='json', data_api=False):
     if 'sig' in params: del params['sig']
     params['sig'] = hash_args(params, api_secret)
 
+    if transport is None:
+        transport = get_transport()
+
     if data_api:
-        url_base = r'http://data.mixpanel.com/api'
+        url_base = transport.data_api_base
     else:
-        url_base = r'http://mixpanel.com/api'
+        url_base = transport.api_base
 
     request_url = ('/'.join([url_base, str(VERSION)] + methods) + '/?' + 
                    unicode_urlencode(params))
 
-    request = urllib.request.urlopen(request_url)
-    data = request.read()
+    response = transport.get(request_url, stream=stream, retries=retries)
+    if stream:
+        lines = _LineStream(response, transport)
+        if cache_key is not None:
+            return _CachingResponse(lines, cache.writer(cache_key))
+        return lines
+    data = response.content
+    if cache_key is not None:
+        cache.put(cache_key, data)
 
     if data_api:
         return data
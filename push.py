@@ -0,0 +1,323 @@
+"""
+Push ingestion of survey responses over HTTP
+
+Mixpanel's export only reaches yesterday, so the scheduler can't show
+today's responses. This service accepts ppe-survey-1 events pushed as
+NDJSON in Mixpanel's event format, e.g. forwarded from the app backend:
+
+    POST /events
+    {"event": "ppe-survey-1", "properties": {"time": 1592900000, "distinct_id": "...", ...}}
+
+Events are buffered in memory and every FLUSH_SECONDS written to a new
+version of the published dataset by the scheduler's own pipeline (hospital
+matching, geocoding, collapsing repeats), then published, so they reach
+the dashboard within seconds. Events are keyed by time and distinct_id, as
+in the scheduler, so replayed events are dropped here, and when the export
+catches up with them they go into the raw CSV but aren't stored twice. Events more than LOOKBACK_DAYS old are left
+to the export. A flush waits for the next turn while a scheduler run holds
+the ingest lock.
+
+    python push.py --port 8000
+"""
+import argparse
+import datetime
+import gzip
+import http.server
+import logging
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from prometheus_client import generate_latest
+
+import charts
+import metrics
+import mixpanel as mp
+import rollups
+import scheduler
+import snapshot
+import store
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+PORT = int(os.environ.get('PUSH_PORT', 8000))
+# Clients must send 'Authorization: Bearer <token>' when this is set
+TOKEN = os.environ.get('PUSH_TOKEN')
+FLUSH_SECONDS = float(os.environ.get('PUSH_FLUSH_SECONDS', 2))
+CHART_SECONDS = 60  # Charts take seconds to draw, so are redrawn less often
+LOOKBACK_DAYS = 2  # Older events are rejected as stale
+MAX_BUFFER = 100000  # Events held before clients are asked to retry
+MAX_BODY = 10 * 1024 * 1024
+EVENTS_PATH = '/events'
+
+logger = logging.getLogger(__name__)
+
+
+class BufferFull(Exception):
+    pass
+
+
+class Pusher(object):
+    """
+    Buffers pushed events and publishes them in micro-batches
+
+    add is called from request threads and flush from one flushing
+    thread. The (time, distinct_id) keys stored from LOOKBACK_DAYS ago
+    on are read when a flush first sees a version it didn't publish
+    itself, and events whose key is among them are dropped.
+    """
+
+    def __init__(self, max_buffer=MAX_BUFFER, lookback_days=LOOKBACK_DAYS,
+                 chart_seconds=CHART_SECONDS):
+        self.max_buffer = max_buffer
+        self.lookback_days = lookback_days
+        self.chart_seconds = chart_seconds
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.seen = None
+        self.seen_version = None
+        self.seen_from = None
+        self.charts_drawn = 0.0
+        self.last_flush = None
+
+    def add(self, lines):
+        """
+        Buffer the valid ppe-survey-1 events among NDJSON lines.
+
+        Returns counts of lines accepted, ignored (other events), stale and
+        invalid. Raises BufferFull, buffering nothing, if they don't fit.
+        """
+        counts = {'accepted': 0, 'ignored': 0, 'stale': 0, 'invalid': 0}
+        oldest = time.time() - self.lookback_days * 86400
+        accepted = []
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                event = json.loads(line)
+                properties = event['properties']
+                event_time = float(properties['time'])
+                valid = isinstance(properties.get('distinct_id'), str)
+            except (ValueError, KeyError, TypeError):
+                valid = False
+            if not valid:
+                counts['invalid'] += 1
+            elif event.get('event') != scheduler.EVENT:
+                counts['ignored'] += 1
+            elif event_time < oldest:
+                counts['stale'] += 1
+            else:
+                accepted.append(line)
+        with self.lock:
+            if len(self.buffer) + len(accepted) > self.max_buffer:
+                raise BufferFull()
+            self.buffer.extend(accepted)
+        counts['accepted'] = len(accepted)
+        return counts
+
+    @property
+    def buffered(self):
+        return len(self.buffer)
+
+    def flush(self):
+        """
+        Publish the buffered events and return the rows written.
+
+        Events stay buffered while the ingest lock is held or nothing has
+        been published yet. A batch that fails is logged and dropped;
+        its events still arrive through the export.
+        """
+        with self.lock:
+            lines, self.buffer = self.buffer, []
+        if not lines:
+            return 0
+
+        with scheduler.ingest_lock() as locked:
+            state = store.current() if locked else None
+            if state is None:
+                with self.lock:
+                    self.buffer[:0] = lines
+                return 0
+            run = metrics.Run('push', None, None)
+            try:
+                rows = self._publish(lines, state, run)
+            except Exception:
+                logger.exception('Dropped a batch of %d pushed events', len(lines))
+                self.seen = None  # Its keys may not have been stored
+                rows = 0
+                run.finish('failed')
+            else:
+                run.finish()
+        self.last_flush = time.time()
+        return rows
+
+    def run(self, stop, every=FLUSH_SECONDS):
+        """Flush every `every` seconds until the stop event is set."""
+        while not stop.wait(every):
+            self.flush()
+        self.flush()
+
+    def _publish(self, lines, state, run):
+        with run.stage('decode'):
+            df = mp._export_to_df(b'\n'.join(lines), list(scheduler.COLUMNS), False)
+            # Pushed events are only told apart by their key, so a repeated
+            # key in a batch is a replay
+            df = df.drop_duplicates(subset=scheduler.DEDUPE_KEYS)
+        path = store.stage(state['path'])
+        store_root, rollup_root, chart_root, snapshot_file = scheduler._outputs(path)
+        try:
+            seen = self._seen(state, store_root, run)
+            start = df['time'].min().date()
+            rows, days = scheduler.ingest([df], run, store_root, seen=seen,
+                                          seed_from=start, processes=0)
+            if days:
+                with run.stage('rollups'):
+                    rollups.update(days, store_root, rollup_root)
+                if time.time() - self.charts_drawn >= self.chart_seconds:
+                    with run.stage('charts'):
+                        charts.build(rollup_root, chart_root)
+                    self.charts_drawn = time.time()
+                with run.stage('snapshot'):
+                    snapshot.build(rollup_root, snapshot_file)
+        except BaseException:
+            scheduler._discard(path)
+            raise
+        if not days:
+            scheduler._discard(path)
+            return 0
+
+        with run.stage('publish'):
+            manifest = store.publish(
+                path, store=store_root, rollups=rollup_root, charts=chart_root,
+                snapshot=snapshot_file, last_day=state['last_day'], raw_rows=state['raw_rows'],
+                raw_bytes=state.get('raw_bytes'), raw_offsets=state.get('raw_offsets'),
+                raw_offsets_from=state.get('raw_offsets_from'))
+        self.seen_version = manifest['version']
+        self.seen.update(zip(df['time'], df['distinct_id']))
+        logger.info('Published %d pushed responses as %s', rows, manifest['version'])
+        return rows
+
+    def _seen(self, state, root, run):
+        # Keys of stored responses, reread when another process published
+        # or the lookback window has moved on
+        since = datetime.date.today() - datetime.timedelta(self.lookback_days)
+        if self.seen is None or self.seen_version != state['version'] or \
+                self.seen_from != since:
+            with run.stage('dedupe'):
+                self.seen = scheduler.stored_keys(since, root)
+            self.seen_version, self.seen_from = state['version'], since
+        return self.seen
+
+
+class PushServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, pusher, port=PORT, host='', token=TOKEN):
+        http.server.HTTPServer.__init__(self, (host, port), PushHandler)
+        self.pusher = pusher
+        self.token = token
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d%s' % (self.server_address[1], EVENTS_PATH)
+
+
+class PushHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        # Requests refused before their body is read close the connection,
+        # or the body would be parsed as the next request
+        if urllib.parse.urlsplit(self.path).path != EVENTS_PATH:
+            return self._refuse(404, {'error': 'Unknown endpoint'})
+        if self.server.token and \
+                self.headers.get('Authorization') != 'Bearer ' + self.server.token:
+            return self._refuse(401, {'error': 'Invalid token'})
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            return self._refuse(411, {'error': 'Content-Length is required'})
+        if length > MAX_BODY:
+            return self._refuse(413, {'error': 'Body over %d bytes' % MAX_BODY})
+
+        body = self.rfile.read(length)
+        if 'gzip' in self.headers.get('Content-Encoding', ''):
+            try:
+                body = gzip.decompress(body)
+            except (OSError, EOFError):
+                return self._send(400, {'error': 'Invalid gzip body'})
+        try:
+            counts = self.server.pusher.add(body.split(b'\n'))
+        except BufferFull:
+            return self._send(503, {'error': 'Buffer full, retry later'},
+                              {'Retry-After': str(int(FLUSH_SECONDS) + 1)})
+        return self._send(202, counts)
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/health':
+            pusher = self.server.pusher
+            return self._send(200, {'buffered': pusher.buffered,
+                                    'last_flush': pusher.last_flush,
+                                    'version': store.version()})
+        if path == '/metrics':
+            return self._send_bytes(200, generate_latest(metrics.REGISTRY),
+                                    'text/plain; version=0.0.4')
+        return self._send(404, {'error': 'Unknown endpoint'})
+
+    def _refuse(self, status, payload):
+        self.close_connection = True
+        self._send(status, payload, {'Connection': 'close'})
+
+    def _send(self, status, payload, headers=None):
+        self._send_bytes(status, json.dumps(payload).encode('utf-8'),
+                         'application/json', headers)
+
+    def _send_bytes(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(port=PORT, every=FLUSH_SECONDS):
+    """Accept pushed events on port and flush them every `every` seconds."""
+    pusher = Pusher()
+    server = PushServer(pusher, port)
+    stop = threading.Event()
+    flusher = threading.Thread(target=pusher.run, args=(stop, every))
+    flusher.start()
+    logger.info('Accepting events at %s', server.url)
+    try:
+        server.serve_forever()
+    finally:
+        stop.set()
+        flusher.join()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Accept PPE responses pushed over HTTP')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--flush-seconds', type=float, default=FLUSH_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        serve(args.port, args.flush_seconds)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,160 @@
+"""
+Pre-aggregated rollups of the merged PPE responses
+
+The base cube holds response counts per day and hospital, split by answer.
+The daily, per-hospital and per-map-cell tables the dashboard shows are
+derived from it. Alongside them, sketches.py keeps HyperLogLog sketches
+of the distinct clinicians per day and hospital.
+All of them are small CSVs written once per ingest, and only the days that
+received new responses are recounted from the store.
+"""
+import os
+
+import pandas as pd
+
+import sketches
+import spatial
+import store
+
+
+ROLLUP_LOCATION = './data/rollups'
+CUBE = 'daily_hospital'
+DAILY = 'daily'
+HOSPITALS = 'hospitals'
+CELLS = 'cells'
+
+CUBE_COLUMNS = ['day_month', 'hospital', 'lat', 'lon',
+                'sufficient', 'insufficient', 'total']
+CUBE_TYPES = {'day_month': object, 'hospital': object, 'lat': 'float64',
+              'lon': 'float64', 'sufficient': 'int64', 'insufficient': 'int64',
+              'total': 'int64'}
+SOURCE_COLUMNS = ['day_month', 'hospital', 'sufficient-supply', 'lat', 'lon']
+SKETCH_COLUMNS = ['hospital_id', 'distinct_id']
+BUILD_DAYS = 31  # Days read from the store at once when recounting everything
+
+
+def build(root=store.STORE_LOCATION, location=ROLLUP_LOCATION):
+    """
+    Recount every stored day and rewrite all rollups.
+
+    Days are read BUILD_DAYS at a time, so only the cube and one batch of
+    responses are held in memory.
+    """
+    days = store.days(root)
+    hospital_index = store.dimension(root) if days else None
+    cubes, sketch_tables = [], []
+    for batch in (days[i:i + BUILD_DAYS] for i in range(0, len(days), BUILD_DAYS)):
+        df = store.read(root, columns=SOURCE_COLUMNS + SKETCH_COLUMNS,
+                        start=batch[0], end=batch[-1], hospital_index=hospital_index)
+        cubes.append(compute_cube(df))
+        sketch_tables.append(sketches.build(df))
+    cube = pd.concat(cubes, ignore_index=True) if cubes else empty_cube()
+    _write_all(cube, location, sketches.merge(sketch_tables))
+    return cube
+
+
+def update(days, root=store.STORE_LOCATION, location=ROLLUP_LOCATION):
+    """Recount only the given days and merge them into the stored rollups."""
+    days = sorted(set(pd.Timestamp(d).strftime(store.DAY_FORMAT) for d in days))
+    if not days:
+        return load(CUBE, location)
+    if not os.path.exists(_path(CUBE, location)) or \
+            not os.path.exists(os.path.join(location, sketches.SKETCH_FILE)):
+        return build(root, location)
+
+    df = store.read(root, columns=SOURCE_COLUMNS + SKETCH_COLUMNS,
+                    start=days[0], end=days[-1])
+    df = df[df['day_month'].isin(days)]
+    cube = load(CUBE, location)
+    cube = pd.concat([cube[~cube['day_month'].isin(days)], compute_cube(df)],
+                     ignore_index=True)
+    cube = cube.sort_values(['day_month', 'hospital']).reset_index(drop=True)
+    clinicians = sketches.merge([sketches.load(location), sketches.build(df)],
+                                replace_days=days)
+    _write_all(cube, location, clinicians)
+    return cube
+
+
+def load(name, location=ROLLUP_LOCATION):
+    if not os.path.exists(_path(name, location)):
+        # Nothing ingested yet; the tables of an empty cube keep their columns
+        return _tables(empty_cube())[name]
+    # Typed, as a table written with no rows reads back as object columns
+    return pd.read_csv(_path(name, location), dtype=CUBE_TYPES)
+
+
+def compute_cube(df):
+    """Count responses per day, hospital and answer."""
+    if df.empty:
+        return empty_cube()
+    counts = (df.groupby(['day_month', 'hospital', 'sufficient-supply'],
+                         observed=True)
+                .size()
+                .unstack(fill_value=0)
+                .reindex(columns=[True, False], fill_value=0))
+    counts.columns = ['sufficient', 'insufficient']
+    counts = counts.reset_index()
+    counts['day_month'] = counts['day_month'].astype(str)
+    counts['hospital'] = counts['hospital'].astype(str)
+
+    sites = df.groupby('hospital', observed=True)[['lat', 'lon']].first()
+    sites.index = sites.index.astype(str)
+    cube = counts.join(sites, on='hospital')
+    cube['total'] = cube['sufficient'] + cube['insufficient']
+    return cube[CUBE_COLUMNS].sort_values(['day_month', 'hospital']) \
+        .reset_index(drop=True)
+
+
+def empty_cube():
+    """A cube with no rows, typed so that sums over it keep their columns."""
+    return pd.DataFrame({c: pd.Series([], dtype=CUBE_TYPES[c]) for c in CUBE_COLUMNS})
+
+
+def daily(cube):
+    """Responses per day with positive and negative proportions."""
+    by_day = cube.groupby('day_month')[['sufficient', 'insufficient', 'total']] \
+        .sum().reset_index()
+    return _with_proportions(by_day)
+
+
+def by_hospital(cube):
+    """Cumulative responses per hospital, most negative first."""
+    by_site = cube.groupby('hospital').agg(
+        lat=('lat', 'first'),
+        lon=('lon', 'first'),
+        sufficient=('sufficient', 'sum'),
+        insufficient=('insufficient', 'sum'),
+        total=('total', 'sum'),
+    ).reset_index()
+    by_site = _with_proportions(by_site)
+    return by_site.sort_values(['proportion-positive', 'total'],
+                               ascending=[True, False]) \
+        .reset_index(drop=True)
+
+
+def cells(cube):
+    """Responses per day and map hexagon, see spatial.py."""
+    return _with_proportions(spatial.bin_counts(cube))
+
+
+def _with_proportions(df):
+    df['proportion-negative'] = (df['insufficient'] / df['total']) * 100
+    df['proportion-positive'] = (df['sufficient'] / df['total']) * 100
+    return df
+
+
+def _write_all(cube, location, clinicians):
+    os.makedirs(location, exist_ok=True)
+    sketches.save(clinicians, location)
+    for name, table in _tables(cube).items():
+        store.replace_file(_path(name, location),
+                           lambda f: table.to_csv(f, index=False))
+
+
+def _tables(cube):
+    return {CUBE: cube, DAILY: daily(cube), HOSPITALS: by_hospital(cube),
+            CELLS: cells(cube)}
+
+
+def _path(name, location):
+    return os.path.join(location, name + '.csv')
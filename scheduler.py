@@ -1,7 +1,27 @@
+import argparse
+import collections
+import contextlib
+import datetime
+import fcntl
+import logging
+import multiprocessing
 import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import requests
+import schedule
 import mixpanel as mp
+import charts
+import dedup
+import geocode
+import hospitals
+import metrics
+import rollups
+import snapshot
+import store
 
 MIXPANEL_API_KEY = os.environ.get('MIXPANEL_API_KEY')
 MIXPANEL_API_SECRET = os.environ.get('MIXPANEL_API_SECRET')
@@ -9,41 +29,581 @@ keys = (MIXPANEL_API_KEY, MIXPANEL_API_SECRET)
 
 DATA_LOCATION = './data/ppe-responses.csv'
 HOSPITALS_LOCATION = './data/hospital_locations.csv'
-FINAL_LOCATION = './data/ppe-merged-responses.csv'
+LOCK_LOCATION = './data/ingest.lock'
+CACHE_LOCATION = os.environ.get('MIXPANEL_CACHE_DIR', './data/mixpanel-cache')
 
 START_DATE = '22 April, 2020'
+CHUNKSIZE = 50000  # Events held in memory at once while downloading
+SHARD = 'week'  # Export date range is fetched in shards of this length
+WORKERS = int(os.environ.get('MIXPANEL_WORKERS', 4))
+# Processes transforming chunks in parallel; 0 transforms in this process
+PROCESSES = int(os.environ.get('INGEST_PROCESSES', min(4, os.cpu_count() or 1)))
+# Workers are started by a fork server, as forking this process would copy
+# the locks of the download threads running at the time
+START_METHOD = 'forkserver'
+# Keep appending raw events to DATA_LOCATION; the store does not need it
+RAW_SINK = os.environ.get('INGEST_RAW_CSV', '1') != '0'
+# How repeated answers are collapsed, one of dedup.POLICIES
+DEDUP_POLICY = os.environ.get('INGEST_DEDUP', 'latest-per-day')
+# Minutes between runs in daemon mode
+INTERVAL_MINUTES = int(os.environ.get('INGEST_INTERVAL_MINUTES', 15))
+# Days before the high-water mark that are fetched again to catch events
+# Mixpanel received late
+OVERLAP_DAYS = int(os.environ.get('INGEST_OVERLAP_DAYS', 1))
+CACHE = mp.ResponseCache(CACHE_LOCATION)
+SKIP_ROWS = 6  # Test responses submitted at launch, dropped on full runs
 
-def main():
+EVENT = 'ppe-survey-1'
+COLUMNS = ['time', 'mp_country_code', 'hospital', 'sufficient-supply', 'distinct_id']
+# Sent to Mixpanel as a where expression so other countries' responses are
+# never downloaded; transform still checks the country itself
+FILTERS = [('mp_country_code', '==', 'GB')]
+DEDUPE_KEYS = ['time', 'distinct_id']
+STORED_COLUMNS = list(store.NUMERIC_COLUMNS) + store.CATEGORICAL_COLUMNS
 
-    remote_df = mp.read_events(
+logger = logging.getLogger(__name__)
+_worker_hospital_index = None
+
+
+def main(full=False):
+    """
+    Bring the published responses up to date with Mixpanel.
+
+    By default only the days after the last fully ingested day (plus
+    OVERLAP_DAYS) are fetched and added to a copy of the published
+    version. Pass full=True, or delete store.MANIFEST_LOCATION, to rebuild
+    everything from START_DATE. Returns without doing anything if another
+    ingest holds LOCK_LOCATION.
+    """
+    with ingest_lock() as locked:
+        if not locked:
+            logger.info('Another ingest holds %s, skipping this run', LOCK_LOCATION)
+            return
+
+        end = datetime.date.today() - datetime.timedelta(1)
+        state = store.current()
+
+        with metrics.Run('scheduler') as run:
+            if full or state is None or not _raw_sink_intact(state):
+                run.set(mode='full', end=end)
+                return full_ingest(end, run)
+
+            last_day = datetime.datetime.strptime(state['last_day'], mp.date_format).date()
+            start = last_day - datetime.timedelta(OVERLAP_DAYS - 1)
+            run.set(mode='incremental', start=start, end=end)
+            if start > end:
+                return
+            incremental_ingest(start, end, state, run)
+
+
+def daemon(every=INTERVAL_MINUTES):
+    """
+    Run main now and then every `every` minutes until interrupted.
+
+    A failed run is logged and the next one goes ahead on schedule.
+    """
+    schedule.every(every).minutes.do(_run_logged)
+    _run_logged()
+    while True:
+        schedule.run_pending()
+        time.sleep(1)
+
+
+@contextlib.contextmanager
+def ingest_lock(path=LOCK_LOCATION):
+    """Hold an exclusive lock on path, yielding False if another process has it."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def full_ingest(end, run=None):
+    run = run or metrics.Run('scheduler', None, None)
+    path = store.stage()
+    store_root, rollup_root, chart_root, snapshot_file = _outputs(path)
+    sink = open(DATA_LOCATION + '.tmp', 'w') if RAW_SINK else None
+    offsets = {}
+    try:
+        chunks = fetch(pd.to_datetime(START_DATE), end, run)
+        rows, _ = ingest(chunks, run, store_root, sink=sink, header=True,
+                         skip=SKIP_ROWS, offsets=offsets)
+        if sink is not None:
+            sink.close()
+        with run.stage('rollups'):
+            rollups.build(store_root, rollup_root)
+        with run.stage('charts'):
+            charts.build(rollup_root, chart_root)
+        with run.stage('snapshot'):
+            snapshot.build(rollup_root, snapshot_file)
+    except BaseException:
+        _discard(path, sink)
+        raise
+
+    with run.stage('publish'):
+        if sink is not None:
+            os.replace(sink.name, DATA_LOCATION)
+        _publish(path, end, rows, offsets)
+
+
+def incremental_ingest(start, end, state, run=None):
+    run = run or metrics.Run('scheduler', None, None)
+    path = store.stage(state['path'])
+    store_root, rollup_root, chart_root, snapshot_file = _outputs(path)
+    sink = None
+    try:
+        # Events from the overlap days may already be stored; keep only new ones
+        raw_seen = None
+        with run.stage('dedupe'):
+            seen = stored_keys(start, store_root)
+            if RAW_SINK:
+                raw_seen = raw_keys(start, state)
+        if RAW_SINK:
+            # New rows go to a copy of the published ones, swapped in on
+            # publish like the rest of the version
+            shutil.copyfile(DATA_LOCATION, DATA_LOCATION + '.tmp')
+            os.truncate(DATA_LOCATION + '.tmp', state['raw_bytes'])
+            sink = open(DATA_LOCATION + '.tmp', 'a')
+        offsets = _raw_offsets(state)
+        chunks = fetch(start, end, run)
+        # The header is written with the first chunk, so it is still missing
+        # if no run has had any events
+        rows, days = ingest(chunks, run, store_root, sink=sink,
+                            header=not state['raw_bytes'], seen=seen,
+                            raw_seen=raw_seen, raw_rows=state['raw_rows'],
+                            seed_from=start, offsets=offsets)
+        if sink is not None:
+            sink.close()
+        if days:
+            with run.stage('rollups'):
+                rollups.update(days, store_root, rollup_root)
+            with run.stage('charts'):
+                charts.build(rollup_root, chart_root)
+            with run.stage('snapshot'):
+                snapshot.build(rollup_root, snapshot_file)
+    except BaseException:
+        _discard(path, sink)
+        raise
+
+    with run.stage('publish'):
+        if sink is not None:
+            os.replace(sink.name, DATA_LOCATION)
+        if days:
+            _publish(path, end, state['raw_rows'] + rows, offsets)
+        else:
+            # Nothing new to show; only move the high-water mark
+            _discard(path)
+            _publish(state['path'], end, state['raw_rows'] + rows, offsets)
+
+
+def ingest(chunks, run, root, sink=None, header=False, skip=0, seen=None,
+           raw_seen=None, raw_rows=0, seed_from=None, processes=PROCESSES,
+           offsets=None):
+    """
+    Run raw event chunks through the pipeline and write them to the store
+    at root
+
+    Chunks are joined up to CHUNKSIZE rows. The events whose key is not in
+    raw_seen (when given) are appended as CSV to the open file sink (when
+    given). Each chunk is then stripped of the events whose key is in seen
+    (when given) and of the first skip GB test responses, has hospital
+    names the store's hospital dimension doesn't know geocoded and is
+    transformed in a pool of processes processes, or in this one when it
+    is 0. At most two chunks per process are in flight.
+    Transformed chunks go, in order, through a dedup.Deduplicator applying
+    DEDUP_POLICY, which hands back whole days to write to the store. Memory
+    does not grow with the length of the history.
+
+    With seed_from, the responses stored from that day on are fed to the
+    deduplicator before the first new response, so that repeats are
+    collapsed across runs, and their days are rewritten.
+
+    With offsets, a dict of ISO day to sink position, the position each
+    chunk is written at is recorded against the last day it holds, keeping
+    the smallest, for raw_keys to find the overlap days again.
+
+    Returns the number of raw rows written and the days that were written.
+    """
+    first_row = raw_rows
+    # The store keeps its own copy of the dimension, so its IDs stay put
+    dimension_location = store.dimension_path(root)
+    hospitals.sync(dimension_location, HOSPITALS_LOCATION)
+    hospital_index = hospitals.load(dimension_location)
+    geocoder = _geocoder()
+    checked = set()
+    deduplicator = dedup.Deduplicator(DEDUP_POLICY)
+    days = set()
+
+    def write(merged_df):
+        if merged_df.empty:
+            return
+        with run.stage('write_store'):
+            # Days come back whole, so replace them, unless a response
+            # arrived too late for a day that was already written
+            day = merged_df.index.normalize()
+            late = day.isin(days)
+            store.write(merged_df[~late], root)
+            store.write(merged_df[late], root, append=True)
+        days.update(day.unique())
+
+    def prepared():
+        nonlocal raw_rows, skip, header
+        for chunk in _coalesce(chunks, CHUNKSIZE):
+            # The raw CSV and the store are deduplicated separately: events
+            # the store already has, e.g. pushed ones, still belong in the
+            # raw CSV when they first arrive from the export
+            raw = chunk
+            if raw_seen is not None:
+                with run.stage('dedupe'):
+                    raw = _drop_seen(chunk, raw_seen)
+                    run.count('dedupe', 'raw', len(raw))
+            raw.index = pd.RangeIndex(raw_rows, raw_rows + len(raw))
+            raw_rows += len(raw)
+            if sink is not None and (len(raw) or header):
+                with run.stage('write_raw'):
+                    if offsets is not None and len(raw):
+                        _record_offset(offsets, raw, sink.tell())
+                    raw.to_csv(sink, header=header)
+                header = False
+            if seen is not None:
+                with run.stage('dedupe'):
+                    run.count('dedupe', 'in', len(chunk))
+                    chunk = _drop_seen(chunk, seen)
+                    run.count('dedupe', 'out', len(chunk))
+            if skip:
+                chunk, dropped = _drop_test_rows(chunk, skip)
+                skip -= dropped
+                run.count('transform', 'in', dropped)
+                run.count('transform', 'dropped_test', dropped)
+            if geocoder is not None:
+                with run.stage('geocode'):
+                    _geocode_new(chunk, hospital_index, geocoder, checked, run,
+                                 dimension_location)
+            yield chunk
+
+    for merged_df, rows, seconds in _transform_all(prepared(), hospital_index, processes):
+        run.add('transform', seconds, rows)
+        if merged_df.empty:
+            continue
+        with run.stage('collapse'):
+            if seed_from is not None:
+                stored = store.read(root, columns=STORED_COLUMNS, start=seed_from,
+                                    hospital_index=hospital_index)
+                run.count('collapse', 'stored', len(stored))
+                write(deduplicator.seed(stored))
+                seed_from = None
+            run.count('collapse', 'in', len(merged_df))
+            closed = deduplicator.push(merged_df)
+        write(closed)
+    with run.stage('collapse'):
+        closed = deduplicator.flush()
+    write(closed)
+
+    run.count('collapse', 'collapsed', deduplicator.collapsed)
+    if geocoder is not None:
+        for kind, count in geocoder.stats.items():
+            run.count('geocode', kind, count)
+    logger.info('Collapsed %d repeated responses (%s)', deduplicator.collapsed,
+                DEDUP_POLICY)
+    return raw_rows - first_row, sorted(days)
+
+
+def fetch(start, end, run=None):
+    """
+    Stream events between start and end. With a run, the time spent
+    downloading and decoding, the rows and the bytes downloaded are
+    recorded under the fetch stage.
+    """
+    chunks = mp.read_events(
         keys,
-        events='ppe-survey-1',
-        start=START_DATE,
+        events=EVENT,
+        start=start,
+        end=end,
         exclude_mp=False,
-        columns=['time', 'mp_country_code', 'hospital', 'sufficient-supply', 'distinct_id']
+        columns=list(COLUMNS),
+        chunksize=CHUNKSIZE,
+        shard=SHARD,
+        workers=WORKERS,
+        cache=CACHE,
+        filters=FILTERS
     )
-    remote_df.to_csv(DATA_LOCATION)
-
-    local_df = pd.read_csv(DATA_LOCATION,
-                           index_col='distinct_id',
-                           parse_dates=['time']
-                           )
-
-    gb_df = local_df[local_df["mp_country_code"] == 'GB'][6:]
-    gb_df['year'] = pd.DatetimeIndex(gb_df['time']).year
-    gb_df['month'] = pd.DatetimeIndex(gb_df['time']).month
-    gb_df['day'] = pd.DatetimeIndex(gb_df['time']).day
-    gb_df['hour'] = pd.DatetimeIndex(gb_df['time']).hour
-    gb_df['day_month'] = pd.DatetimeIndex(gb_df['time']).to_period('D')
-
-    geocoded_hospitals_df = pd.read_csv(HOSPITALS_LOCATION, index_col='address')
-    merged_df = pd.merge(left=gb_df, how='left', right=geocoded_hospitals_df, left_on='hospital',
-                         right_on='hospital')
-    merged_df.set_index('time', inplace=True)
+    if run is None:
+        return chunks
+    return _recorded_fetch(chunks, run)
+
+
+def _recorded_fetch(chunks, run):
+    transport = mp.get_transport()
+    received = transport.bytes_received
+    try:
+        for chunk in run.timed_iter('fetch', chunks):
+            yield chunk
+    finally:
+        run.downloaded(transport.bytes_received - received)
+
+
+def transform(local_df, skip=0, run=None, hospital_index=None):
+    """
+    Keep GB responses, derive time parts and join the hospital dimension.
+
+    The first skip GB responses are dropped as test responses. Returns a
+    time-indexed DataFrame of the responses at a known hospital.
+    """
+    run = run or metrics.Run('scheduler', None, None)
+    if hospital_index is None:
+        hospital_index = hospitals.load(HOSPITALS_LOCATION)
+    with run.stage('transform'):
+        merged_df, rows = _transform(local_df, skip, hospital_index)
+    run.add('transform', 0.0, rows)
+    return merged_df
+
+
+def _transform(local_df, skip, hospital_index):
+    rows = collections.OrderedDict([('in', len(local_df))])
+    local_df, rows['dropped_test'] = _drop_test_rows(local_df, skip)
+    gb_df = local_df[local_df["mp_country_code"] == 'GB']
+    rows['dropped_non_gb'] = len(local_df) - len(gb_df)
+
+    # One DatetimeIndex for every time part
+    times = pd.DatetimeIndex(gb_df['time'])
+    hospital_id = hospital_index.resolve(gb_df['hospital'])
+    lat, lon = hospital_index.coordinates(hospital_id)
+    gb_df = gb_df.assign(year=times.year, month=times.month, day=times.day,
+                         hour=times.hour, day_month=times.to_period('D'),
+                         hospital_id=hospital_id, lat=lat, lon=lon)
+
+    merged_df = gb_df.set_index('time')
     merged_df.dropna(subset=['lat', 'lon'], inplace=True)
+    merged_df['hospital'] = hospital_index.categorical(merged_df['hospital_id'])
+    rows['dropped_no_location'] = len(gb_df) - len(merged_df)
+    rows['out'] = len(merged_df)
+
+    return merged_df, rows
+
 
-    merged_df.to_csv(FINAL_LOCATION)
+def _transform_all(chunks, hospital_index, processes=PROCESSES):
+    # Yields (merged_df, row counts, seconds) per chunk, in chunk order
+    if processes < 1:
+        for chunk in chunks:
+            yield _timed_transform(chunk, hospital_index)
+        return
+
+    context = multiprocessing.get_context(START_METHOD)
+    with ProcessPoolExecutor(processes, mp_context=context, initializer=_init_worker,
+                             initargs=(hospital_index,)) as executor:
+        pending = collections.deque()
+        known = len(hospital_index)
+        for chunk in chunks:
+            # Sites geocoded during the run are sent along until the end,
+            # since any worker may not have seen them yet
+            added = hospital_index.sites.iloc[known:] \
+                if len(hospital_index) > known else None
+            pending.append(executor.submit(_transform_chunk, chunk, added))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _coalesce(chunks, size):
+    # Shards are cut into chunks separately, so quiet weeks arrive as small
+    # chunks; join them up to size rows to keep per-chunk overhead low
+    pending, rows = [], 0
+    for chunk in chunks:
+        pending.append(chunk)
+        rows += len(chunk)
+        if rows >= size:
+            yield pd.concat(pending, sort=False) if len(pending) > 1 else chunk
+            pending, rows = [], 0
+    if pending:
+        yield pd.concat(pending, sort=False)
+
+
+def _init_worker(hospital_index):
+    global _worker_hospital_index
+    _worker_hospital_index = hospital_index
+
+
+def _transform_chunk(chunk, added=None):
+    if added is not None:
+        _worker_hospital_index.extend(added)
+    return _timed_transform(chunk, _worker_hospital_index)
+
+
+def _timed_transform(chunk, hospital_index):
+    started = time.perf_counter()
+    merged_df, rows = _transform(chunk, 0, hospital_index)
+    return merged_df, rows, time.perf_counter() - started
+
+
+def _geocoder():
+    # None when GEOCODE_PROVIDER is 'none'
+    provider = geocode.provider()
+    return geocode.Geocoder(provider) if provider is not None else None
+
+
+def _geocode_new(chunk, hospital_index, geocoder, checked, run, location):
+    # Geocodes the chunk's GB hospital names that match no site, once per
+    # run, and adds the sites found to the store's hospital file at
+    # location and the index so that their responses are kept
+    names = chunk.loc[chunk['mp_country_code'] == 'GB', 'hospital'].dropna().unique()
+    unmatched = [name for name in names if name not in checked and
+                 hospital_index.resolve_name(name) == hospitals.UNMATCHED]
+    checked.update(names)
+    if not unmatched:
+        return
+    run.count('geocode', 'in', len(unmatched))
+    found = geocoder.lookup(unmatched)
+    if found:
+        hospital_index.extend(hospitals.add_sites(found, location))
+        run.count('geocode', 'added', len(found))
+        logger.info('Added %d geocoded hospitals', len(found))
+
+
+def _drop_test_rows(local_df, skip):
+    # Drops the first skip GB responses, returning the frame and how many
+    if skip <= 0:
+        return local_df, 0
+    test_rows = np.flatnonzero((local_df["mp_country_code"] == 'GB').values)[:skip]
+    return local_df.drop(local_df.index[test_rows]), len(test_rows)
+
+
+def _drop_seen(chunk, seen):
+    # Drops events whose key is in seen. Repeats within the new events are
+    # kept, as a full run keeps them.
+    is_new = [key not in seen for key in zip(chunk['time'], chunk['distinct_id'])]
+    return chunk[is_new]
+
+
+def stored_keys(start, root):
+    """
+    Return the (time, distinct_id) pairs in the store at root from start on
+
+    The store also holds responses pushed through push.py.
+    """
+    stored = store.read(root, columns=['distinct_id'], start=start)
+    return set(zip(stored.index, stored['distinct_id'].astype(str)))
+
+
+def raw_keys(start, state=None):
+    """
+    Return the (time, distinct_id) pairs in the raw CSV from start on
+
+    Only the end of the file written since the first chunk holding a day
+    from start on is read, found from the raw_offsets in the manifest
+    state.
+    """
+    seen = set()
+    start = pd.Timestamp(start)
+    offset = _raw_offset(start, state)
+    with open(DATA_LOCATION) as f:
+        header = f.readline().rstrip('\n')
+        if not header:  # No events yet, so no header either
+            return seen
+        names = header.split(',')
+        if offset:
+            f.seek(offset)
+        # IDs are strings, even when a chunk only holds numeric-looking ones
+        for raw in pd.read_csv(f, header=None, names=names, usecols=DEDUPE_KEYS,
+                               dtype={'distinct_id': str}, parse_dates=['time'],
+                               chunksize=CHUNKSIZE):
+            raw = raw[raw['time'] >= start]
+            seen.update(zip(raw['time'], raw['distinct_id']))
+    return seen
+
+
+def _record_offset(offsets, chunk, position):
+    day = chunk['time'].max().strftime(store.DAY_FORMAT)
+    offsets[day] = min(offsets.get(day, position), position)
+
+
+def _raw_offsets(state):
+    # The raw CSV positions recorded by earlier runs, see ingest
+    return dict(state.get('raw_offsets') or {})
+
+
+def _raw_offset(start, state):
+    # Where the raw CSV's rows from start on begin. Every row is in a chunk
+    # whose last day is at least its own, so it is at or after the smallest
+    # position recorded for a day from start on.
+    if state is None or state.get('raw_offsets_from') is None:
+        return 0
+    start = start.strftime(store.DAY_FORMAT)
+    if start < state['raw_offsets_from']:
+        return 0
+    later = [position for day, position in state['raw_offsets'].items() if day >= start]
+    return min(later) if later else state['raw_bytes']
+
+
+def _outputs(path):
+    # Store, rollup and chart directories and the snapshot inside a version
+    return (os.path.join(path, 'merged'), os.path.join(path, 'rollups'),
+            os.path.join(path, 'charts'), os.path.join(path, snapshot.SNAPSHOT_FILE))
+
+
+def _publish(path, last_day, raw_rows, offsets=None):
+    store_root, rollup_root, chart_root, snapshot_file = _outputs(path)
+    raw_bytes = os.path.getsize(DATA_LOCATION) if RAW_SINK else None
+    # Only the days the next run can refetch are kept
+    offsets_from = (last_day - datetime.timedelta(OVERLAP_DAYS)).strftime(store.DAY_FORMAT)
+    offsets = dict((day, position) for day, position in (offsets or {}).items()
+                   if day >= offsets_from)
+    manifest = store.publish(path, store=store_root, rollups=rollup_root,
+                             charts=chart_root, snapshot=snapshot_file,
+                             last_day=last_day.strftime(mp.date_format),
+                             raw_rows=int(raw_rows), raw_bytes=raw_bytes,
+                             raw_offsets=offsets,
+                             raw_offsets_from=offsets_from if RAW_SINK else None)
+    logger.info('Published %s up to %s', manifest['version'], manifest['last_day'])
+    return manifest
+
+
+def _discard(path, sink=None):
+    # Removes an unpublished version and, if given, its raw CSV
+    shutil.rmtree(path, ignore_errors=True)
+    if sink is not None:
+        sink.close()
+        if os.path.exists(sink.name):
+            os.remove(sink.name)
+        with contextlib.suppress(OSError):
+            os.remove(sink.name)
+
+
+def _raw_sink_intact(state):
+    # The raw CSV must hold at least the published rows to be appended to
+    if not RAW_SINK:
+        return True
+    if state.get('raw_bytes') is None or not os.path.exists(DATA_LOCATION):
+        return False
+    return os.path.getsize(DATA_LOCATION) >= state['raw_bytes']
+
+
+def _run_logged():
+    try:
+        main()
+    except Exception:
+        logger.exception('Ingest failed')
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Ingest PPE responses from Mixpanel')
+    parser.add_argument('--full', action='store_true',
+                        help='Rebuild everything from START_DATE')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running, ingesting every --every minutes')
+    parser.add_argument('--every', type=int, default=INTERVAL_MINUTES)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    if args.daemon:
+        daemon(args.every)
+    else:
+        main(full=args.full)
@@ -0,0 +1,166 @@
+"""
+HyperLogLog sketches of distinct clinicians per day and hospital
+
+A HyperLogLog sketch estimates how many distinct values it has seen from
+2**PRECISION small registers. Each distinct_id is hashed to 64 bits; the
+first PRECISION bits pick a register and the register keeps the highest
+rank (position of the first set bit) of the remaining bits. Sketches merge
+by taking the register-wise maximum, so the clinicians of any set of days
+and hospitals are counted by merging their sketches, never by rescanning
+the responses.
+
+Most day and hospital cells hold a handful of clinicians, so sketches are
+stored sparsely, as the (register, rank) pairs of their non-empty
+registers, in one table sorted by day. A query takes the day range as a
+slice, masks the hospitals it wants and folds the ranks into one register
+array.
+
+Error bound: the relative standard error of an estimate is
+1.04 / sqrt(2**PRECISION), 0.81% at the default precision of 14, so about
+95% of estimates are within 1.6% and nearly all within 2.5% of the true
+count. Below 2.5 * 2**PRECISION (40,960) distinct clinicians the estimate
+falls back to linear counting of empty registers, which is more accurate
+still: typically within two clinicians for counts of a few hundred.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import store
+
+
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+STANDARD_ERROR = 1.04 / np.sqrt(REGISTERS)
+SKETCH_FILE = 'clinicians.npz'
+
+_TAIL_BITS = 64 - PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+
+def hash_ids(values):
+    """64-bit hashes of an array of IDs, stable across runs and processes."""
+    return pd.util.hash_array(np.asarray(values, dtype=object))
+
+
+def registers_and_ranks(hashes):
+    """Return the register each hash updates and the rank it offers."""
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    registers = (hashes >> np.uint64(_TAIL_BITS)).astype(np.uint16)
+    tail = hashes & np.uint64((1 << _TAIL_BITS) - 1)
+
+    # Rank is the number of leading zeros in the tail plus one. log2 of the
+    # float can round up just below a power of two, so correct it exactly.
+    nonzero = tail > 0
+    bits = np.zeros(len(tail), dtype=np.int64)
+    bits[nonzero] = np.floor(np.log2(tail[nonzero].astype(np.float64))).astype(np.int64)
+    over = nonzero & (np.left_shift(np.uint64(1), bits.astype(np.uint64)) > tail)
+    bits[over] -= 1
+    ranks = np.where(nonzero, _TAIL_BITS - bits, _TAIL_BITS + 1).astype(np.uint8)
+    return registers, ranks
+
+
+def estimate(registers):
+    """Estimated distinct count from a full register array."""
+    zeros = np.count_nonzero(registers == 0)
+    raw = _ALPHA * REGISTERS ** 2 / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    if raw <= 2.5 * REGISTERS and zeros:
+        return REGISTERS * np.log(float(REGISTERS) / zeros)
+    return raw
+
+
+def build(df):
+    """
+    Sparse sketches of a store read with distinct_id and hospital_id
+
+    Returns a DataFrame of day (datetime64[D]), hospital_id, register and
+    rank, one row per non-empty register of each day and hospital, sorted
+    by day.
+    """
+    df = df[df['distinct_id'].notna()]
+    if df.empty:
+        return _empty()
+    ids = df['distinct_id']
+    if hasattr(ids, 'cat'):
+        # Hash each clinician once rather than once per response
+        hashes = hash_ids(ids.cat.categories).take(ids.cat.codes.to_numpy())
+    else:
+        hashes = hash_ids(ids.to_numpy())
+    registers, ranks = registers_and_ranks(hashes)
+    entries = pd.DataFrame({
+        'day': pd.DatetimeIndex(df.index).values.astype('datetime64[D]'),
+        'hospital_id': df['hospital_id'].to_numpy(dtype=np.int32),
+        'register': registers,
+        'rank': ranks,
+    })
+    return entries.groupby(['day', 'hospital_id', 'register'], sort=True)['rank'] \
+        .max().reset_index()
+
+
+def merge(tables, replace_days=None):
+    """Concatenate sketch tables, dropping replace_days from all but the last."""
+    tables = [t for t in tables if len(t)]
+    if not tables:
+        return _empty()
+    if replace_days is not None and len(tables) > 1:
+        replace_days = pd.DatetimeIndex([pd.Timestamp(d) for d in replace_days])
+        tables = [t[~pd.DatetimeIndex(t['day']).isin(replace_days)]
+                  for t in tables[:-1]] + tables[-1:]
+    return pd.concat(tables, ignore_index=True) \
+        .sort_values('day', kind='mergesort').reset_index(drop=True)
+
+
+def save(entries, location):
+    def write(f):
+        np.savez(f, day=entries['day'].to_numpy(dtype='datetime64[D]'),
+                 hospital_id=entries['hospital_id'].to_numpy(dtype=np.int32),
+                 register=entries['register'].to_numpy(dtype=np.uint16),
+                 rank=entries['rank'].to_numpy(dtype=np.uint8))
+    store.replace_file(os.path.join(location, SKETCH_FILE), write, 'wb')
+
+
+def load(location):
+    """Return the sketch table in location as a DataFrame, empty if missing."""
+    path = os.path.join(location, SKETCH_FILE)
+    if not os.path.exists(path):
+        return _empty()
+    with np.load(path) as arrays:
+        return pd.DataFrame({name: arrays[name] for name in
+                             ['day', 'hospital_id', 'register', 'rank']})
+
+
+class Clinicians(object):
+    """
+    Distinct clinician counts for any day range and set of hospitals
+
+    Built once per published version from the sketch table; each count
+    merges only the sketches it needs.
+    """
+
+    def __init__(self, entries):
+        self.day_index = store.DayIndex(entries['day'].to_numpy())
+        self.hospital_id = entries['hospital_id'].to_numpy()
+        self.register = entries['register'].to_numpy().astype(np.intp)
+        self.rank = entries['rank'].to_numpy()
+
+    def count(self, start=None, end=None, hospital_ids=None):
+        """
+        Estimate the distinct clinicians who responded between start and
+        end, inclusive, optionally only at the given hospital IDs.
+        """
+        rows = self.day_index.slice(start, end)
+        register, rank = self.register[rows], self.rank[rows]
+        if hospital_ids is not None:
+            wanted = np.isin(self.hospital_id[rows], np.asarray(hospital_ids))
+            register, rank = register[wanted], rank[wanted]
+        registers = np.zeros(REGISTERS, dtype=np.uint8)
+        np.maximum.at(registers, register, rank)
+        return int(round(estimate(registers)))
+
+
+def _empty():
+    return pd.DataFrame({'day': np.empty(0, dtype='datetime64[D]'),
+                         'hospital_id': np.empty(0, dtype=np.int32),
+                         'register': np.empty(0, dtype=np.uint16),
+                         'rank': np.empty(0, dtype=np.uint8)})
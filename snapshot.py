@@ -0,0 +1,77 @@
+"""
+Binary snapshot of everything the dashboard loads, for a fast cold start
+
+The dashboard only shows rollups, but they are CSVs to parse and day
+indexes to build, which a freshly started dyno pays for on its first page
+load. Each ingest therefore also pickles every rollup table with its day
+index and the clinician sketches into one file in the version, which the
+app loads in one read. It is built from the rollups, never the store, so
+it costs about as much as the rollups themselves. A snapshot written by a
+different FORMAT, or one that can't be read, is ignored and the app reads
+the rollups as before.
+
+    python snapshot.py   # Add one to a version published without it
+"""
+import os
+import pickle
+
+import rollups
+import sketches
+import store
+
+
+SNAPSHOT_FILE = 'snapshot.pickle'
+FORMAT = 2  # Bump when the contents change shape
+ROLLUPS = [rollups.CUBE, rollups.DAILY, rollups.HOSPITALS, rollups.CELLS]
+
+
+def read_rollup(name, rollup_root):
+    """A rollup table and, if it has a day column, its DayIndex."""
+    table = rollups.load(name, rollup_root)
+    day_index = None
+    if 'day_month' in table.columns:
+        day_index = store.DayIndex(table['day_month'])
+    return table, day_index
+
+
+def build(rollup_root, path):
+    """Write the snapshot of a version's rollups to path."""
+    contents = {
+        'format': FORMAT,
+        'rollups': {name: read_rollup(name, rollup_root) for name in ROLLUPS},
+        'clinicians': sketches.Clinicians(sketches.load(rollup_root)),
+    }
+    store.replace_file(path, lambda f: pickle.dump(
+        contents, f, protocol=pickle.HIGHEST_PROTOCOL), 'wb')
+
+
+def load(path):
+    """Return the snapshot at path, or None if it is missing or unusable."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            contents = pickle.load(f)
+    except Exception:  # Written by other library versions, or truncated
+        return None
+    if not isinstance(contents, dict) or contents.get('format') != FORMAT:
+        return None
+    return contents
+
+
+if __name__ == "__main__":
+    # For versions published before ingests wrote snapshots
+    import scheduler
+
+    with scheduler.ingest_lock() as locked:
+        manifest = store.current()
+        if not locked:
+            raise SystemExit('Another ingest holds %s, try again later'
+                             % scheduler.LOCK_LOCATION)
+        if manifest is None:
+            raise SystemExit('Nothing has been published yet, run scheduler.py first')
+        location = os.path.join(manifest['path'], SNAPSHOT_FILE)
+        build(manifest['rollups'], location)
+        fields = dict((k, v) for k, v in manifest.items()
+                      if k not in ('version', 'path', 'published'))
+        store.publish(manifest['path'], **dict(fields, snapshot=location))
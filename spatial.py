@@ -0,0 +1,83 @@
+"""
+Hexagonal binning of hospital sites for the results map
+
+Coordinates are projected onto a flat plane around the UK's mid latitude
+and snapped to pointy-top hexagons of CELL_SIZE_KM, identified by their
+axial (q, r) coordinates. Sites only move when hospital_locations.csv
+changes, so each site's cell is computed once and responses are binned by
+looking up their hospital's cell.
+"""
+import math
+
+import numpy as np
+
+
+CELL_SIZE_KM = 1.5  # Centre to corner, matches the old HexagonLayer radius
+ORIGIN_LAT = 54.0  # Projection is least distorted around this latitude
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LON = 111.320 * math.cos(math.radians(ORIGIN_LAT))
+SQRT3 = math.sqrt(3)
+COUNT_COLUMNS = ['sufficient', 'insufficient', 'total']
+
+
+def cells(lat, lon, size=CELL_SIZE_KM):
+    """Return integer axial (q, r) arrays of the hexagons holding each point."""
+    x = np.asarray(lon, dtype=np.float64) * KM_PER_DEGREE_LON
+    y = np.asarray(lat, dtype=np.float64) * KM_PER_DEGREE_LAT
+    q = (SQRT3 / 3 * x - y / 3) / size
+    r = (2.0 / 3 * y) / size
+    return _round_axial(q, r)
+
+
+def centres(q, r, size=CELL_SIZE_KM):
+    """Return (lat, lon) arrays of hexagon centres."""
+    q = np.asarray(q, dtype=np.float64)
+    r = np.asarray(r, dtype=np.float64)
+    x = size * SQRT3 * (q + r / 2)
+    y = size * 1.5 * r
+    return y / KM_PER_DEGREE_LAT, x / KM_PER_DEGREE_LON
+
+
+def site_cells(sites, size=CELL_SIZE_KM):
+    """
+    Index hospital sites by hexagon
+
+    Takes a frame with hospital, lat and lon columns and returns it with q
+    and r added, plus the cell centre as cell_lat and cell_lon.
+    """
+    sites = sites[['hospital', 'lat', 'lon']].drop_duplicates('hospital')
+    q, r = cells(sites['lat'], sites['lon'], size)
+    cell_lat, cell_lon = centres(q, r, size)
+    return sites.assign(q=q, r=r, cell_lat=cell_lat, cell_lon=cell_lon) \
+        .reset_index(drop=True)
+
+
+def bin_counts(counts, size=CELL_SIZE_KM):
+    """
+    Sum per-hospital counts into hexagons
+
+    counts needs hospital, lat and lon columns. The COUNT_COLUMNS it has
+    are summed per cell, and per day_month when that column is present.
+    """
+    sites = site_cells(counts, size)
+    keys = [k for k in ['day_month'] if k in counts.columns]
+    value_columns = [c for c in COUNT_COLUMNS if c in counts.columns]
+    binned = counts[keys + ['hospital'] + value_columns] \
+        .merge(sites[['hospital', 'q', 'r', 'cell_lat', 'cell_lon']],
+               on='hospital')
+    binned = binned.groupby(keys + ['q', 'r', 'cell_lat', 'cell_lon'])[value_columns] \
+        .sum().reset_index()
+    return binned.rename(columns={'cell_lat': 'lat', 'cell_lon': 'lon'})
+
+
+def _round_axial(q, r):
+    # Round in cube coordinates, then fix the component with the largest
+    # rounding error so that q + r + s stays zero
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq = np.where(fix_q, -rr - rs, rq)
+    rr = np.where(fix_r, -rq - rs, rr)
+    return rq.astype(np.int64), rr.astype(np.int64)
@@ -0,0 +1,421 @@
+"""
+Day-partitioned columnar store for the merged PPE responses
+
+Each day is a directory under the store root named YYYY-MM-DD holding one
+.npy file per column. Numeric columns are stored as typed arrays and string
+columns as int32 codes plus a JSON list of categories. Hospitals are stored
+as their hospitals.py ID; name and coordinates are looked up when read, in
+the store's own copy of the hospital dimension (see dimension).
+Reads memory-map the files, so only the columns and days that are asked
+for are touched on disk.
+
+Ingests write into a new version directory (see stage) and switch readers
+over to it by atomically replacing a small JSON manifest (see publish), so
+readers never see a partly written store or rollup.
+"""
+import datetime
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+import hospitals
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+STORE_LOCATION = './data/merged'
+DAY_FORMAT = '%Y-%m-%d'
+VERSIONS_LOCATION = './data/versions'
+MANIFEST_LOCATION = './data/manifest.json'
+# Published versions kept on disk for readers still using an older one:
+# the newest KEEP_VERSIONS, and any replaced less than KEEP_VERSIONS_SECONDS
+# ago, however often pushes publish
+KEEP_VERSIONS = 3
+KEEP_VERSIONS_SECONDS = int(os.environ.get('KEEP_VERSIONS_SECONDS', 300))
+VERSION_FORMAT = '%Y%m%dT%H%M%S%f'
+
+# Stored columns and their on-disk types. 'time' is the DataFrame index.
+NUMERIC_COLUMNS = {
+    'hospital_id': np.int32,
+    'sufficient-supply': np.bool_,
+}
+CATEGORICAL_COLUMNS = ['distinct_id']
+# Looked up from hospital_id in the hospital dimension when read
+HOSPITAL_COLUMNS = ['hospital', 'lat', 'lon']
+# Derived from the time index when read, never stored
+DERIVED_COLUMNS = ['day_month', 'year', 'month', 'day', 'hour']
+COLUMNS = (list(NUMERIC_COLUMNS) + CATEGORICAL_COLUMNS + HOSPITAL_COLUMNS +
+           DERIVED_COLUMNS)
+
+_manifest_cache = {}
+
+
+class MissingVersion(Exception):
+    """A published version was deleted before a reader had finished with it."""
+
+
+def write(df, root=STORE_LOCATION, append=False):
+    """
+    Write a time-indexed DataFrame into day partitions under root.
+
+    Days already in the store are replaced, or extended with the new rows
+    when append is True. Columns not in the store layout are ignored.
+    """
+    os.makedirs(root, exist_ok=True)
+    days = pd.DatetimeIndex(df.index).normalize()
+    for day, part in df.groupby(days):
+        path = partition_path(day, root)
+        if append and os.path.exists(path):
+            part = pd.concat([_read_partition(path, _stored(COLUMNS)), part],
+                             sort=False)
+        _write_partition(path, part)
+
+
+def read(root=STORE_LOCATION, columns=None, start=None, end=None,
+         hospital_index=None):
+    """
+    Read the store into a DataFrame indexed by time
+
+    Parameters
+    ----------
+    columns : list of column names, optional
+        Only these columns are read. Defaults to every column in COLUMNS.
+    start, end : date-like, optional
+        Inclusive day range. Partitions outside it are never opened.
+    hospital_index : hospitals.HospitalIndex, optional
+        Dimension used to look up hospital names and coordinates. The
+        store's own is loaded when needed and not given.
+    """
+    if columns is None:
+        columns = COLUMNS
+    unknown = set(columns) - set(COLUMNS)
+    if unknown:
+        raise KeyError('Unknown store columns: %s' % sorted(unknown))
+
+    if hospital_index is None and set(columns) & set(HOSPITAL_COLUMNS):
+        hospital_index = dimension(root)
+    frames = [_read_partition(partition_path(day, root), _stored(columns))
+              for day in days(root, start, end)]
+    if not frames:
+        return _derive(_empty_frame(_stored(columns)), columns, hospital_index)
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in columns:
+            # Each day has its own dictionary; unify before concatenating
+            unified = pd.api.types.union_categoricals(
+                [f[col] for f in frames], sort_categories=True)
+            for f in frames:
+                f[col] = pd.Categorical(f[col], categories=unified.categories)
+    return _derive(pd.concat(frames), columns, hospital_index)
+
+
+def dimension(root=STORE_LOCATION):
+    """
+    The hospitals.HospitalIndex the IDs in the store at root refer to
+
+    Stores written before each kept its own copy use hospital_locations.csv.
+    """
+    location = dimension_path(root)
+    if os.path.exists(location):
+        return hospitals.load(location)
+    return hospitals.load()
+
+
+def dimension_path(root=STORE_LOCATION):
+    return os.path.join(root, hospitals.DIMENSION_FILE)
+
+
+def days(root=STORE_LOCATION, start=None, end=None):
+    """Return the sorted list of stored days within [start, end]."""
+    if not os.path.isdir(root):
+        return []
+    start = pd.Timestamp(start).date() if start is not None else None
+    end = pd.Timestamp(end).date() if end is not None else None
+
+    stored = []
+    for name in os.listdir(root):
+        try:
+            day = datetime.datetime.strptime(name, DAY_FORMAT).date()
+        except ValueError:  # Temporary or unrelated entries
+            continue
+        if (start is None or day >= start) and (end is None or day <= end):
+            stored.append(day)
+    return sorted(stored)
+
+
+class DayIndex(object):
+    """
+    Row offsets of each day in a table sorted by time
+
+    Built once from the sorted times (or ISO day strings) of a table, it
+    turns a day or day range into a row slice by binary search, so that
+    table.iloc[index.slice(start, end)] is a view rather than a scan.
+    """
+
+    def __init__(self, times):
+        days = np.asarray(times, dtype='datetime64[D]')
+        if len(days) and (days[1:] < days[:-1]).any():
+            raise ValueError('DayIndex needs rows sorted by time')
+        self.days, starts = np.unique(days, return_index=True)
+        self.offsets = np.append(starts, len(days))
+
+    def __len__(self):
+        return len(self.days)
+
+    @property
+    def first(self):
+        return pd.Timestamp(self.days[0]).date() if len(self) else None
+
+    @property
+    def last(self):
+        return pd.Timestamp(self.days[-1]).date() if len(self) else None
+
+    def slice(self, start=None, end=None):
+        """Return the row slice covering the inclusive day range."""
+        lo = 0 if start is None else \
+            np.searchsorted(self.days, _to_day(start), side='left')
+        hi = len(self.days) if end is None else \
+            np.searchsorted(self.days, _to_day(end), side='right')
+        hi = max(lo, hi)
+        return slice(int(self.offsets[lo]), int(self.offsets[hi]))
+
+    def day(self, day):
+        return self.slice(day, day)
+
+
+def stage(base=None, versions=VERSIONS_LOCATION):
+    """
+    Create a directory for a new, unpublished version and return its path
+
+    With base, the new version starts as a copy of that directory in which
+    every file is a hard link, so unchanged partitions are neither copied
+    nor duplicated on disk. Outputs are only ever replaced by renaming a
+    new file or directory over them, never modified in place, so writing
+    to the new version leaves base untouched.
+    """
+    name = '%s-%d' % (datetime.datetime.utcnow().strftime(VERSION_FORMAT),
+                      os.getpid())
+    path = os.path.join(versions, name)
+    os.makedirs(path)
+    if base is not None and os.path.isdir(base):
+        for src_dir, dirs, files in os.walk(base):
+            dirs[:] = [d for d in dirs if not d.endswith('.tmp')]
+            dst_dir = os.path.join(path, os.path.relpath(src_dir, base))
+            os.makedirs(dst_dir, exist_ok=True)
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    os.link(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+                except OSError:  # File systems without hard links
+                    shutil.copy2(os.path.join(src_dir, name), dst_dir)
+    return path
+
+
+def publish(path, manifest_location=MANIFEST_LOCATION, **fields):
+    """
+    Make the version at path the current one
+
+    Writes the manifest under a temporary name and renames it into place,
+    so readers see either the old or the new version in full. fields,
+    such as the paths of the outputs inside the version, are stored in
+    the manifest alongside it. Old versions are then deleted, see prune.
+    """
+    manifest = dict(fields, version=os.path.basename(path), path=path,
+                    published=datetime.datetime.utcnow().isoformat())
+    _write_json(manifest_location, manifest)
+    prune(os.path.dirname(path), keep=path)
+    return manifest
+
+
+def current(manifest_location=MANIFEST_LOCATION):
+    """
+    Return the manifest of the published version, or None
+
+    The manifest is only parsed again when its file changes, so readers
+    can call this on every request.
+    """
+    try:
+        stat = os.stat(manifest_location)
+    except OSError:
+        return None
+    key = (manifest_location, stat.st_mtime_ns, stat.st_size)
+    if _manifest_cache.get('key') != key:
+        with open(manifest_location) as f:
+            _manifest_cache.update(key=key, manifest=json.load(f))
+    return _manifest_cache['manifest']
+
+
+def version(manifest_location=MANIFEST_LOCATION):
+    """Return the published version's name, or None before the first."""
+    manifest = current(manifest_location)
+    return manifest['version'] if manifest else None
+
+
+def require(version, versions=VERSIONS_LOCATION):
+    """
+    Raise MissingVersion if a published version's directory is gone
+
+    Outputs that are missing read as empty, so readers call this after
+    reading a version to avoid caching a pruned one as if it had no data.
+    Does nothing for version None, i.e. before the first versioned ingest.
+    """
+    if version is not None and not os.path.isdir(os.path.join(versions, version)):
+        raise MissingVersion('Version %s was deleted while it was being read, '
+                             'see store.KEEP_VERSIONS_SECONDS' % version)
+
+
+def prune(versions=VERSIONS_LOCATION, keep=None, count=KEEP_VERSIONS,
+          seconds=KEEP_VERSIONS_SECONDS):
+    """
+    Delete old versions, never deleting keep
+
+    The newest count versions are kept, and so is any other whose
+    successor was created less than seconds ago, as it may have been
+    published until moments ago.
+    """
+    if not os.path.isdir(versions):
+        return
+    names = sorted(os.listdir(versions))
+    keep = os.path.basename(keep) if keep else None
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=seconds)
+    for name, successor in zip(names[:-count] if count else names, names[1:]):
+        if name != keep and _created(successor) < cutoff:
+            shutil.rmtree(os.path.join(versions, name), ignore_errors=True)
+
+
+def replace_file(path, write, mode='w'):
+    """
+    Write the file at path by renaming a new one over it
+
+    write is called with a temporary file next to path, open in mode.
+    Readers see the old file or the new one in full, and a hard link to the
+    old one, such as a published version's (see stage), is left as it was.
+    """
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(tmp_path, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def clear(root=STORE_LOCATION):
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+
+
+def partition_path(day, root=STORE_LOCATION):
+    return os.path.join(root, pd.Timestamp(day).strftime(DAY_FORMAT))
+
+
+def _write_json(path, data):
+    def write(f):
+        json.dump(data, f, default=str)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(path, write)
+
+
+def _created(name):
+    # When a version was staged, from its name
+    try:
+        return datetime.datetime.strptime(name.split('-')[0], VERSION_FORMAT)
+    except ValueError:  # Not a version
+        return datetime.datetime.min
+
+
+def _to_day(value):
+    return np.datetime64(pd.Timestamp(value).date(), 'D')
+
+
+def _stored(columns):
+    stored = [c for c in columns
+              if c not in DERIVED_COLUMNS and c not in HOSPITAL_COLUMNS]
+    if 'hospital_id' not in stored and set(columns) & set(HOSPITAL_COLUMNS):
+        stored.append('hospital_id')
+    return stored
+
+
+def _write_partition(path, df):
+    df = df.sort_index(kind='mergesort')
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    index = pd.DatetimeIndex(df.index).values.astype('datetime64[ns]')
+    np.save(os.path.join(tmp_path, 'time.npy'), index)
+    for col, dtype in NUMERIC_COLUMNS.items():
+        values = df[col]
+        if dtype is np.bool_:
+            values = values.eq(True)
+        np.save(os.path.join(tmp_path, col + '.npy'),
+                values.to_numpy(dtype=dtype))
+    for col in CATEGORICAL_COLUMNS:
+        cat = pd.Categorical(df[col].astype(object).where(df[col].notna(), None))
+        np.save(os.path.join(tmp_path, col + '.npy'),
+                cat.codes.astype(np.int32))
+        with open(os.path.join(tmp_path, col + '.json'), 'w') as f:
+            json.dump([str(c) for c in cat.categories], f)
+
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.rename(tmp_path, path)
+
+
+def _read_partition(path, columns):
+    index = np.load(os.path.join(path, 'time.npy'), mmap_mode='r')
+    data = {}
+    for col in columns:
+        codes = np.load(os.path.join(path, col + '.npy'), mmap_mode='r')
+        if col in CATEGORICAL_COLUMNS:
+            with open(os.path.join(path, col + '.json')) as f:
+                categories = json.load(f)
+            data[col] = pd.Categorical.from_codes(np.asarray(codes), categories)
+        else:
+            data[col] = codes
+    return pd.DataFrame(data, columns=columns,
+                        index=pd.DatetimeIndex(index, name='time'))
+
+
+def _empty_frame(columns):
+    data = {}
+    for col in columns:
+        if col in CATEGORICAL_COLUMNS:
+            data[col] = pd.Categorical([])
+        else:
+            data[col] = np.empty(0, dtype=NUMERIC_COLUMNS[col])
+    return pd.DataFrame(data, columns=columns,
+                        index=pd.DatetimeIndex([], name='time'))
+
+
+def _derive(df, columns, hospital_index=None):
+    if set(columns) & set(HOSPITAL_COLUMNS):
+        if hospital_index is None:
+            hospital_index = hospitals.load()
+        ids = df['hospital_id'].to_numpy()
+        lat, lon = hospital_index.coordinates(ids)
+        lookups = {'hospital': hospital_index.categorical(ids),
+                   'lat': lat, 'lon': lon}
+        for col in HOSPITAL_COLUMNS:
+            if col in columns:
+                df[col] = lookups[col]
+
+    index = pd.DatetimeIndex(df.index)
+    for col in columns:
+        if col == 'day_month':
+            # Format each distinct day once rather than every row
+            day_month = pd.Categorical(index.normalize())
+            df[col] = day_month.rename_categories(
+                day_month.categories.strftime(DAY_FORMAT))
+        elif col in DERIVED_COLUMNS:
+            df[col] = getattr(index, col)
+    return df[list(columns)]
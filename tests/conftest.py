@@ -0,0 +1,50 @@
+"""
+Fixtures shared by the tests
+
+Modules read and write under ./data, so tests that touch files run in a
+temporary directory holding a copy of the repository's hospital files.
+"""
+import os
+import shutil
+
+import pytest
+
+import mixpanel as mp
+import scheduler
+from benchmarks.generate import Generator
+from benchmarks.server import ExportServer, KEYS
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = ['hospital_locations.csv', 'hospital_aliases.csv']
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A temporary working directory with ./data and the hospital files."""
+    os.makedirs(str(tmp_path / 'data'))
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(ROOT, 'data', name), str(tmp_path / 'data'))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def export_server(workdir, monkeypatch):
+    """
+    Start a stand-in export API serving a number of synthetic events and
+    point mixpanel and scheduler at it, without a response cache.
+    """
+    servers = []
+
+    def start(events, **options):
+        server = ExportServer(Generator(events, **options)).start()
+        servers.append(server)
+        monkeypatch.setattr(mp, '_transport', mp.Transport(data_api_base=server.base_url))
+        monkeypatch.setattr(scheduler, 'keys', KEYS)
+        monkeypatch.setattr(scheduler, 'CACHE', None)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
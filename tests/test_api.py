@@ -0,0 +1,108 @@
+import shutil
+import threading
+
+import pandas as pd
+import pytest
+import requests
+
+import api
+import hospitals
+import rollups
+import store
+
+
+def publish(*rows):
+    """Publish a version holding (time, hospital_id, answer, distinct_id) responses."""
+    times, hospital_ids, answers, ids = zip(*rows)
+    path = store.stage()
+    root, rollup_root = path + '/merged', path + '/rollups'
+    hospitals.sync(store.dimension_path(root))
+    store.write(pd.DataFrame({'hospital_id': hospital_ids, 'sufficient-supply': answers,
+                              'distinct_id': ids},
+                             index=pd.DatetimeIndex(times, name='time')), root)
+    rollups.build(root, rollup_root)
+    return store.publish(path, store=root, rollups=rollup_root)
+
+
+ROWS = [('2020-05-01 09:00', 0, True, 'a'), ('2020-05-01 10:00', 1, False, 'b'),
+        ('2020-05-02 09:00', 0, False, 'a'), ('2020-05-03 09:00', 2, True, 'c')]
+
+
+@pytest.fixture
+def server(workdir):
+    server = api.APIServer(port=0, host='127.0.0.1')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    def get(path, **headers):
+        return requests.get('http://127.0.0.1:%d%s' % (server.server_address[1], path),
+                            headers=headers)
+    yield get
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_pages(server):
+    publish(*ROWS)
+    first = server('/api/daily?limit=2')
+    assert first.headers['X-Total-Count'] == '3'
+    page = first.json()
+    assert [row['day'] for row in page['rows']] == ['2020-05-01', '2020-05-02']
+    assert page['rows'][0]['total'] == 2 and page['rows'][0]['proportion-negative'] == 50.0
+    rest = server(page['next']).json()
+    assert [row['day'] for row in rest['rows']] == ['2020-05-03'] and rest['next'] is None
+
+    csv = server('/api/daily?start=2020-05-02&limit=1', Accept='text/csv')
+    assert csv.headers['Content-Type'].startswith('text/csv')
+    assert csv.text.splitlines()[1].startswith('2020-05-02,')
+    assert 'offset=1' in csv.headers['Link'] and 'rel="next"' in csv.headers['Link']
+
+
+def test_slices(server):
+    publish(*ROWS)
+    names = hospitals.load().names
+    summary = server('/api/summary?end=2020-05-02&hospital=%s' % names[0]).json()
+    assert (summary['total'], summary['insufficient'], summary['hospitals']) == (2, 1, 1)
+    assert summary['clinicians'] == 1
+    by_site = server('/api/hospitals').json()['rows']
+    assert [row['hospital'] for row in by_site][0] == names[1]  # Most negative first
+
+    assert server('/api/daily?start=May').status_code == 400
+    assert server('/api/daily?limit=0').status_code == 400
+    assert server('/api/responses').status_code == 404
+
+
+def test_etags(server):
+    publish(*ROWS)
+    answer = server('/api/daily')
+    etag = answer.headers['ETag']
+    assert etag.startswith('W/"%s-' % store.version())
+    for tags in [etag, etag[2:], '"other", ' + etag, '*']:
+        assert server('/api/daily', **{'If-None-Match': tags}).status_code == 304
+    assert server('/api/daily?limit=5', **{'If-None-Match': etag}).status_code == 200
+
+    # A new version has new tags
+    publish(*ROWS[:2])
+    changed = server('/api/daily', **{'If-None-Match': etag})
+    assert changed.status_code == 200 and len(changed.json()['rows']) == 1
+
+
+def test_gzip(server, monkeypatch):
+    monkeypatch.setattr(api, 'MIN_GZIP_BYTES', 0)
+    publish(*ROWS)
+    body = server('/api/hospitals', **{'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in body.headers
+    gzipped = server('/api/hospitals', **{'Accept-Encoding': 'gzip'})
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.json() == body.json()
+
+
+def test_pruned_version(workdir):
+    manifest = publish(*ROWS)
+    query_api = api.QueryAPI()
+    key, _ = query_api.etag('summary', {})
+    # Deleted between the ETag and the answer, as by another process' prune
+    shutil.rmtree(manifest['path'])
+    with pytest.raises(store.MissingVersion):
+        query_api.answer(key)
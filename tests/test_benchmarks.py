@@ -0,0 +1,54 @@
+import datetime
+
+import pandas as pd
+import pytest
+import requests
+
+import mixpanel as mp
+from benchmarks.generate import Generator
+from benchmarks.server import ExportServer, KEYS, where_predicate
+
+
+DAY = datetime.date(2020, 5, 1)
+
+
+def test_generator_is_reproducible():
+    generator = Generator(1000)
+    assert sum(generator.events_on(day) for day in generator.day_range()) == 1000
+    assert generator.day(DAY) == Generator(1000).day(DAY)
+    assert generator.day(DAY) != Generator(1000, seed=1).day(DAY)
+    times = [e['time'] for e in generator.day_events(DAY)]
+    assert times == sorted(times)
+
+
+@pytest.mark.parametrize('filters', [
+    [('mp_country_code', '==', 'GB')],
+    [('mp_country_code', '!=', 'GB'), ('sufficient-supply', '==', True)],
+    [('$os', 'in', ['iOS']), ('missing', 'not in', ['x'])],
+    [('hospital', 'not in', ['A', 'B "quoted" (C)'])],
+])
+def test_where_predicate_matches_filter_mask(filters):
+    events = Generator(500).day_events(DAY)
+    matches = where_predicate(mp.where_expression(filters))
+    expected = mp.filter_mask(pd.DataFrame(events), filters)
+    assert [matches(e) for e in events] == expected.tolist()
+
+
+def test_unsupported_where_expressions():
+    assert where_predicate(None) is None
+    with pytest.raises(ValueError):
+        where_predicate('properties["a"] ~ 1')
+
+
+def test_server_checks_signatures():
+    server = ExportServer(Generator(100)).start()
+    try:
+        transport = mp.Transport(data_api_base=server.base_url)
+        params = {'from_date': '2020-05-01', 'to_date': '2020-05-01'}
+        assert mp.request(KEYS, ['export'], params, data_api=True, transport=transport,
+                          retries=0)
+        with pytest.raises(requests.HTTPError):
+            mp.request((KEYS[0], 'wrong secret'), ['export'], params, data_api=True,
+                       transport=transport, retries=0)
+    finally:
+        server.stop()
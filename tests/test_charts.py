@@ -0,0 +1,42 @@
+import os
+
+import pandas as pd
+
+import charts
+import rollups
+import store
+
+
+PNG = b'\x89PNG\r\n\x1a\n'
+
+
+def test_charts_of_all_and_selected_days(workdir):
+    df = pd.DataFrame({'hospital_id': [0, 1, 0], 'sufficient-supply': [True, False, False],
+                       'distinct_id': ['a', 'b', 'a']},
+                      index=pd.DatetimeIndex(['2020-05-01 09:00', '2020-05-01 10:00',
+                                              '2020-05-02 09:00'], name='time'))
+    store.write(df, './data/merged')
+    rollups.build('./data/merged', './data/rollups')
+    charts.build('./data/rollups', './data/charts')
+    assert sorted(os.listdir('./data/charts')) == \
+        sorted(name + '.png' for name in charts.SOURCES)
+
+    # As the dashboard draws them for a narrower range of days
+    for name, source in charts.SOURCES.items():
+        table = rollups.load(source, './data/rollups')
+        if 'day_month' in table:
+            table = table.iloc[store.DayIndex(table['day_month']).day('2020-05-02')]
+            assert len(table) == 1
+        image = charts.png(name, table)
+        assert image.startswith(PNG)
+        with open(charts.chart_path(name, './data/charts'), 'rb') as f:
+            assert f.read() != image or source == rollups.HOSPITALS
+
+
+def test_build_without_rollups(workdir):
+    # A version published before any responses were stored
+    charts.build('./data/rollups', './data/charts')
+    for name in charts.SOURCES:
+        with open(charts.chart_path(name, './data/charts'), 'rb') as f:
+            assert f.read().startswith(PNG)
+    assert not [n for n in os.listdir('./data/charts') if not n.endswith('.png')]
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import dedup
+
+
+def responses(*rows):
+    """(time, distinct_id, hospital_id, answer) tuples as a time-indexed frame."""
+    times, ids, hospital_ids, answers = zip(*rows)
+    return pd.DataFrame({'distinct_id': ids, 'hospital_id': hospital_ids,
+                         'answer': answers},
+                        index=pd.DatetimeIndex(times, name='time'))
+
+
+def run(deduplicator, *chunks):
+    out = [deduplicator.push(chunk) for chunk in chunks] + [deduplicator.flush()]
+    return pd.concat(out)
+
+
+def test_latest_per_day():
+    df = responses(('2020-05-01 09:00', 'a', 1, 'first'),
+                   ('2020-05-01 17:00', 'a', 1, 'last'),
+                   ('2020-05-01 10:00', 'a', 2, 'other hospital'),
+                   ('2020-05-02 09:00', 'a', 1, 'next day'),
+                   ('2020-05-01 11:00', None, 1, 'unkeyed'),
+                   ('2020-05-01 12:00', None, 1, 'unkeyed'))
+    deduplicator = dedup.Deduplicator('latest-per-day')
+    out = run(deduplicator, df)
+    assert sorted(out['answer']) == ['last', 'next day', 'other hospital',
+                                     'unkeyed', 'unkeyed']
+    assert deduplicator.collapsed == 1
+
+
+def test_burst():
+    df = responses(('2020-05-01 09:00', 'a', 1, 'run 1'),
+                   ('2020-05-01 09:10', 'a', 1, 'run 1 end'),
+                   ('2020-05-01 09:40', 'a', 1, 'run 2'))
+    out = run(dedup.Deduplicator('burst'), df)
+    assert out['answer'].tolist() == ['run 1 end', 'run 2']
+
+
+def test_days_are_emitted_once_and_whole():
+    # Day one stays open for late responses until a day past the lateness arrives
+    deduplicator = dedup.Deduplicator('latest-per-day', lateness_days=1)
+    first = deduplicator.push(responses(('2020-05-01 09:00', 'a', 1, 'early'),
+                                        ('2020-05-02 09:00', 'b', 1, 'x')))
+    assert first.empty
+    closed = deduplicator.push(responses(('2020-05-01 18:00', 'a', 1, 'late'),
+                                         ('2020-05-03 09:00', 'c', 1, 'y')))
+    assert closed['answer'].tolist() == ['late']
+    assert deduplicator.flush()['answer'].tolist() == ['x', 'y']
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        dedup.Deduplicator('newest')
+
+
+def test_repeats_collapse_across_chunks_and_seeded_rows():
+    deduplicator = dedup.Deduplicator('latest-per-day')
+    # Responses stored by an earlier run are returned with their day
+    deduplicator.seed(responses(('2020-05-01 09:00', 'a', 1, 'stored'),
+                                ('2020-05-01 09:30', 'b', 1, 'stored')))
+    out = run(deduplicator,
+              responses(('2020-05-01 12:00', 'a', 1, 'first chunk')),
+              responses(('2020-05-01 15:00', 'a', 1, 'second chunk')))
+    assert out['answer'].tolist() == ['stored', 'second chunk']
+    assert out['distinct_id'].tolist() == ['b', 'a']
+    assert deduplicator.collapsed == 2
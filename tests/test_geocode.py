@@ -0,0 +1,75 @@
+import time
+
+import pandas as pd
+
+import geocode
+
+
+class Provider(object):
+    """Answers from a dict of Places, failing for names it is given as errors."""
+
+    rate_limited = False
+
+    def __init__(self, places, errors=()):
+        self.places = places
+        self.errors = set(errors)
+        self.calls = []
+
+    def __call__(self, name):
+        self.calls.append(name)
+        if name in self.errors:
+            raise geocode.GeocodeError(name)
+        return self.places.get(name)
+
+
+def test_lookups_are_cached(tmp_path):
+    location = str(tmp_path / 'cache.csv')
+    provider = Provider({'Royal Infirmary': geocode.Place(55.9, -3.1, 'Edinburgh', 'hospital'),
+                         'Paris Clinic': geocode.Place(48.9, 2.3, 'Paris', 'clinic'),
+                         'Royal Pub': geocode.Place(51.5, -0.1, 'London', 'pub')},
+                        errors=['Flaky Hospital'])
+    geocoder = geocode.Geocoder(provider, geocode.GeocodeCache(location), workers=2)
+    names = ['Royal Infirmary', ' royal infirmary ', 'Paris Clinic', 'Royal Pub',
+             'Nowhere Hospital', 'Flaky Hospital', 'SG Test 2', 'INHC Triage Space']
+    found = geocoder.lookup(names)
+    assert list(found) == ['Royal Infirmary']
+    assert sorted(provider.calls) == ['Flaky Hospital', 'Nowhere Hospital', 'Paris Clinic',
+                                      'Royal Infirmary', 'Royal Pub']
+    assert geocoder.stats == {'ignored': 2, 'cached': 0, 'found': 1, 'rejected': 2,
+                              'not_found': 3, 'failed': 1}
+
+    # Only the failed lookup is tried again, also once the cache is reloaded
+    provider.calls = []
+    geocoder = geocode.Geocoder(provider, geocode.GeocodeCache(location))
+    assert list(geocoder.lookup(names)) == ['Royal Infirmary']
+    assert provider.calls == ['Flaky Hospital']
+
+
+def test_names_not_found_expire(tmp_path):
+    location = str(tmp_path / 'cache.csv')
+    cache = geocode.GeocodeCache(location)
+    cache.put('Nowhere Hospital', None)
+    cache.save()
+    assert 'nowhere hospital' in geocode.GeocodeCache(location)
+    assert 'Nowhere Hospital' not in geocode.GeocodeCache(location, negative_ttl_days=0)
+    assert geocode.GeocodeCache(location).get('Nowhere Hospital') is None
+
+
+def test_rate_limiter_spaces_calls():
+    limiter = geocode.RateLimiter(20)
+    started = time.monotonic()
+    for _ in range(5):
+        limiter.wait()
+    assert time.monotonic() - started >= 4 / 20.0
+    started = time.monotonic()
+    geocode.RateLimiter(0).wait()
+    assert time.monotonic() - started < 0.05
+
+
+def test_local_provider():
+    provider = geocode.LocalProvider(pd.DataFrame({'hospital': ['Royal Infirmary'],
+                                                   'lat': [55.9], 'lon': [-3.1]}))
+    place = provider('ROYAL  infirmary')
+    assert (place.lat, place.lon, place.kind) == (55.9, -3.1, 'hospital')
+    assert geocode.acceptable(place)
+    assert provider('Elsewhere') is None and provider.calls == 2
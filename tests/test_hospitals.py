@@ -0,0 +1,57 @@
+import pandas as pd
+
+import geocode
+import hospitals
+
+
+def index(*names):
+    sites = pd.DataFrame({'hospital': list(names), 'lat': [51.0 + i for i in range(len(names))],
+                          'lon': [-1.0] * len(names)})
+    aliases = pd.DataFrame({'alias': ['UCLH'], 'hospital': ['University College Hospital']})
+    return hospitals.HospitalIndex(sites, aliases)
+
+
+def test_resolve():
+    hospital_index = index("St George's (London)", 'Queen Alexandra Hospital',
+                           'University College Hospital', 'Guys')
+    ids = hospital_index.resolve(["st georges london", 'UCLH',
+                                  'Emergency Department - Queen Alexandra Hospital',
+                                  'Queen Alexandra Hospitals', 'Guys', 'Guy', 'Nowhere', None])
+    assert ids.tolist() == [0, 2, 1, 1, 3, -1, -1, -1]
+    lat, _ = hospital_index.coordinates(ids)
+    assert lat[:2].tolist() == [51.0, 53.0] and pd.isna(lat[-1])
+    assert hospital_index.categorical(ids[:2]).tolist() == \
+        ["St George's (London)", 'University College Hospital']
+
+
+def test_extend_matches_names_unmatched_before():
+    hospital_index = index('Queen Alexandra Hospital')
+    assert hospital_index.resolve_name('Lewisham Hospital') == hospitals.UNMATCHED
+    hospital_index.extend(pd.DataFrame({'hospital': ['Lewisham Hospital'], 'lat': [51.5],
+                                        'lon': [0.0]}, index=[1]))
+    assert hospital_index.resolve_name('Lewisham Hospital') == 1
+    assert len(hospital_index) == 2
+
+
+def test_sync_keeps_ids(workdir):
+    copy = './data/merged/' + hospitals.DIMENSION_FILE
+    hospitals.sync(copy)
+    before = hospitals.load(copy)
+    original = pd.read_csv(hospitals.HOSPITALS_LOCATION)
+
+    # The source is reordered, loses a site and gains one
+    source = pd.concat([original.iloc[1:].iloc[::-1],
+                        pd.DataFrame({'hospital': ['Northwick Park Annexe'], 'lat': [51.5],
+                                      'lon': [0.0]})])
+    source.to_csv(hospitals.HOSPITALS_LOCATION, index=False)
+    added = hospitals.sync(copy)
+    assert added.index.tolist() == [len(before)]
+    added = hospitals.add_sites({'Geocoded Hospital': geocode.Place(52.0, -2.0, '', 'hospital')},
+                                copy)
+    assert added.index.tolist() == [len(before) + 1]
+
+    after = hospitals.load(copy)
+    assert after.names[:len(before)].tolist() == before.names.tolist()
+    assert after.resolve_name('Northwick Park Annexe') == len(before)
+    assert after.resolve_name('Geocoded Hospital') == len(before) + 1
+    assert hospitals.sync(copy).empty
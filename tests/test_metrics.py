@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+import metrics
+
+
+def test_run_log_and_metrics_file(tmp_path):
+    log, prom = str(tmp_path / 'run-log.jsonl'), str(tmp_path / 'metrics.prom')
+    with pytest.raises(RuntimeError):
+        with metrics.Run('test', log, prom) as run:
+            run.set(mode='full')
+            with run.stage('fetch'):
+                run.downloaded(100)
+            for _ in run.timed_iter('fetch', [[1, 2], [3]]):
+                pass
+            run.count('transform', 'in', 3)
+            run.add('transform', 0.5, {'out': 2, 'dropped_non_gb': 1})
+            with run.stage('transform'):
+                raise RuntimeError('failed')
+
+    with open(log) as f:
+        entry = json.loads(f.readline())
+    assert entry['component'] == 'test' and entry['status'] == 'failed'
+    assert entry['mode'] == 'full' and entry['bytes_downloaded'] == 100
+    stages = {s['stage']: s for s in entry['stages']}
+    assert list(stages) == ['fetch', 'transform']
+    assert stages['fetch']['rows'] == {'out': 3}
+    assert stages['transform']['rows'] == {'in': 3, 'out': 2, 'dropped_non_gb': 1}
+    assert stages['transform']['seconds'] >= 0.5
+
+    with open(prom) as f:
+        text = f.read()
+    assert 'ppe_rows_total{component="test",kind="dropped_non_gb",stage="transform"} 1.0' \
+        in text
+    assert 'ppe_last_run_timestamp_seconds{component="test",status="failed"}' in text
+
+
+def test_startup_is_recorded_once(tmp_path):
+    log = str(tmp_path / 'startup-log.jsonl')
+    startup = metrics.Startup(log, release='v1')
+    with startup.phase('load_data'):
+        pass
+    startup.add('imports', 1.5, version='a')
+    entry = startup.finish()
+    assert entry['release'] == 'v1' and entry['version'] == 'a'
+    assert list(entry['phases']) == ['load_data', 'imports']
+
+    # Later reruns change nothing
+    startup.add('imports', 9.0)
+    assert startup.finish() is None
+    with open(log) as f:
+        assert len(f.readlines()) == 1
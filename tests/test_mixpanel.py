@@ -0,0 +1,227 @@
+import datetime
+import json
+
+import pandas as pd
+import pytest
+
+import mixpanel as mp
+from benchmarks.server import KEYS
+
+
+START, END = '2020-04-22', '2020-05-20'
+COLUMNS = ['time', 'hospital', 'mp_country_code', 'sufficient-supply', 'distinct_id']
+
+
+def as_strings(df):
+    # Batches and shards each have their own categories
+    for col in mp.CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype(str)
+    return df
+
+
+def export_lines(*events):
+    # Events without a time are a second apart
+    return [json.dumps({'event': 'ppe', 'properties': dict({'time': 1588000000 + i}, **p)})
+            .encode('utf-8') for i, p in enumerate(events)]
+
+
+# Decoding
+
+def test_columns_decode_as_records_do():
+    lines = export_lines({'time': 1588000000, 'distinct_id': 'a', 'hospital': 'X',
+                          'sufficient-supply': True, 'mp_country_code': 'GB'},
+                         {'time': 1588003600, 'distinct_id': 'b', 'hospital': 'Y',
+                          'sufficient-supply': False}) + \
+        [b'not json', b''] + \
+        export_lines({'time': 1588007200.5, 'distinct_id': 'c', 'sufficient-supply': None})
+    requested = ['distinct_id', 'hospital', 'sufficient-supply', 'mp_country_code']
+    columns = mp._export_to_df(lines, requested, False)
+    records = mp._export_to_df(lines, None, False)
+    assert sorted(records) == sorted(requested + ['time', 'event'])
+    pd.testing.assert_frame_equal(columns, records[columns.columns])
+
+    assert columns['distinct_id'].tolist() == ['a', 'b', 'c']
+    assert columns['hospital'].dtype == 'category'
+    assert columns['hospital'].isna().tolist() == [False, False, True]
+    # Naive local times, as datetime.fromtimestamp gives
+    assert columns['time'].tolist() == [
+        datetime.datetime.fromtimestamp(t) for t in [1588000000, 1588003600, 1588007200.5]]
+
+
+def test_answers_decode_as_booleans():
+    lines = export_lines({'time': 1588000000, 'sufficient-supply': True},
+                         {'time': 1588000001, 'sufficient-supply': False})
+    df = mp._export_to_df(lines, ['sufficient-supply'], True)
+    assert df['sufficient-supply'].dtype == bool
+
+
+def test_decoded_batches():
+    lines = export_lines(*[{'time': 1588000000 + i, 'distinct_id': str(i)}
+                           for i in range(5)])
+    batches = list(mp._decode_batches(lines, ['time', 'distinct_id'], True, chunksize=2))
+    assert [batch.index.tolist() for batch in batches] == [[0, 1], [2, 3], [4]]
+    assert pd.concat(batches)['distinct_id'].tolist() == ['0', '1', '2', '3', '4']
+
+
+# Streamed exports
+
+@pytest.mark.parametrize('shard', [None, 'week'])
+def test_batches_cover_the_export(export_server, shard):
+    export_server(300)
+    whole = mp.read_events(KEYS, start=START, end=END, columns=COLUMNS, exclude_mp=False)
+    batches = list(mp.iter_events(KEYS, start=START, end=END, columns=COLUMNS,
+                                  exclude_mp=False, chunksize=7, shard=shard))
+    assert all(0 < len(batch) <= 7 for batch in batches)
+    if shard is None:
+        assert [len(batch) for batch in batches[:-1]] == [7] * (len(batches) - 1)
+    # A continuous index across batches, as read_csv gives
+    streamed = pd.concat(batches)
+    assert streamed.index.tolist() == list(range(len(whole)))
+    pd.testing.assert_frame_equal(as_strings(streamed), as_strings(whole),
+                                  check_index_type=False)
+
+
+def test_chunksize_must_be_positive():
+    with pytest.raises(ValueError):
+        next(mp.iter_events(KEYS, chunksize=0))
+
+
+# Sharded exports
+
+def test_date_shards():
+    assert mp._date_shards('2020-04-22', '2020-05-05', 'week') == \
+        [('2020-04-22', '2020-04-28'), ('2020-04-29', '2020-05-05')]
+    assert mp._date_shards('2020-04-22', '2020-04-30', 'week') == \
+        [('2020-04-22', '2020-04-28'), ('2020-04-29', '2020-04-30')]
+    assert mp._date_shards('2020-04-22', '2020-04-22', 'day') == \
+        [('2020-04-22', '2020-04-22')]
+    with pytest.raises(ValueError):
+        mp._date_shards('2020-04-22', '2020-04-30', 'month')
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_shards_match_a_single_export(export_server, workers):
+    export_server(3000)
+    whole = mp.read_events(KEYS, start=START, end=END, columns=COLUMNS, exclude_mp=False)
+    sharded = mp.read_events(KEYS, start=START, end=END, columns=COLUMNS,
+                             exclude_mp=False, shard='day', workers=workers)
+    assert len(whole) > 1000
+    # Categories are unified across shards rather than lost in the merge
+    for col in mp.CATEGORICAL_COLUMNS:
+        assert isinstance(sharded[col].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(as_strings(sharded), as_strings(whole))
+
+
+# Filters
+
+def test_where_expression():
+    assert mp.where_expression([('mp_country_code', '==', 'GB')]) == \
+        'properties["mp_country_code"] == "GB"'
+    assert mp.where_expression([('hospital', 'in', ['A', 'B']), ('count', '>=', 2)]) == \
+        '(properties["hospital"] == "A" or properties["hospital"] == "B")' \
+        ' and properties["count"] >= 2'
+    assert mp.where_expression([('hospital', 'not in', ['A', 'B'])]) == \
+        '(properties["hospital"] != "A" and properties["hospital"] != "B")'
+
+
+def test_where_expression_rejects_unknown_operators():
+    with pytest.raises(ValueError):
+        mp.where_expression([('hospital', 'like', 'A')])
+
+
+def test_filter_mask():
+    df = pd.DataFrame({'country': ['GB', 'FR', None], 'count': ['3', 1, None]})
+    assert mp.filter_mask(df, [('country', '==', 'GB')]).tolist() == [True, False, False]
+    assert mp.filter_mask(df, [('country', 'not in', ['GB'])]).tolist() == [False, True, True]
+    assert mp.filter_mask(df, [('count', '>', 2)]).tolist() == [True, False, False]
+    assert mp.filter_mask(df, [('country', '!=', 'FR'), ('count', '<=', 3)]).tolist() == \
+        [True, False, False]
+
+
+def test_filter_mask_missing_property():
+    # Matches only != and not in, as Mixpanel's where does
+    df = pd.DataFrame({'country': ['GB', 'FR']})
+    assert mp.filter_mask(df, [('missing', '==', 'GB')]).tolist() == [False, False]
+    assert mp.filter_mask(df, [('missing', '!=', 'GB')]).tolist() == [True, True]
+    assert mp.filter_mask(df, [('missing', 'not in', ['GB'])]).tolist() == [True, True]
+
+
+@pytest.mark.parametrize('exclude_mp', [True, False])
+def test_filters_on_excluded_properties(exclude_mp):
+    lines = export_lines({'distinct_id': 'a', 'mp_country_code': 'GB', '$os': 'iOS'},
+                         {'distinct_id': 'b', 'mp_country_code': 'FR', '$os': 'iOS'},
+                         {'distinct_id': 'c', 'mp_country_code': 'GB', '$os': 'Android'})
+    filters = [('mp_country_code', '==', 'GB'), ('$os', '==', 'iOS')]
+    df = mp._export_to_df(lines, None, exclude_mp, filters=filters)
+    assert df['distinct_id'].tolist() == ['a']
+    assert ('mp_country_code' in df) != exclude_mp
+    assert ('$os' in df) != exclude_mp
+
+
+def test_filters_on_properties_not_requested():
+    lines = export_lines({'distinct_id': 'a', 'mp_country_code': 'GB'},
+                         {'distinct_id': 'b', 'mp_country_code': 'FR'})
+    df = mp._export_to_df(lines, ['distinct_id'], True,
+                          filters=[('mp_country_code', '==', 'FR')])
+    assert df['distinct_id'].tolist() == ['b']
+    assert list(df.columns) == ['distinct_id', 'time']
+
+
+def test_filters_are_pushed_down(export_server):
+    server = export_server(1000)
+    filters = [('mp_country_code', '==', 'GB'), ('$os', 'not in', ['Android'])]
+    local = mp.read_events(KEYS, start=START, end=END, columns=['distinct_id'],
+                           filters=filters, pushdown=False)
+    sent = server.bytes_sent
+    pushed = mp.read_events(KEYS, start=START, end=END, columns=['distinct_id'],
+                            filters=filters)
+    assert 0 < len(pushed) < 1000
+    pd.testing.assert_frame_equal(pushed, local)
+    # Only the matching events were sent
+    assert server.bytes_sent - sent < 0.75 * sent
+
+
+# Response cache
+
+def test_response_cache_key_ignores_signature():
+    cache = mp.ResponseCache('unused')
+    params = {'from_date': '2020-05-01', 'to_date': '2020-05-02', 'event': '["ppe"]'}
+    key = cache.key(['export'], dict(params, api_key='k', expire=1, sig='a'))
+    assert key == cache.key(['export'], dict(params, api_key='k', expire=2, sig='b'))
+    assert key == cache.key(['export'], params)
+    assert key != cache.key(['export'], dict(params, to_date='2020-05-03'))
+    assert key != cache.key(['export'], params, format='csv')
+    assert key != cache.key(['export'], params, data_api=True)
+
+
+def test_past_exports_are_served_from_the_cache(export_server, tmp_path):
+    server = export_server(300)
+    cache = mp.ResponseCache(str(tmp_path / 'cache'))
+    first = mp.read_events(KEYS, start=START, end=END, columns=COLUMNS, cache=cache,
+                           shard='week')
+    requests = server.requests
+    again = mp.read_events(KEYS, start=START, end=END, columns=COLUMNS, cache=cache,
+                           shard='week')
+    assert server.requests == requests
+    pd.testing.assert_frame_equal(as_strings(again), as_strings(first))
+    # Streamed reads of the same shards are served from the same entries
+    streamed = mp.iter_events(KEYS, start=START, end=END, columns=COLUMNS, cache=cache,
+                              shard='week', chunksize=50)
+    assert sum(len(batch) for batch in streamed) == len(first)
+    assert server.requests == requests
+
+
+def test_only_days_before_yesterday_are_cached(tmp_path):
+    cache = mp.ResponseCache(str(tmp_path))
+    today = datetime.date.today()
+    assert cache.cacheable({'to_date': (today - datetime.timedelta(2)).isoformat()})
+    assert not cache.cacheable({'to_date': (today - datetime.timedelta(1)).isoformat()})
+    assert not cache.cacheable({})
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = mp.ResponseCache(str(tmp_path), max_bytes=1)
+    cache.put('aa1', b'x' * 1000)
+    cache.put('bb2', b'y' * 1000)
+    cache.evict()
+    assert cache.get('aa1') is None
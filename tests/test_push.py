@@ -0,0 +1,92 @@
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+import push
+import rollups
+import scheduler
+import store
+
+
+def events(count, hours_ago=1, first=0):
+    now = int(time.time()) - hours_ago * 3600
+    return [json.dumps({'event': scheduler.EVENT, 'properties': {
+        'time': now + i, 'distinct_id': 'clinician-%d' % (first + i),
+        'mp_country_code': 'GB', 'hospital': 'Southampton General Hospital', 'sufficient-supply': i % 2 == 0}})
+        .encode('utf-8') for i in range(count)]
+
+
+@pytest.fixture
+def published(workdir):
+    """An empty published version, as left by a first ingest."""
+    path = store.stage()
+    root, rollup_root, chart_root, snapshot_file = scheduler._outputs(path)
+    store.publish(path, store=root, rollups=rollup_root, charts=chart_root,
+                  snapshot=snapshot_file, last_day='2020-06-24', raw_rows=0, raw_bytes=0)
+    return path
+
+
+def stored_total():
+    return int(rollups.load(rollups.DAILY, store.current()['rollups'])['total'].sum())
+
+
+def test_replayed_events_are_stored_once(published):
+    pusher = push.Pusher()
+    lines = events(5)
+    assert pusher.add(lines + lines[:1]) == {'accepted': 6, 'ignored': 0, 'stale': 0,
+                                             'invalid': 0}
+    assert pusher.flush() == 5
+    version = store.version()
+    assert stored_total() == 5
+
+    # Replays, to this process or a restarted one, publish nothing
+    pusher.add(lines[:3])
+    assert pusher.flush() == 0
+    restarted = push.Pusher()
+    restarted.add(lines)
+    assert restarted.flush() == 0
+    assert store.version() == version and stored_total() == 5
+
+    restarted.add(lines + events(2, first=5))
+    assert restarted.flush()
+    assert stored_total() == 7
+
+
+def test_events_wait_for_a_published_version(workdir):
+    pusher = push.Pusher()
+    pusher.add(events(2))
+    assert pusher.flush() == 0 and pusher.buffered == 2
+
+
+def test_add_sorts_lines():
+    pusher = push.Pusher(max_buffer=3)
+    stale = events(1, hours_ago=24 * (push.LOOKBACK_DAYS + 1))
+    other = [json.dumps({'event': 'other', 'properties': {'time': time.time(),
+                                                          'distinct_id': 'a'}}).encode()]
+    assert pusher.add(events(2) + stale + other + [b'{', b'']) == \
+        {'accepted': 2, 'ignored': 1, 'stale': 1, 'invalid': 1}
+    with pytest.raises(push.BufferFull):
+        pusher.add(events(2))
+    assert pusher.buffered == 2
+
+
+def test_server(published):
+    pusher = push.Pusher()
+    server = push.PushServer(pusher, port=0, host='127.0.0.1', token='secret')
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        body = b'\n'.join(events(3))
+        refused = requests.post(server.url, data=body)
+        assert refused.status_code == 401
+        accepted = requests.post(server.url, data=body,
+                                 headers={'Authorization': 'Bearer secret'})
+        assert accepted.status_code == 202 and accepted.json()['accepted'] == 3
+        assert requests.get(server.url.replace('/events', '/health')).json()['buffered'] == 3
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
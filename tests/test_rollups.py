@@ -0,0 +1,68 @@
+import datetime
+import os
+
+import pandas as pd
+
+import rollups
+import scheduler
+import sketches
+import store
+
+
+def responses(*rows):
+    """(time, hospital_id, answer, distinct_id) tuples as a store frame."""
+    times, hospital_ids, answers, ids = zip(*rows)
+    return pd.DataFrame({'hospital_id': hospital_ids, 'sufficient-supply': answers,
+                         'distinct_id': ids},
+                        index=pd.DatetimeIndex(times, name='time'))
+
+
+def test_update_matches_build(workdir):
+    root = './data/merged'
+    store.write(responses(('2020-05-01 09:00', 0, True, 'a'),
+                          ('2020-05-01 10:00', 1, False, 'b'),
+                          ('2020-05-02 09:00', 0, False, 'a')), root)
+    rollups.build(root, './data/updated')
+
+    # Day two is replaced and day three is new
+    store.write(responses(('2020-05-02 11:00', 1, True, 'c'),
+                          ('2020-05-02 12:00', 1, True, 'd'),
+                          ('2020-05-03 09:00', 2, False, 'a')), root)
+    rollups.update(['2020-05-02', '2020-05-03'], root, './data/updated')
+    rollups.build(root, './data/built')
+
+    for name in [rollups.CUBE, rollups.DAILY, rollups.HOSPITALS, rollups.CELLS]:
+        pd.testing.assert_frame_equal(rollups.load(name, './data/updated'),
+                                      rollups.load(name, './data/built'))
+    pd.testing.assert_frame_equal(sketches.load('./data/updated'),
+                                  sketches.load('./data/built'))
+    by_day = rollups.load(rollups.DAILY, './data/updated')
+    assert by_day['day_month'].tolist() == ['2020-05-01', '2020-05-02', '2020-05-03']
+    assert by_day['total'].tolist() == [2, 2, 1]
+
+
+def test_empty_rollups_keep_their_columns(workdir):
+    cube = rollups.empty_cube()
+    assert list(rollups.daily(cube)) == ['day_month', 'sufficient', 'insufficient',
+                                         'total', 'proportion-negative',
+                                         'proportion-positive']
+    assert 'proportion-positive' in rollups.by_hospital(cube)
+    assert 'proportion-positive' in rollups.cells(cube)
+
+    # Also before anything is written, and once written with no rows
+    for name in [rollups.CUBE, rollups.DAILY, rollups.HOSPITALS, rollups.CELLS]:
+        assert 'total' in rollups.load(name, './data/rollups')
+    rollups.build('./data/merged', './data/rollups')
+    by_day = rollups.load(rollups.DAILY, './data/rollups')
+    assert by_day.empty and by_day['total'].sum() == 0
+
+
+def test_empty_ingest_publishes(export_server):
+    export_server(0)
+    scheduler.full_ingest(datetime.date(2020, 5, 20))
+
+    manifest = store.current()
+    assert manifest['raw_rows'] == 0
+    assert rollups.load(rollups.DAILY, manifest['rollups']).empty
+    assert sorted(os.listdir(manifest['charts'])) == \
+        ['heatmap.png', 'ranking.png', 'sentiment.png', 'totals.png', 'trend.png']
@@ -0,0 +1,118 @@
+import datetime
+import os
+
+import pandas as pd
+import pytest
+
+import metrics
+import rollups
+import scheduler
+import store
+
+
+FIRST_END = datetime.date(2020, 5, 10)
+END = datetime.date(2020, 5, 20)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_failed_run_leaves_published_data(export_server, monkeypatch):
+    export_server(3000)
+    scheduler.full_ingest(FIRST_END)
+    state = store.current()
+    raw = read(scheduler.DATA_LOCATION)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError('rollups failed')
+    monkeypatch.setattr(rollups, 'update', fail)
+    with pytest.raises(RuntimeError):
+        scheduler.incremental_ingest(FIRST_END, END, state)
+
+    assert store.current() == state
+    assert read(scheduler.DATA_LOCATION) == raw
+    assert not os.path.exists(scheduler.DATA_LOCATION + '.tmp')
+    assert os.listdir(store.VERSIONS_LOCATION) == [state['version']]
+
+
+def test_raw_csv_is_swapped_in_on_publish(export_server):
+    export_server(3000)
+    scheduler.full_ingest(FIRST_END)
+    state = store.current()
+    raw = read(scheduler.DATA_LOCATION)
+    inode = os.stat(scheduler.DATA_LOCATION).st_ino
+
+    scheduler.incremental_ingest(FIRST_END, END, state)
+    published = store.current()
+    assert published['version'] != state['version']
+    assert read(scheduler.DATA_LOCATION).startswith(raw)
+    assert os.path.getsize(scheduler.DATA_LOCATION) == published['raw_bytes'] > len(raw)
+    # A reader holding the old file still sees it whole
+    assert os.stat(scheduler.DATA_LOCATION).st_ino != inode
+
+
+def test_incremental_matches_full(export_server):
+    export_server(3000)
+    scheduler.full_ingest(END)
+    stored = store.read(store.current()['store'])
+    raw = scheduler.raw_keys(scheduler.START_DATE)
+
+    scheduler.full_ingest(FIRST_END)
+    scheduler.incremental_ingest(FIRST_END, END, store.current())
+    state = store.current()
+    pd.testing.assert_frame_equal(store.read(state['store']), stored)
+    assert scheduler.raw_keys(scheduler.START_DATE) == raw
+    assert state['raw_rows'] == len(raw)
+    # Reading from the recorded offsets finds the same overlap days
+    assert scheduler.raw_keys(FIRST_END, state) == scheduler.raw_keys(FIRST_END)
+    assert len(scheduler.raw_keys(FIRST_END)) > 0
+
+
+def test_incremental_after_empty_ingest(export_server):
+    export_server(0)
+    scheduler.full_ingest(FIRST_END)
+    assert scheduler.raw_keys(FIRST_END, store.current()) == set()
+
+    export_server(3000)
+    scheduler.incremental_ingest(FIRST_END, END, store.current())
+    raw = pd.read_csv(scheduler.DATA_LOCATION, index_col=0)
+    assert len(raw) == store.current()['raw_rows'] > 0
+    assert set(scheduler.DEDUPE_KEYS) <= set(raw.columns)
+
+
+def test_ingest_lock(workdir):
+    with scheduler.ingest_lock('./data/test.lock') as locked:
+        assert locked
+        with scheduler.ingest_lock('./data/test.lock') as again:
+            assert not again
+    with scheduler.ingest_lock('./data/test.lock') as locked:
+        assert locked
+
+
+def test_replace_file_keeps_the_old_file_on_failure(workdir):
+    path = './data/output.txt'
+    store.replace_file(path, lambda f: f.write('old'))
+
+    def write(f):
+        f.write('partial')
+        raise ValueError('writer failed')
+    with pytest.raises(ValueError):
+        store.replace_file(path, write)
+    assert read(path) == b'old'
+    assert os.listdir('./data').count('output.txt') == 1
+    assert not [name for name in os.listdir('./data') if name.endswith('.tmp')]
+
+
+def test_transform_in_processes(export_server, monkeypatch):
+    export_server(3000)
+    monkeypatch.setattr(scheduler, 'CHUNKSIZE', 500)
+    for processes in [0, 2]:
+        # Shards are still being downloaded by threads as the workers start
+        chunks = scheduler.fetch(pd.to_datetime(scheduler.START_DATE), END)
+        scheduler.ingest(chunks, metrics.Run('scheduler', None, None),
+                         './data/%d' % processes, processes=processes)
+    serial, parallel = store.read('./data/0'), store.read('./data/2')
+    assert len(serial) > 1000
+    pd.testing.assert_frame_equal(serial, parallel)
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import sketches
+
+
+def test_ranks():
+    # Rank is one more than the leading zeros of the bits after the register
+    tail = 64 - sketches.PRECISION
+    hashes = np.array([(5 << tail) | (1 << (tail - 1)), (7 << tail) | 1, 9 << tail],
+                      dtype=np.uint64)
+    registers, ranks = sketches.registers_and_ranks(hashes)
+    assert registers.tolist() == [5, 7, 9]
+    assert ranks.tolist() == [1, tail, tail + 1]
+
+
+@pytest.mark.parametrize('count', [300, 100000])
+def test_estimate_within_error(count):
+    registers, ranks = sketches.registers_and_ranks(
+        sketches.hash_ids(['clinician-%d' % i for i in range(count)]))
+    full = np.zeros(sketches.REGISTERS, dtype=np.uint8)
+    np.maximum.at(full, registers.astype(np.intp), ranks)
+    assert abs(sketches.estimate(full) - count) <= 4 * sketches.STANDARD_ERROR * count
+
+
+def test_clinicians_merge_days_and_hospitals():
+    ids = ['clinician-%d' % i for i in range(200)]
+    days = pd.to_datetime(['2020-05-01'] * 100 + ['2020-05-02'] * 100)
+    df = pd.DataFrame({'distinct_id': ids[:100] + ids[50:150],
+                       'hospital_id': [1] * 150 + [2] * 50}, index=days)
+    clinicians = sketches.Clinicians(sketches.build(df))
+    # Linear counting is within a couple of clinicians at these sizes, and
+    # clinicians seen on both days are counted once, not twice
+    assert abs(clinicians.count() - 150) <= 2
+    assert abs(clinicians.count('2020-05-02', '2020-05-02') - 100) <= 2
+    assert abs(clinicians.count(hospital_ids=[2]) - 50) <= 2
+    assert clinicians.count('2020-05-03') == 0
+
+
+def test_merge_replaces_days_and_saves(tmp_path):
+    def clinicians(day, ids):
+        return sketches.build(pd.DataFrame({'distinct_id': ids, 'hospital_id': 1},
+                                           index=pd.to_datetime([day] * len(ids))))
+
+    stored = sketches.merge([clinicians('2020-05-01', ['a', 'b']),
+                             clinicians('2020-05-02', ['a', 'c', 'd'])])
+    # Day two is recounted with fewer clinicians
+    merged = sketches.merge([stored, clinicians('2020-05-02', ['a'])],
+                            replace_days=['2020-05-02'])
+    sketches.save(merged, str(tmp_path))
+    loaded = sketches.load(str(tmp_path))
+    pd.testing.assert_frame_equal(loaded, merged, check_dtype=False)
+    counts = sketches.Clinicians(loaded)
+    assert counts.count() == 2
+    assert counts.count('2020-05-02', '2020-05-02') == 1
+    assert len(sketches.load(str(tmp_path / 'missing'))) == 0
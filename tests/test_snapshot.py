@@ -0,0 +1,52 @@
+import os
+import pickle
+import subprocess
+import sys
+
+import pandas as pd
+
+import rollups
+import snapshot
+import store
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_snapshot_holds_the_rollups(workdir):
+    df = pd.DataFrame({'hospital_id': [0, 1, 0], 'sufficient-supply': [True, False, False],
+                       'distinct_id': ['a', 'b', 'a']},
+                      index=pd.DatetimeIndex(['2020-05-01 09:00', '2020-05-01 10:00',
+                                              '2020-05-02 09:00'], name='time'))
+    store.write(df, './data/merged')
+    rollups.build('./data/merged', './data/rollups')
+    snapshot.build('./data/rollups', './data/snapshot.pickle')
+
+    contents = snapshot.load('./data/snapshot.pickle')
+    for name in snapshot.ROLLUPS:
+        table, day_index = contents['rollups'][name]
+        expected, expected_index = snapshot.read_rollup(name, './data/rollups')
+        pd.testing.assert_frame_equal(table, expected)
+        assert (day_index is None) == (expected_index is None)
+    by_day, day_index = contents['rollups'][rollups.DAILY]
+    assert by_day.iloc[day_index.day('2020-05-02')]['total'].tolist() == [1]
+    assert contents['clinicians'].count() == 2
+
+
+def test_unusable_snapshots_are_ignored(workdir):
+    assert snapshot.load(None) is None
+    assert snapshot.load('./data/missing.pickle') is None
+    with open('./data/truncated.pickle', 'wb') as f:
+        f.write(pickle.dumps({'format': snapshot.FORMAT})[:5])
+    assert snapshot.load('./data/truncated.pickle') is None
+    with open('./data/old.pickle', 'wb') as f:
+        pickle.dump({'format': snapshot.FORMAT - 1, 'rollups': {}}, f)
+    assert snapshot.load('./data/old.pickle') is None
+
+
+def test_dashboard_modules_import_without_plotting_libraries():
+    # The app imports these on a cold start; charts are drawn at ingest
+    code = ('import sys, charts, metrics, rollups, sketches, snapshot, spatial, store; '
+            'print([m for m in ("matplotlib", "seaborn", "pydeck") if m in sys.modules])')
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    assert out.strip() == b'[]'
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+
+import spatial
+
+
+def test_cells_round_to_the_nearest_centre():
+    q = np.array([0, 3, -2, 10])
+    r = np.array([0, -1, 5, -7])
+    lat, lon = spatial.centres(q, r)
+    got_q, got_r = spatial.cells(lat, lon)
+    assert got_q.tolist() == q.tolist() and got_r.tolist() == r.tolist()
+
+    # Points a little short of a corner stay in the cell
+    corner = 0.45 * spatial.CELL_SIZE_KM
+    got_q, got_r = spatial.cells(lat + corner / spatial.KM_PER_DEGREE_LAT, lon)
+    assert got_q.tolist() == q.tolist() and got_r.tolist() == r.tolist()
+
+
+def test_round_axial_keeps_cube_coordinates_valid():
+    rng = np.random.RandomState(0)
+    q, r = rng.uniform(-50, 50, 1000), rng.uniform(-50, 50, 1000)
+    rq, rr = spatial._round_axial(q, r)
+    # Rounded to a hexagon whose centre is within one cell of the point
+    distance = (np.abs(rq - q) + np.abs(rr - r) + np.abs((rq + rr) - (q + r))) / 2
+    assert (distance <= 1).all()
+    assert rq.dtype.kind == 'i' and rr.dtype.kind == 'i'
+
+
+def test_bin_counts_per_day_and_cell():
+    # Two sites a few hundred metres apart share a cell, a third is far away
+    counts = pd.DataFrame({'day_month': ['2020-05-01', '2020-05-01', '2020-05-01', '2020-05-02'],
+                           'hospital': ['A', 'B', 'C', 'A'],
+                           'lat': [51.500, 51.502, 53.0, 51.500],
+                           'lon': [-0.100, -0.101, -2.0, -0.100],
+                           'sufficient': [1, 2, 4, 8], 'insufficient': [0, 1, 0, 0],
+                           'total': [1, 3, 4, 8]})
+    binned = spatial.bin_counts(counts)
+    assert len(binned) == 3
+    assert binned.groupby('day_month')['total'].sum().tolist() == [8, 8]
+    assert sorted(binned.loc[binned['day_month'] == '2020-05-01', 'total']) == [4, 4]
+    lat, lon = spatial.centres(binned['q'].to_numpy(), binned['r'].to_numpy())
+    assert np.allclose(lat, binned['lat']) and np.allclose(lon, binned['lon'])
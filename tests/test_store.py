@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import hospitals
+import store
+
+
+def responses(*rows):
+    """(time, hospital_id, answer, distinct_id) tuples as a store frame."""
+    times, hospital_ids, answers, ids = zip(*rows)
+    return pd.DataFrame({'hospital_id': hospital_ids, 'sufficient-supply': answers,
+                         'distinct_id': ids},
+                        index=pd.DatetimeIndex(times, name='time'))
+
+
+ROWS = [('2020-05-01 17:00', 1, False, 'b'),
+        ('2020-05-01 09:00', 0, True, 'a'),
+        ('2020-05-02 09:00', 0, False, 'c'),
+        ('2020-05-04 12:00', 2, True, 'a')]
+
+
+def test_write_and_read(workdir):
+    root = './data/merged'
+    store.write(responses(*ROWS), root)
+    assert [str(d) for d in store.days(root)] == ['2020-05-01', '2020-05-02', '2020-05-04']
+    assert [str(d) for d in store.days(root, start='2020-05-02', end='2020-05-03')] == \
+        ['2020-05-02']
+
+    df = store.read(root)
+    assert list(df.columns) == store.COLUMNS
+    assert df.index.is_monotonic_increasing and len(df) == 4
+    assert df['distinct_id'].tolist() == ['a', 'b', 'c', 'a']
+    assert df['hospital_id'].dtype == np.int32 and df['sufficient-supply'].dtype == bool
+    # Categories of each day are unified rather than lost in the merge
+    assert isinstance(df['distinct_id'].dtype, pd.CategoricalDtype)
+    sites = hospitals.load().sites
+    assert df['hospital'].tolist() == sites['hospital'].iloc[[0, 1, 0, 2]].tolist()
+    assert df['lat'].tolist() == sites['lat'].iloc[[0, 1, 0, 2]].tolist()
+    assert df['day_month'].astype(str).tolist() == \
+        ['2020-05-01', '2020-05-01', '2020-05-02', '2020-05-04']
+    assert df['hour'].tolist() == [9, 17, 9, 12]
+
+    days = store.read(root, columns=['distinct_id'], start='2020-05-02')
+    assert list(days.columns) == ['distinct_id'] and days['distinct_id'].tolist() == ['c', 'a']
+    with pytest.raises(KeyError):
+        store.read(root, columns=['answer'])
+
+
+def test_days_are_replaced_or_extended(workdir):
+    root = './data/merged'
+    store.write(responses(*ROWS), root)
+    store.write(responses(('2020-05-01 10:00', 3, True, 'd')), root)
+    store.write(responses(('2020-05-02 11:00', 3, True, 'e')), root, append=True)
+    df = store.read(root, columns=['distinct_id'])
+    assert df['distinct_id'].tolist() == ['d', 'c', 'e', 'a']
+    assert not [name for name in os.listdir(root) if name.endswith('.tmp')]
+
+
+def test_read_empty_store(workdir):
+    df = store.read('./data/merged', columns=['hospital_id', 'hospital', 'day_month'])
+    assert df.empty and list(df.columns) == ['hospital_id', 'hospital', 'day_month']
+
+
+def test_day_index():
+    times = pd.to_datetime(['2020-05-01 09:00', '2020-05-01 17:00', '2020-05-02 09:00',
+                            '2020-05-05 12:00'])
+    day_index = store.DayIndex(times)
+    assert len(day_index) == 3
+    assert (str(day_index.first), str(day_index.last)) == ('2020-05-01', '2020-05-05')
+    assert day_index.day('2020-05-01') == slice(0, 2)
+    assert day_index.slice('2020-05-02', '2020-05-05') == slice(2, 4)
+    assert day_index.slice(end='2020-05-03') == slice(0, 3)
+    # Ranges between or outside the stored days are empty
+    assert day_index.day('2020-05-03') == slice(3, 3)
+    assert day_index.slice('2020-05-06') == slice(4, 4)
+    assert times[day_index.slice('2020-05-05', '2020-05-01')].empty
+    # Day strings, as in the rollups, index the same way
+    assert store.DayIndex(['2020-05-01', '2020-05-01', '2020-05-02']).day('2020-05-02') == \
+        slice(2, 3)
+    with pytest.raises(ValueError):
+        store.DayIndex(times[::-1])
+    assert store.DayIndex([]).first is None and store.DayIndex([]).slice() == slice(0, 0)
+
+
+def test_manifest_is_reloaded_when_published(workdir):
+    assert store.current() is None and store.version() is None
+    store.require(None)
+    first = store.stage()
+    store.publish(first, rollups='rollups')
+    manifest = store.current()
+    # Parsed once, then shared until the manifest file changes
+    assert store.current() is manifest
+    assert manifest['version'] == os.path.basename(first)
+
+    second = store.stage(first)
+    store.publish(second, rollups='rollups', raw_rows=1)
+    assert store.version() == os.path.basename(second)
+    assert store.current()['raw_rows'] == 1
+    store.require(store.version())
+    with pytest.raises(store.MissingVersion):
+        store.require('20200501T000000000000-1')
+
+
+def test_prune_keeps_recently_replaced_versions(workdir):
+    versions = './data/versions'
+    old = ['20200501T000000000000-1', '20200502T000000000000-1', '20200503T000000000000-1']
+    for name in old:
+        os.makedirs(os.path.join(versions, name))
+    store.prune(versions, count=2)
+    assert sorted(os.listdir(versions)) == old[1:]
+
+    # Versions replaced moments ago are kept for readers still using them
+    recent = [os.path.basename(store.stage(versions=versions)) for _ in range(3)]
+    store.prune(versions, keep=recent[-1], count=1)
+    assert sorted(os.listdir(versions)) == [old[-1]] + recent
+    store.prune(versions, keep=recent[-1], count=1, seconds=0)
+    assert os.listdir(versions) == recent[-1:]
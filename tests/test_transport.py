@@ -0,0 +1,95 @@
+import http.server
+import threading
+import traceback
+
+import pytest
+import requests
+
+import mixpanel as mp
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        status, headers = self.server.replies.pop(0) if self.server.replies else (200, {})
+        body = b'{"ok": true}'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    """A server answering with the (status, headers) queued in replies, then 200."""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.replies, server.paths = [], []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = 'http://127.0.0.1:%d/api/2.0/export/?api_key=SECRET&sig=SIGNATURE' \
+        % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def transport(**options):
+    return mp.Transport(**dict(dict(backoff=0.0), **options))
+
+
+def test_retries_and_honours_retry_after(server, monkeypatch):
+    delays = []
+    monkeypatch.setattr(mp.time, 'sleep', delays.append)
+    server.replies = [(503, {'Retry-After': '7'}), (429, {}), (200, {})]
+    response = transport(retries=3).get(server.url)
+    assert response.json() == {'ok': True}
+    assert len(server.paths) == 3
+    assert delays == [7.0, 0.0]
+
+
+def test_retry_after_is_capped():
+    assert transport(max_backoff=5.0)._delay(0, retry_after=600) == 5.0
+    assert 0 <= transport(backoff=1.0, max_backoff=3.0)._delay(10) <= 3.0
+
+
+def test_gives_up_after_retries(server, monkeypatch):
+    monkeypatch.setattr(mp.time, 'sleep', lambda seconds: None)
+    server.replies = [(500, {})] * 3
+    with pytest.raises(requests.HTTPError):
+        transport(retries=2).get(server.url)
+    assert len(server.paths) == 3
+
+
+def test_client_errors_are_not_retried(server):
+    server.replies = [(401, {})]
+    with pytest.raises(requests.HTTPError) as raised:
+        transport().get(server.url)
+    assert len(server.paths) == 1
+    assert raised.value.response.status_code == 401
+
+
+@pytest.mark.parametrize('status', [401, 503])
+def test_errors_leave_credentials_out(server, monkeypatch, status):
+    monkeypatch.setattr(mp.time, 'sleep', lambda seconds: None)
+    server.replies = [(status, {})] * 2
+    with pytest.raises(requests.HTTPError) as raised:
+        transport(retries=1).get(server.url)
+    logged = ''.join(traceback.format_exception(raised.type, raised.value, raised.tb))
+    assert '/api/2.0/export/' in logged
+    assert 'SECRET' not in logged and 'SIGNATURE' not in logged
+
+
+def test_connection_errors_leave_credentials_out(server):
+    url = server.url
+    server.shutdown()
+    server.server_close()
+    with pytest.raises(requests.ConnectionError) as raised:
+        transport(retries=0).get(url)
+    logged = ''.join(traceback.format_exception(raised.type, raised.value, raised.tb))
+    assert 'SECRET' not in logged and 'SIGNATURE' not in logged